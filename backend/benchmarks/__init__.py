@@ -0,0 +1,10 @@
+'''
+Benchmarks for the trivia API.
+
+Run them from the backend directory, e.g.
+
+    python -m benchmarks.pagination
+
+By default they run against a throwaway SQLite database so no Postgres
+server is needed; pass --database to point them at a real one.
+'''
@@ -0,0 +1,73 @@
+'''
+Throughput in rows/sec of POST /questions/bulk (NDJSON and CSV) and
+GET /questions/export, next to one POST /questions per row.
+'''
+import argparse
+import json
+import random
+import time
+
+from .common import make_app, reset, seed, synthetic_question
+
+
+def make_rows(count, rng):
+  return [{
+    'question': synthetic_question(rng),
+    'answer': 'Answer {}'.format(n),
+    'difficulty': rng.randint(1, 5),
+    'category': rng.randint(1, 6)
+  } for n in range(count)]
+
+
+def rate(count, seconds):
+  return round(count / seconds, 1)
+
+
+def run(rows, single_rows, batch_size, database_path=None):
+  app = make_app(database_path)
+  reset(app)
+  seed(app, 0)
+  client = app.test_client()
+  data = make_rows(rows, random.Random(2))
+
+  ndjson = '\n'.join(json.dumps(row) for row in data)
+  start = time.perf_counter()
+  res = client.post('/questions/bulk?batch_size={}'.format(batch_size), data=ndjson, content_type='application/x-ndjson')
+  ndjson_seconds = time.perf_counter() - start
+  assert json.loads(res.data)['inserted'] == rows
+
+  csv_body = 'question,answer,difficulty,category\n' + '\n'.join(
+    '"{question}","{answer}",{difficulty},{category}'.format(**row) for row in data)
+  start = time.perf_counter()
+  res = client.post('/questions/bulk?batch_size={}'.format(batch_size), data=csv_body, content_type='text/csv')
+  csv_seconds = time.perf_counter() - start
+  assert json.loads(res.data)['inserted'] == rows
+
+  start = time.perf_counter()
+  exported = sum(1 for _ in client.get('/questions/export', buffered=False).response)
+  export_seconds = time.perf_counter() - start
+
+  start = time.perf_counter()
+  for row in data[:single_rows]:
+    client.post('/questions', json=row)
+  single_seconds = time.perf_counter() - start
+
+  return {
+    'rows': rows,
+    'batch_size': batch_size,
+    'bulk_ndjson_rows_per_sec': rate(rows, ndjson_seconds),
+    'bulk_csv_rows_per_sec': rate(rows, csv_seconds),
+    'export_rows_per_sec': rate(exported, export_seconds),
+    'single_post_rows_per_sec': rate(single_rows, single_seconds)
+  }
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--rows', type=int, default=100000)
+  parser.add_argument('--single-rows', type=int, default=1000)
+  parser.add_argument('--batch-size', type=int, default=1000)
+  parser.add_argument('--database')
+  args = parser.parse_args()
+
+  print(json.dumps(run(args.rows, args.single_rows, args.batch_size, args.database), indent=2))
@@ -0,0 +1,106 @@
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from flaskr import create_app
+from flaskr.bulk import questions_changed
+from models import db, Question, Category
+
+CATEGORIES = ['Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports']
+SEED_BATCH = 10000
+
+
+def sqlite_path():
+  handle, path = tempfile.mkstemp(suffix='.db', prefix='trivia-bench-')
+  os.close(handle)
+  return 'sqlite:///' + path
+
+
+def make_app(database_path=None, pool_config=None, **config):
+  return create_app(dict({
+    'SQLALCHEMY_DATABASE_URI': database_path or sqlite_path(),
+    'DB_POOL_CONFIG': pool_config,
+    'DB_CREATE_ALL': True,
+    'RATE_LIMITING': False
+  }, **config))
+
+
+def reset(app):
+  with app.app_context():
+    db.drop_all()
+    db.create_all()
+
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'to', 'shi', 'ne', 'vu', 'pe', 'dor', 'zan', 'qui', 'bel', 'fa', 'gro', 'hy']
+WORDS = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+STARTS = ['What is', 'Who was', 'Which', 'Where is', 'How many', 'When did']
+
+
+def synthetic_question(rng):
+  words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 10)))
+  return '{} {}?'.format(rng.choice(STARTS), words)
+
+
+def category_weights(count, skew):
+  return [1 / (rank + 1) ** skew for rank in range(count)]
+
+
+'''
+seed(app, total, skew)
+    fills the questions table up to `total` synthetic questions. With
+    skew=0 they are spread evenly over the six standard categories;
+    larger values give a Zipf-like distribution where category 1 is the
+    biggest (skew=1 puts about 41% of the questions in it).
+'''
+def seed(app, total, skew=0.0, rng=None):
+  rng = rng or random.Random(0)
+
+  with app.app_context():
+    if Category.query.count() == 0:
+      db.session.execute(Category.__table__.insert(), [{'type': name} for name in CATEGORIES])
+      db.session.commit()
+
+    category_ids = [category.id for category in Category.query.order_by(Category.id)]
+    weights = category_weights(len(category_ids), skew)
+    inserted = Question.query.count()
+
+    while inserted < total:
+      batch = min(SEED_BATCH, total - inserted)
+      categories = rng.choices(category_ids, weights, k=batch)
+      rows = [{
+        'question': synthetic_question(rng),
+        'answer': 'Answer {}'.format(inserted + n),
+        'category': categories[n],
+        'difficulty': rng.randint(1, 5)
+      } for n in range(batch)]
+      db.session.execute(Question.__table__.insert(), rows)
+      db.session.commit()
+      inserted += batch
+
+    questions_changed()
+
+
+def measure(fn, repeat):
+  timings = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    fn()
+    timings.append((time.perf_counter() - start) * 1000)
+  return timings
+
+
+def percentile(timings, pct):
+  ordered = sorted(timings)
+  index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+  return ordered[index]
+
+
+def summarize(timings):
+  return {
+    'p50_ms': round(statistics.median(timings), 3),
+    'p95_ms': round(percentile(timings, 95), 3),
+    'p99_ms': round(percentile(timings, 99), 3),
+    'mean_ms': round(statistics.mean(timings), 3)
+  }
@@ -0,0 +1,61 @@
+'''
+Bytes on the wire and CPU time per request for the cacheable listing
+endpoints, without compression, compressed on every request, and
+served from the compressed response cache.
+'''
+import argparse
+import json
+import time
+
+from flaskr.compression import response_cache, ENCODINGS
+from .common import make_app, reset, seed, sqlite_path
+
+PATHS = ('/categories', '/questions', '/questions?per_page=100', '/categories/1/questions?per_page=100')
+
+
+def cpu_ms(fn, repeat):
+  start = time.process_time()
+  for _ in range(repeat):
+    fn()
+  return round((time.process_time() - start) / repeat * 1000, 3)
+
+
+def run(rows, repeat, database_path=None):
+  database_path = database_path or sqlite_path()
+  app = make_app(database_path)
+  reset(app)
+  seed(app, rows)
+  compressed_app = app
+  plain_app = make_app(database_path)
+  plain_app.config['COMPRESSION'] = False
+
+  results = []
+  for path in PATHS:
+    modes = [('none', plain_app, None, False)]
+    for encoding in ENCODINGS:
+      modes.append((encoding, compressed_app, encoding, False))
+      modes.append((encoding + '_cached', compressed_app, encoding, True))
+
+    for name, mode_app, encoding, cached in modes:
+      client = mode_app.test_client()
+      headers = {'Accept-Encoding': encoding} if encoding else {}
+
+      def get():
+        if not cached:
+          response_cache.clear()
+        return client.get(path, headers=headers)
+
+      size = len(get().data)
+      results.append({'path': path, 'mode': name, 'bytes': size, 'cpu_ms': cpu_ms(get, repeat)})
+
+  return results
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--rows', type=int, default=10000)
+  parser.add_argument('--repeat', type=int, default=200)
+  parser.add_argument('--database')
+  args = parser.parse_args()
+
+  print(json.dumps(run(args.rows, args.repeat, args.database), indent=2))
@@ -0,0 +1,95 @@
+'''
+Requests/sec and latency with 10, 100 and 1000 concurrent clients, for
+the sync app behind a fixed number of worker threads (like gunicorn
+sync workers) and for the ASGI app from flaskr.asgi.
+
+Both are driven in-process by asyncio client tasks, so the numbers
+compare how the two serving modes schedule work, not network stacks.
+'''
+import argparse
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flaskr.asgi import AsyncTriviaApp
+from .common import make_app, reset, seed, summarize
+
+PATHS = ['/categories/{}/questions'.format(category) for category in range(1, 7)]
+
+
+async def asgi_get(app, path):
+  async def receive():
+    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+  status = []
+
+  async def send(message):
+    if message['type'] == 'http.response.start':
+      status.append(message['status'])
+
+  await app({
+    'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+    'path': path, 'root_path': '', 'query_string': b'', 'headers': [],
+    'server': ('localhost', 80), 'client': ('127.0.0.1', 0)
+  }, receive, send)
+  return status[0]
+
+
+async def drive(request, clients, total):
+  timings = []
+
+  async def client(index):
+    for n in range(total // clients):
+      start = time.perf_counter()
+      status = await request(PATHS[(index + n) % len(PATHS)])
+      assert status == 200, status
+      timings.append((time.perf_counter() - start) * 1000)
+
+  start = time.perf_counter()
+  await asyncio.gather(*(client(index) for index in range(clients)))
+  return total / (time.perf_counter() - start), timings
+
+
+def run(client_counts, total, sync_workers, database_path=None):
+  app = make_app(database_path)
+  reset(app)
+  seed(app, 10000)
+
+  asgi_app = AsyncTriviaApp(app, sync_workers)
+  executor = ThreadPoolExecutor(max_workers=sync_workers)
+  local = threading.local()
+
+  def wsgi_get(path):
+    if not hasattr(local, 'client'):
+      local.client = app.test_client()
+    return local.client.get(path).status_code
+
+  async def sync_request(path):
+    return await asyncio.get_event_loop().run_in_executor(executor, wsgi_get, path)
+
+  async def asgi_request(path):
+    return await asgi_get(asgi_app, path)
+
+  results = []
+  for clients in client_counts:
+    for mode, request in (('sync', sync_request), ('asgi', asgi_request)):
+      asgi_app.semaphore = None
+      rate, timings = asyncio.run(drive(request, clients, max(total, clients)))
+      results.append({'mode': mode, 'clients': clients, 'requests_per_sec': round(rate, 1), 'latency': summarize(timings)})
+
+  executor.shutdown()
+  return results
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--clients', default='10,100,1000')
+  parser.add_argument('--requests', type=int, default=2000)
+  parser.add_argument('--sync-workers', type=int, default=8)
+  parser.add_argument('--database')
+  args = parser.parse_args()
+
+  clients = [int(count) for count in args.clients.split(',')]
+  print(json.dumps(run(clients, args.requests, args.sync_workers, args.database), indent=2))
@@ -0,0 +1,210 @@
+'''
+Mixed-workload load test for the trivia API.
+
+Seeds a synthetic dataset, then drives GET /questions, GET /categories,
+GET /categories/<id>/questions, POST /questions/search and POST
+/quizzes in a weighted mix from one or more client threads. Prints (or
+writes with --output) a JSON report with throughput and p50/p95/p99
+latency per endpoint, tagged with the current git commit, so two runs
+can be compared with --compare:
+
+    python -m benchmarks --questions-per-category 10000 --output before.json
+    git checkout other-branch
+    python -m benchmarks --questions-per-category 10000 --compare before.json
+'''
+import argparse
+import json
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from models import Question, Category
+from .common import make_app, reset, seed, summarize, WORDS, CATEGORIES
+
+DEFAULT_MIX = 'questions=35,categories=5,category=25,search=15,quiz=20'
+SAMPLE_IDS_PER_CATEGORY = 1000
+
+
+def parse_mix(text):
+  mix = {}
+  for part in text.split(','):
+    name, weight = part.split('=')
+    if name not in SCENARIOS:
+      raise ValueError('unknown scenario {}'.format(name))
+    mix[name] = float(weight)
+  return mix
+
+
+def git_commit():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+'''
+Dataset
+    what the scenarios need to build realistic requests: page counts,
+    category ids weighted by size, and a sample of question ids per
+    category to use as previous_questions
+'''
+class Dataset:
+  def __init__(self, app):
+    with app.app_context():
+      self.total = Question.query.count()
+      self.category_ids = [category.id for category in Category.query.order_by(Category.id)]
+      self.ids = {}
+      self.sizes = []
+      for category_id in self.category_ids:
+        matches = Question.query.filter(Question.category == category_id)
+        self.sizes.append(matches.count())
+        self.ids[category_id] = [row.id for row in matches.with_entities(Question.id).limit(SAMPLE_IDS_PER_CATEGORY)]
+
+  def category(self, rng):
+    return rng.choices(self.category_ids, self.sizes)[0]
+
+
+def get_questions(client, rng, data):
+  # most visitors look at the first few pages
+  page = min(int(rng.expovariate(0.3)) + 1, max(data.total // 10, 1))
+  return client.get('/questions?page={}'.format(page))
+
+
+def get_categories(client, rng, data):
+  return client.get('/categories')
+
+
+def get_category_questions(client, rng, data):
+  return client.get('/categories/{}/questions?page={}'.format(data.category(rng), rng.randint(1, 3)))
+
+
+def search(client, rng, data):
+  return client.post('/questions/search', json={'searchTerm': rng.choice(WORDS)[:rng.randint(3, 6)]})
+
+
+def play_quiz(client, rng, data):
+  category_id = data.category(rng)
+  ids = data.ids[category_id]
+  previous = rng.sample(ids, min(len(ids), rng.randint(0, 10)))
+  return client.post('/quizzes', json={
+    'previous_questions': previous,
+    'quiz_category': {'id': category_id, 'type': CATEGORIES[(category_id - 1) % len(CATEGORIES)]}
+  })
+
+
+SCENARIOS = {
+  'questions': get_questions,
+  'categories': get_categories,
+  'category': get_category_questions,
+  'search': search,
+  'quiz': play_quiz
+}
+
+
+def run(questions_per_category, skew, mix, requests, clients, warmup=50, seed_value=0, database_path=None):
+  app = make_app(database_path)
+  reset(app)
+  seed(app, questions_per_category * len(CATEGORIES), skew=skew)
+  data = Dataset(app)
+
+  names = list(mix)
+  weights = [mix[name] for name in names]
+  timings = {name: [] for name in names}
+  errors = {name: 0 for name in names}
+  lock = threading.Lock()
+
+  def client_loop(index, count, record):
+    rng = random.Random(seed_value * 1000 + index)
+    client = app.test_client()
+    for _ in range(count):
+      name = rng.choices(names, weights)[0]
+      start = time.perf_counter()
+      res = SCENARIOS[name](client, rng, data)
+      elapsed = (time.perf_counter() - start) * 1000
+      if record:
+        with lock:
+          timings[name].append(elapsed)
+          if res.status_code >= 500:
+            errors[name] += 1
+
+  client_loop(-1, warmup, False)
+
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=clients) as executor:
+    list(executor.map(lambda index: client_loop(index, requests // clients, True), range(clients)))
+  seconds = time.perf_counter() - start
+
+  all_timings = [timing for name in names for timing in timings[name]]
+  return {
+    'commit': git_commit(),
+    'dataset': {
+      'questions': data.total,
+      'questions_per_category': dict(zip(data.category_ids, data.sizes)),
+      'skew': skew,
+      'database': app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0]
+    },
+    'mix': mix,
+    'clients': clients,
+    'requests': len(all_timings),
+    'throughput_rps': round(len(all_timings) / seconds, 1),
+    'overall': summarize(all_timings),
+    'endpoints': {
+      name: dict(summarize(timings[name]), count=len(timings[name]), server_errors=errors[name])
+      for name in names if timings[name]
+    }
+  }
+
+
+'''
+compare(baseline, current)
+    ratio of current to baseline for throughput and each endpoint's
+    latency percentiles; above 1.0 latency is slower, below faster
+'''
+def compare(baseline, current):
+  def ratio(new, old):
+    return round(new / old, 3) if old else None
+
+  report = {
+    'baseline_commit': baseline.get('commit'),
+    'commit': current.get('commit'),
+    'throughput_ratio': ratio(current['throughput_rps'], baseline['throughput_rps']),
+    'endpoints': {}
+  }
+  for name, stats in current['endpoints'].items():
+    old = baseline['endpoints'].get(name)
+    if old is not None:
+      report['endpoints'][name] = {key: ratio(stats[key], old[key]) for key in ('p50_ms', 'p95_ms', 'p99_ms')}
+  return report
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--questions-per-category', type=int, default=1000)
+  parser.add_argument('--skew', type=float, default=0.0, help='0 for even categories, 1 or more for a few large ones')
+  parser.add_argument('--mix', default=DEFAULT_MIX)
+  parser.add_argument('--requests', type=int, default=2000)
+  parser.add_argument('--clients', type=int, default=1)
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--database')
+  parser.add_argument('--output')
+  parser.add_argument('--compare')
+  args = parser.parse_args(argv)
+
+  result = run(args.questions_per_category, args.skew, parse_mix(args.mix), args.requests,
+               args.clients, seed_value=args.seed, database_path=args.database)
+
+  if args.compare:
+    with open(args.compare) as baseline:
+      result['comparison'] = compare(json.load(baseline), result)
+
+  output = json.dumps(result, indent=2)
+  if args.output:
+    with open(args.output, 'w') as handle:
+      handle.write(output + '\n')
+  print(output)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,47 @@
+'''
+Per-request latency of GET /questions as the table grows.
+
+Compares the first page, a deep page reached with ?page= (OFFSET) and
+the same deep page reached with ?cursor= (keyset).
+'''
+import argparse
+import json
+
+from flaskr.pagination import encode_cursor
+from .common import make_app, reset, seed, measure, summarize
+
+
+def run(sizes, repeat, database_path=None):
+  app = make_app(database_path)
+  reset(app)
+  client = app.test_client()
+  results = []
+
+  for size in sizes:
+    seed(app, size)
+    deep_page = max(1, size // 10 - 1)
+    deep_cursor = encode_cursor((deep_page - 1) * 10)
+
+    def get(url):
+      res = client.get(url)
+      assert res.status_code == 200, res.status_code
+
+    results.append({
+      'rows': size,
+      'first_page': summarize(measure(lambda: get('/questions'), repeat)),
+      'deep_offset': summarize(measure(lambda: get('/questions?page={}'.format(deep_page)), repeat)),
+      'deep_cursor': summarize(measure(lambda: get('/questions?cursor={}'.format(deep_cursor)), repeat))
+    })
+
+  return results
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--sizes', default='1000,10000,100000,1000000')
+  parser.add_argument('--repeat', type=int, default=50)
+  parser.add_argument('--database')
+  args = parser.parse_args()
+
+  sizes = [int(size) for size in args.sizes.split(',')]
+  print(json.dumps(run(sizes, args.repeat, args.database), indent=2))
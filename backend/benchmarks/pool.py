@@ -0,0 +1,62 @@
+'''
+Load test of the connection pool: concurrent clients read
+/categories/<id>/questions while the pool size and overflow vary, and
+the run reports requests/sec and the pool metrics (checkouts, new
+connections, time spent waiting for a connection).
+'''
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from models import PoolConfig, pool_stats, pool_metrics
+from .common import make_app, reset, seed, sqlite_path
+
+
+def run(clients, requests, pool_sizes, database_path=None):
+  database_path = database_path or sqlite_path()
+  app = make_app(database_path)
+  reset(app)
+  seed(app, 10000)
+  results = []
+
+  for pool_size in pool_sizes:
+    config = PoolConfig(pool_size=pool_size, max_overflow=0, pool_timeout=60)
+    app = make_app(database_path, pool_config=config)
+    pool_metrics.reset()
+
+    def worker(count):
+      client = app.test_client()
+      for n in range(count):
+        res = client.get('/categories/{}/questions?page={}'.format(n % 6 + 1, n % 50 + 1))
+        assert res.status_code in (200, 404), res.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+      list(executor.map(worker, [requests // clients] * clients))
+    seconds = time.perf_counter() - start
+
+    with app.app_context():
+      stats = pool_stats()
+    results.append({
+      'clients': clients,
+      'pool_size': pool_size,
+      'requests_per_sec': round(requests / seconds, 1),
+      'mean_wait_ms': round(stats['wait_seconds'] / max(stats['waits'], 1) * 1000, 3),
+      'max_wait_ms': round(stats['max_wait_seconds'] * 1000, 3),
+      'connects': stats['connects']
+    })
+
+  return results
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--clients', type=int, default=32)
+  parser.add_argument('--requests', type=int, default=3200)
+  parser.add_argument('--pool-sizes', default='1,4,16')
+  parser.add_argument('--database')
+  args = parser.parse_args()
+
+  sizes = [int(size) for size in args.pool_sizes.split(',')]
+  print(json.dumps(run(args.clients, args.requests, sizes, args.database), indent=2))
@@ -0,0 +1,61 @@
+'''
+Rows per second serialized by the read paths: hydrated Question objects
+with format() against column projections with format_question_row(),
+both for the raw query and through /questions and
+/categories/<id>/questions.
+'''
+import argparse
+import json
+import time
+
+from models import db, Question, question_rows, format_question_row
+from .common import make_app, reset, seed
+
+
+def rows_per_sec(fn, rows, repeat):
+  start = time.perf_counter()
+  for _ in range(repeat):
+    fn()
+  return round(rows * repeat / (time.perf_counter() - start), 1)
+
+
+def run(rows, page_size, repeat, database_path=None):
+  app = make_app(database_path)
+  reset(app)
+  seed(app, rows)
+  client = app.test_client()
+
+  with app.app_context():
+    def hydrated():
+      json.dumps([question.format() for question in Question.query.order_by(Question.id).limit(page_size)])
+      db.session.expunge_all()
+
+    def projected():
+      json.dumps([format_question_row(row) for row in question_rows().order_by(Question.id).limit(page_size)])
+
+    # both must serialize to the same bytes
+    assert json.dumps([question.format() for question in Question.query.order_by(Question.id).limit(50)]) == \
+      json.dumps([format_question_row(row) for row in question_rows().order_by(Question.id).limit(50)])
+
+    results = {
+      'page_size': page_size,
+      'query_hydrated_rows_per_sec': rows_per_sec(hydrated, page_size, repeat),
+      'query_projected_rows_per_sec': rows_per_sec(projected, page_size, repeat)
+    }
+
+  for name, url in (('questions', '/questions'), ('category_questions', '/categories/1/questions')):
+    url = '{}?per_page={}&stream=0'.format(url, page_size)
+    results[name + '_rows_per_sec'] = rows_per_sec(lambda: client.get(url), page_size, repeat)
+
+  return results
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--rows', type=int, default=100000)
+  parser.add_argument('--page-size', type=int, default=1000)
+  parser.add_argument('--repeat', type=int, default=20)
+  parser.add_argument('--database')
+  args = parser.parse_args()
+
+  print(json.dumps(run(args.rows, args.page_size, args.repeat, args.database), indent=2))
@@ -0,0 +1,97 @@
+'''
+Latency of POST /quizzes, random and adaptive (difficulty targeted),
+across category sizes and the number of questions already played in
+the session. With --counts, compares a
+round of N questions fetched with one count=N request against N
+single-question requests.
+'''
+import argparse
+import json
+import random
+
+from models import db, Question
+from .common import make_app, reset, seed, measure, summarize
+
+
+def run(sizes, played_fractions, repeat, database_path=None):
+  app = make_app(database_path)
+  reset(app)
+  client = app.test_client()
+  rng = random.Random(0)
+  results = []
+
+  for size in sizes:
+    # six categories, so each one holds roughly size / 6 questions
+    seed(app, size)
+    with app.app_context():
+      ids = [row.id for row in db.session.query(Question.id).filter(Question.category == 1)]
+
+    for fraction in played_fractions:
+      previous = rng.sample(ids, int(len(ids) * fraction))
+      body = {'previous_questions': previous, 'quiz_category': {'id': 1, 'type': 'Science'}}
+
+      adaptive_body = dict(body, difficulty=3, last_answer_correct=True)
+
+      def play():
+        res = client.post('/quizzes', json=body)
+        assert res.status_code == 200, res.status_code
+
+      def play_adaptive():
+        res = client.post('/quizzes', json=adaptive_body)
+        assert res.status_code == 200, res.status_code
+
+      results.append({
+        'rows': size,
+        'category_size': len(ids),
+        'previous_questions': len(previous),
+        'latency': summarize(measure(play, repeat)),
+        'adaptive_latency': summarize(measure(play_adaptive, repeat))
+      })
+
+  return results
+
+
+def run_counts(size, counts, repeat, database_path=None):
+  app = make_app(database_path)
+  reset(app)
+  seed(app, size)
+  client = app.test_client()
+  category = {'id': 1, 'type': 'Science'}
+  results = []
+
+  for count in counts:
+    def batched():
+      res = client.post('/quizzes', json={'previous_questions': [], 'quiz_category': category, 'count': count})
+      assert len(res.get_json()['questions']) == count
+
+    def one_by_one():
+      previous = []
+      for _ in range(count):
+        res = client.post('/quizzes', json={'previous_questions': previous, 'quiz_category': category})
+        previous.append(res.get_json()['question']['id'])
+
+    results.append({
+      'count': count,
+      'batched': summarize(measure(batched, repeat)),
+      'one_by_one': summarize(measure(one_by_one, repeat))
+    })
+
+  return results
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--sizes', default='1000,10000,100000')
+  parser.add_argument('--played', default='0,0.1,0.5,0.9')
+  parser.add_argument('--repeat', type=int, default=50)
+  parser.add_argument('--counts', help='e.g. 1,5,10,20,50; runs the batch comparison on the largest size')
+  parser.add_argument('--database')
+  args = parser.parse_args()
+
+  sizes = [int(size) for size in args.sizes.split(',')]
+  if args.counts:
+    counts = [int(count) for count in args.counts.split(',')]
+    print(json.dumps(run_counts(max(sizes), counts, args.repeat, args.database), indent=2))
+  else:
+    played = [float(fraction) for fraction in args.played.split(',')]
+    print(json.dumps(run(sizes, played, args.repeat, args.database), indent=2))
@@ -0,0 +1,78 @@
+'''
+Local load generator for the rate limiter: a few abusive clients, all
+from one address, hammer POST /quizzes while reader clients from other
+addresses page through GET /questions over a small connection pool.
+Runs once with rate limiting off and once with it on, and reports how
+many abusive requests got through, were limited (429) or shed (503),
+and the readers' latency.
+'''
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from models import PoolConfig
+from .common import make_app, reset, seed, sqlite_path, summarize
+
+
+def run_mode(database_path, rate_limiting, abusers, readers, seconds):
+  app = make_app(database_path, PoolConfig(pool_size=2, max_overflow=0), RATE_LIMITING=rate_limiting)
+
+  statuses = {}
+  reader_timings = []
+  lock = threading.Lock()
+  deadline = time.monotonic() + seconds
+  body = {'previous_questions': [], 'quiz_category': {'id': 1, 'type': 'Science'}}
+
+  def abuse(index):
+    client = app.test_client()
+    while time.monotonic() < deadline:
+      status = client.post('/quizzes', json=body, environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code
+      with lock:
+        statuses[status] = statuses.get(status, 0) + 1
+
+  def read(index):
+    client = app.test_client()
+    address = '10.0.1.{}'.format(index)
+    page = 1
+    while time.monotonic() < deadline:
+      start = time.perf_counter()
+      client.get('/questions?page={}'.format(page), environ_base={'REMOTE_ADDR': address})
+      with lock:
+        reader_timings.append((time.perf_counter() - start) * 1000)
+      page = page % 50 + 1
+
+  with ThreadPoolExecutor(max_workers=abusers + readers) as executor:
+    futures = [executor.submit(abuse, n) for n in range(abusers)]
+    futures += [executor.submit(read, n) for n in range(readers)]
+    for future in futures:
+      future.result()
+
+  return {
+    'rate_limiting': rate_limiting,
+    'abusive_requests': {str(status): count for status, count in sorted(statuses.items())},
+    'reader_requests': len(reader_timings),
+    'reader_latency': summarize(reader_timings)
+  }
+
+
+def run(questions, abusers, readers, seconds, database_path=None):
+  database_path = database_path or sqlite_path()
+  app = make_app(database_path)
+  reset(app)
+  seed(app, questions)
+
+  return [run_mode(database_path, enabled, abusers, readers, seconds) for enabled in (False, True)]
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--questions', type=int, default=10000)
+  parser.add_argument('--abusers', type=int, default=8)
+  parser.add_argument('--readers', type=int, default=4)
+  parser.add_argument('--seconds', type=float, default=5)
+  parser.add_argument('--database')
+  args = parser.parse_args()
+
+  print(json.dumps(run(args.questions, args.abusers, args.readers, args.seconds, args.database), indent=2))
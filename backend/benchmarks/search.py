@@ -0,0 +1,69 @@
+'''
+p50/p99 latency of POST /questions/search through the search index
+compared with the previous ILIKE '%term%' query paginated in Python.
+'''
+import argparse
+import json
+import random
+
+from flask import request
+
+from flaskr.search import trigram_index
+from models import Question
+from .common import make_app, reset, seed, measure, summarize, WORDS
+
+
+def ilike_search(term):
+  # the pre-index implementation of the endpoint
+  selection = Question.query.filter(Question.question.ilike('%{}%'.format(term))).order_by(Question.id).all()
+  page = request.args.get('page', 1, type=int)
+  questions = [question.format() for question in selection]
+  return questions[(page - 1) * 10:page * 10], len(selection)
+
+
+def run(sizes, repeat, database_path=None):
+  app = make_app(database_path)
+  reset(app)
+  client = app.test_client()
+  rng = random.Random(1)
+  results = []
+
+  for size in sizes:
+    seed(app, size)
+    terms = [rng.choice(WORDS)[:rng.randint(3, 6)] for _ in range(repeat)]
+
+    def indexed():
+      res = client.post('/questions/search', json={'searchTerm': next(term_cycle)})
+      assert res.status_code == 200, res.status_code
+
+    def ilike():
+      with app.test_request_context('/questions/search'):
+        ilike_search(next(term_cycle))
+
+    # build the index outside the timed loop
+    with app.test_request_context():
+      trigram_index.ensure_built()
+
+    term_cycle = iter(terms * 2)
+    indexed_timings = measure(indexed, repeat)
+    term_cycle = iter(terms * 2)
+    ilike_timings = measure(ilike, repeat)
+
+    results.append({
+      'rows': size,
+      'index': summarize(indexed_timings),
+      'ilike': summarize(ilike_timings)
+    })
+
+  return results
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--sizes', default='10000,100000,1000000')
+  parser.add_argument('--repeat', type=int, default=50)
+  parser.add_argument('--database')
+  args = parser.parse_args()
+
+  sizes = [int(size) for size in args.sizes.split(',')]
+  print(json.dumps(run(sizes, args.repeat, args.database), indent=2))
@@ -0,0 +1,74 @@
+'''
+JSON encoding cost of typical responses: a 10-question page with its
+categories, the categories list and a 100-question page, encoded with
+flask.jsonify (stdlib encoder, sorted keys) and with each backend in
+flaskr/serialization.py that is installed.
+'''
+import argparse
+import json
+import random
+import time
+
+import flask
+
+from flaskr.serialization import BACKENDS, orjson
+from .common import make_app, synthetic_question, CATEGORIES
+
+
+def page(size, rng):
+  return {
+    'success': True,
+    'status_code': 200,
+    'questions': [{
+      'id': n,
+      'question': synthetic_question(rng),
+      'answer': 'Answer {}'.format(n),
+      'category': rng.randint(1, len(CATEGORIES)),
+      'difficulty': rng.randint(1, 5)
+    } for n in range(size)],
+    'total_questions': 100000,
+    'next_cursor': 'eyJpZCI6MTB9',
+    'categories': [{'id': n + 1, 'type': name} for n, name in enumerate(CATEGORIES)],
+    'current_category': {'id': 1, 'type': CATEGORIES[0]}
+  }
+
+
+def per_call_us(fn, data, repeat):
+  start = time.perf_counter()
+  for _ in range(repeat):
+    fn(data)
+  return round((time.perf_counter() - start) / repeat * 1e6, 2)
+
+
+def run(repeat):
+  app = make_app()
+  rng = random.Random(0)
+  payloads = {
+    'page_10': page(10, rng),
+    'categories': {'success': True, 'categories': page(0, rng)['categories']},
+    'page_100': page(100, rng)
+  }
+  encoders = {'flask_jsonify': lambda data: flask.jsonify(data).get_data()}
+  for name, dumps in BACKENDS.items():
+    if name != 'orjson' or orjson is not None:
+      encoders[name] = dumps
+
+  results = []
+  with app.test_request_context():
+    for payload_name, data in payloads.items():
+      for encoder_name, encode in encoders.items():
+        results.append({
+          'payload': payload_name,
+          'encoder': encoder_name,
+          'bytes': len(encode(data)),
+          'us_per_call': per_call_us(encode, data, repeat)
+        })
+  return results
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--repeat', type=int, default=5000)
+  args = parser.parse_args()
+
+  print(json.dumps(run(args.repeat), indent=2))
@@ -0,0 +1,155 @@
+'''
+Per-worker memory and cold start with and without the shared snapshot.
+Each mode runs in a fresh interpreter that creates the app and forks
+workers the way gunicorn's preload_app does:
+
+    quiz_index            every worker builds its own quiz index on
+                          its first quiz request
+    quiz_index_preloaded  the master builds the index before forking,
+                          workers start with a copy-on-write copy
+    snapshot              the master maps the snapshot file (written
+                          beforehand, as `flask snapshot` would), workers
+                          draw from the shared mapping
+
+Every worker times its first POST /quizzes, serves a round of quiz
+requests, and once all workers are done reports its RSS and PSS
+(resident memory with shared pages divided between the processes that
+map them, Linux only).
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from flaskr import create_app
+from flaskr.quiz import quiz_index
+from flaskr.snapshot import write_snapshot
+from flaskr.startup import after_fork
+from .common import make_app, reset, seed, sqlite_path
+
+MODES = ('quiz_index', 'quiz_index_preloaded', 'snapshot')
+
+
+def memory_kb():
+  usage = {}
+  for path, field, name in (
+    ('/proc/self/status', 'VmRSS:', 'rss_kb'),
+    ('/proc/self/smaps_rollup', 'Pss:', 'pss_kb')
+  ):
+    try:
+      with open(path) as status:
+        for line in status:
+          if line.startswith(field):
+            usage[name] = int(line.split()[1])
+    except OSError:
+      pass
+  return usage
+
+
+def serve(app, requests):
+  client = app.test_client()
+  body = {'previous_questions': [], 'quiz_category': {'id': 1}, 'count': 10}
+
+  start = time.perf_counter()
+  client.post('/quizzes', json=body)
+  first = time.perf_counter() - start
+
+  start = time.perf_counter()
+  for n in range(requests):
+    client.post('/quizzes', json=dict(body, quiz_category={'id': n % 6 + 1}))
+  rest = time.perf_counter() - start
+
+  return {'first_quiz_ms': round(first * 1000, 3), 'quiz_ms': round(rest / requests * 1000, 3)}
+
+
+def measure_mode(database_path, mode, workers, requests, snapshot_path):
+  config = {'SQLALCHEMY_DATABASE_URI': database_path, 'RATE_LIMITING': False}
+  if mode == 'snapshot':
+    config['SNAPSHOT_PATH'] = snapshot_path
+  app = create_app(config)
+
+  start = time.perf_counter()
+  with app.app_context():
+    if mode == 'quiz_index_preloaded':
+      quiz_index.ensure_built()
+    elif mode == 'snapshot':
+      app.extensions['snapshot'].current()
+  preloaded = time.perf_counter() - start
+
+  children = []
+  go_read, go_write = os.pipe()
+  for _ in range(workers):
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+      os.close(read_end)
+      os.close(go_write)
+      after_fork(app)
+      result = serve(app, requests)
+      os.write(write_end, b'.')
+      # wait until every worker is done, so shared pages are counted once per worker
+      os.read(go_read, 1)
+      result.update(memory_kb())
+      os.write(write_end, json.dumps(result).encode('utf-8'))
+      os._exit(0)
+    os.close(write_end)
+    children.append((pid, os.fdopen(read_end, 'rb')))
+
+  os.close(go_read)
+  for _, pipe in children:
+    pipe.read(1)
+  os.close(go_write)
+
+  results = []
+  for pid, pipe in children:
+    results.append(json.loads(pipe.read()))
+    pipe.close()
+    os.waitpid(pid, 0)
+
+  return {
+    'mode': mode,
+    'preload_ms': round(preloaded * 1000, 3),
+    'snapshot_bytes': os.path.getsize(snapshot_path) if mode == 'snapshot' else 0,
+    'per_worker': {
+      name: round(sum(result.get(name, 0) for result in results) / len(results), 3)
+      for name in ('first_quiz_ms', 'quiz_ms', 'rss_kb', 'pss_kb')
+    }
+  }
+
+
+def run(questions, workers, requests, database_path=None):
+  database_path = database_path or sqlite_path()
+  app = make_app(database_path)
+  reset(app)
+  seed(app, questions)
+  snapshot_path = os.path.join(tempfile.mkdtemp(prefix='trivia-bench-'), 'questions.snapshot')
+  with app.app_context():
+    write_snapshot(snapshot_path)
+
+  results = []
+  for mode in MODES:
+    output = subprocess.check_output([
+      sys.executable, '-m', 'benchmarks.snapshot', '--measure', mode, '--workers', str(workers),
+      '--requests', str(requests), '--database', database_path, '--snapshot', snapshot_path
+    ])
+    results.append(json.loads(output))
+  return results
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--questions', type=int, default=100000)
+  parser.add_argument('--workers', type=int, default=4)
+  parser.add_argument('--requests', type=int, default=200)
+  parser.add_argument('--database')
+  parser.add_argument('--snapshot', help=argparse.SUPPRESS)
+  parser.add_argument('--measure', choices=MODES, help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.measure is not None:
+    print(json.dumps(measure_mode(args.database, args.measure, args.workers, args.requests, args.snapshot)))
+  else:
+    print(json.dumps(run(args.questions, args.workers, args.requests, args.database), indent=2))
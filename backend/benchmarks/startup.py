@@ -0,0 +1,101 @@
+'''
+Worker startup cost. Each mode runs in a fresh interpreter that imports
+the app, creates it (with or without create_all) and optionally warms
+it up, then forks workers the way gunicorn's preload_app does. Every
+worker reports how long its first GET /categories, GET /questions and
+POST /quizzes took, i.e. what a user hitting a freshly booted worker
+waits for.
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from flaskr import create_app
+from flaskr.startup import warm_up, after_fork
+from .common import make_app, reset, seed, sqlite_path
+
+MODES = {
+  'create_all': {'create_all': True, 'warm_up': False},
+  'no_create_all': {'create_all': False, 'warm_up': False},
+  'preload_warm_up': {'create_all': False, 'warm_up': True}
+}
+
+
+def first_requests(app):
+  client = app.test_client()
+  timings = {}
+  for name, request in (
+    ('categories', lambda: client.get('/categories')),
+    ('questions', lambda: client.get('/questions')),
+    ('quiz', lambda: client.post('/quizzes', json={'previous_questions': [], 'quiz_category': {'id': 1}}))
+  ):
+    start = time.perf_counter()
+    request()
+    timings[name] = round((time.perf_counter() - start) * 1000, 3)
+  return timings
+
+
+def measure_mode(database_path, mode, workers):
+  options = MODES[mode]
+
+  start = time.perf_counter()
+  app = create_app({'SQLALCHEMY_DATABASE_URI': database_path, 'DB_CREATE_ALL': options['create_all']})
+  created = time.perf_counter() - start
+
+  warmed = warm_up(app) if options['warm_up'] else 0
+
+  results = []
+  for _ in range(workers):
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+      os.close(read_end)
+      after_fork(app)
+      os.write(write_end, json.dumps(first_requests(app)).encode('utf-8'))
+      os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as pipe:
+      results.append(json.loads(pipe.read()))
+    os.waitpid(pid, 0)
+
+  return {
+    'mode': mode,
+    'create_app_ms': round(created * 1000, 3),
+    'warm_up_ms': round(warmed * 1000, 3),
+    'first_request_ms': {
+      name: round(sum(result[name] for result in results) / len(results), 3) for name in results[0]
+    }
+  }
+
+
+def run(questions, workers, database_path=None):
+  database_path = database_path or sqlite_path()
+  app = make_app(database_path)
+  reset(app)
+  seed(app, questions)
+
+  results = []
+  for mode in MODES:
+    output = subprocess.check_output([
+      sys.executable, '-m', 'benchmarks.startup', '--measure', mode,
+      '--workers', str(workers), '--database', database_path
+    ])
+    results.append(json.loads(output))
+  return results
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--questions', type=int, default=100000)
+  parser.add_argument('--workers', type=int, default=4)
+  parser.add_argument('--database')
+  parser.add_argument('--measure', choices=MODES, help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.measure is not None:
+    print(json.dumps(measure_mode(args.database, args.measure, args.workers)))
+  else:
+    print(json.dumps(run(args.questions, args.workers, args.database), indent=2))
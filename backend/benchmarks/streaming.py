@@ -0,0 +1,66 @@
+'''
+Peak RSS of a large GET /questions listing built in memory (stream=0)
+and streamed from a server-side cursor (stream=1). Each mode runs in
+its own process so ru_maxrss is not shared between them.
+'''
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from .common import make_app, reset, seed, sqlite_path
+
+
+def peak_rss_mb():
+  # ru_maxrss is in kilobytes on Linux
+  return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def measure_mode(database_path, rows, stream):
+  app = make_app(database_path)
+  client = app.test_client()
+  baseline = peak_rss_mb()
+
+  start = time.perf_counter()
+  res = client.get('/questions?per_page={}&stream={}'.format(rows, stream), buffered=False)
+  size = sum(len(chunk) for chunk in res.response)
+  seconds = time.perf_counter() - start
+
+  return {
+    'stream': stream,
+    'bytes': size,
+    'seconds': round(seconds, 3),
+    'baseline_rss_mb': baseline,
+    'peak_rss_mb': peak_rss_mb()
+  }
+
+
+def run(rows, database_path=None):
+  database_path = database_path or sqlite_path()
+  app = make_app(database_path)
+  reset(app)
+  seed(app, rows)
+
+  results = []
+  for stream in (0, 1):
+    output = subprocess.check_output([
+      sys.executable, '-m', 'benchmarks.streaming',
+      '--measure', str(stream), '--rows', str(rows), '--database', database_path
+    ])
+    results.append(json.loads(output))
+  return results
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--rows', type=int, default=100000)
+  parser.add_argument('--database')
+  parser.add_argument('--measure', type=int, choices=(0, 1), help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.measure is not None:
+    print(json.dumps(measure_mode(args.database, args.rows, args.measure)))
+  else:
+    print(json.dumps(run(args.rows, args.database), indent=2))
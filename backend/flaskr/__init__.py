@@ -1,28 +1,61 @@
+import csv
 import os
-from flask import Flask, request, abort, jsonify
+from flask import Flask, request, abort, g, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
 
-from models import setup_db, Question, Category
-
-QUESTIONS_PER_PAGE = 10
-
-def paginate_questions(request, selection):
-  page = request.args.get('page', 1, type=int)
-  start = (page - 1) * QUESTIONS_PER_PAGE
-  end = start + QUESTIONS_PER_PAGE
-
-  questions = [question.format() for question in selection]
-  current_questions = questions[start:end]
-
-  return current_questions
+from models import setup_db, env_flag, Question, Category, category_cache, question_counts
+from migrations import migrate_command
+from .pagination import paginate_questions, page_response
+from .quiz import quiz_index, quiz_source, draw_question, draw_questions, next_session_question, next_difficulty, QUIZ_MAX_COUNT, MIN_DIFFICULTY, MAX_DIFFICULTY
+from .http_cache import conditional
+from .bulk import import_questions, export_questions, delete_questions, update_questions, BULK_BATCH_SIZE, BULK_MAX_BATCH_SIZE, NDJSON_MIMETYPES, CSV_MIMETYPES
+from .search import trigram_index, find_questions
+from .quiz_sessions import MemoryQuizSessionStore, QUIZ_SESSION_MAX, QUIZ_SESSION_TTL
+from .profiling import init_profiling, metrics_text
+from .compression import compress_response
+from .serialization import init_json, jsonify
+from .rate_limit import RateLimiter
+from .replicas import ReplicaRouter
+from .snapshot import init_snapshot, snapshot_command
+from .packs import init_packs, pack_response, packs_command, PACK_MAX_COUNT
 
 
 def create_app(test_config=None):
   # create and configure the app
   app = Flask(__name__)
-  setup_db(app)
+  app.config['JSON_SORT_KEYS'] = False
+  if test_config is not None:
+    app.config.from_mapping(test_config)
+  init_json(app)
+  setup_db(
+    app,
+    app.config.get('SQLALCHEMY_DATABASE_URI'),
+    app.config.get('DB_POOL_CONFIG'),
+    create_tables=app.config.get('DB_CREATE_ALL', env_flag('DB_CREATE_ALL', False)),
+    replica_paths=app.config.get('DB_REPLICAS')
+  )
+
+  quiz_sessions = app.config.get('QUIZ_SESSION_STORE') or MemoryQuizSessionStore(
+    max_sessions=app.config.get('QUIZ_SESSION_MAX', QUIZ_SESSION_MAX),
+    ttl=app.config.get('QUIZ_SESSION_TTL', QUIZ_SESSION_TTL)
+  )
+
+  app.cli.add_command(migrate_command)
+  app.cli.add_command(snapshot_command)
+  app.cli.add_command(packs_command)
+
+  # quizzes draw from the shared snapshot file when SNAPSHOT_PATH is set
+  init_snapshot(app)
+  init_packs(app)
+
+  limiter = RateLimiter(app)
+
+  # reads of the views decorated with router.read_only go to DB_REPLICAS
+  router = ReplicaRouter(app)
+
+  # None unless PROFILING is enabled
+  profiler = init_profiling(app)
 
   '''
   @DONE: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -36,6 +69,9 @@ def create_app(test_config=None):
   def after_request(response):
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,true')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+    compress_response(response)
+    if profiler is not None:
+      profiler.finish(response)
     return response
 
 
@@ -44,20 +80,36 @@ def create_app(test_config=None):
   Create an endpoint to handle GET requests 
   for all available categories.
   '''
+  def wants_counts():
+    return request.args.get('with_counts', 0, type=int) == 1
+
+  def category_tables():
+    if wants_counts():
+      return (Category.__tablename__, Question.__tablename__)
+    return (Category.__tablename__,)
+
   @app.route('/categories')
+  @router.read_only
+  @conditional(category_tables)
   def retrieve_categories():
-    categories = Category.query.all()
-
-    if len(categories) == 0:
+    if category_cache.first() is None:
       abort(404)
 
-    formatted_categories = [category.format() for category in categories]
+    if wants_counts():
+      counts = question_counts.all()
+      return jsonify({
+        'success': True,
+        'status_code': 200,
+        'categories': [
+          dict(category, question_count=counts.get(category['id'], 0)) for category in category_cache.all()
+        ],
+        'total_questions': sum(counts.values())
+      })
 
-    return jsonify({
-      'success': True,
-      'status_code': 200,
-      'categories': formatted_categories
-    })
+    # the categories list is cached already encoded, only the envelope is added here
+    body = b'{"categories":' + category_cache.json() + b',"status_code":200,"success":true}\n'
+
+    return app.response_class(body, mimetype='application/json')
 
 
   '''
@@ -73,29 +125,31 @@ def create_app(test_config=None):
   Clicking on the page numbers should update the questions. 
   '''
   @app.route('/questions')
+  @router.read_only
+  @conditional(Question.__tablename__, Category.__tablename__)
   def retrieve_questions():
-    selection = Question.query.order_by(Question.id).all()
-    current_questions = paginate_questions(request, selection)
+    try:
+      page = paginate_questions(request, Question.query, total=question_counts.total())
+    except ValueError:
+      abort(400)
 
-    if len(current_questions) == 0:
+    if page.empty:
       abort(404)
 
-    total_questions = len(selection)
-    current_category = Category.query.first().format()
-
-    categories = Category.query.all()
-    formatted_categories = [category.format() for category in categories]
+    current_category = category_cache.first()
+    formatted_categories = category_cache.all()
 
     output = {
       'success': True,
       'status_code': 200,
-      'questions': current_questions,
-      'total_questions': total_questions,
+      'questions': page.questions,
+      'total_questions': page.total_questions,
+      'next_cursor': page.next_cursor,
       'categories': formatted_categories,
       'current_category': current_category
     }
 
-    return jsonify(output)
+    return page_response(page, output)
 
 
   '''
@@ -106,6 +160,7 @@ def create_app(test_config=None):
   This removal will persist in the database and when you refresh the page. 
   '''
   @app.route('/questions/<int:question_id>', methods=['DELETE'])
+  @limiter.limit('delete_question')
   def delete_question(question_id):
     question = Question.query.get(question_id)
 
@@ -114,6 +169,8 @@ def create_app(test_config=None):
 
     try:
       question.delete()
+      quiz_index.remove(question.id)
+      trigram_index.remove(question.id)
 
       return jsonify({
         'success': True,
@@ -135,6 +192,7 @@ def create_app(test_config=None):
   of the questions list in the "List" tab.  
   '''
   @app.route('/questions', methods=['POST'])
+  @limiter.limit('create_question')
   def create_question():
     body = request.get_json()
 
@@ -157,6 +215,8 @@ def create_app(test_config=None):
     try:
       question = Question(question=question, answer=answer, difficulty=difficulty, category=category)
       question.insert()
+      quiz_index.add(question.id, question.category, question.difficulty)
+      trigram_index.add(question.id, question.question)
 
       return jsonify({
         "success": True,
@@ -167,6 +227,80 @@ def create_app(test_config=None):
       abort(400)
 
 
+  '''
+  Bulk import: streams NDJSON (application/x-ndjson) or CSV (text/csv)
+  questions into the database in batches, reporting rejected rows.
+  '''
+  @app.route('/questions/bulk', methods=['POST'])
+  def bulk_create_questions():
+    if request.mimetype not in NDJSON_MIMETYPES + CSV_MIMETYPES:
+      abort(415)
+
+    batch_size = request.args.get('batch_size', app.config.get('BULK_BATCH_SIZE', BULK_BATCH_SIZE), type=int)
+    if batch_size < 1 or batch_size > BULK_MAX_BATCH_SIZE:
+      abort(400)
+
+    try:
+      result = import_questions(request.stream, request.mimetype, batch_size)
+    except (UnicodeDecodeError, csv.Error):
+      abort(400)
+
+    return jsonify({
+      'success': True,
+      'status_code': 200,
+      'inserted': result.inserted,
+      'error_count': result.error_count,
+      'errors': result.errors
+    })
+
+
+  '''
+  Export: streams every question as NDJSON, one object per line.
+  '''
+  @app.route('/questions/export')
+  @router.read_only
+  def export_all_questions():
+    return app.response_class(
+      stream_with_context(export_questions()),
+      mimetype='application/x-ndjson'
+    )
+
+
+  '''
+  Batch delete and update: every question chosen by "ids" (a list of
+  question ids) or "filter" (category, difficulty and/or searchTerm) is
+  deleted, or has the fields in "set" changed, in one transaction.
+  '''
+  @app.route('/questions', methods=['DELETE'])
+  @limiter.limit('delete_questions')
+  def batch_delete_questions():
+    try:
+      deleted = delete_questions(request.get_json(silent=True))
+    except ValueError:
+      abort(400)
+
+    return jsonify({
+      'success': True,
+      'status_code': 200,
+      'deleted': deleted
+    })
+
+
+  @app.route('/questions', methods=['PATCH'])
+  @limiter.limit('update_questions')
+  def batch_update_questions():
+    try:
+      updated = update_questions(request.get_json(silent=True))
+    except ValueError:
+      abort(400)
+
+    return jsonify({
+      'success': True,
+      'status_code': 200,
+      'updated': updated
+    })
+
+
   '''
   @DONE: 
   Create a POST endpoint to get questions based on a search term. 
@@ -178,30 +312,32 @@ def create_app(test_config=None):
   Try using the word "title" to start. 
   '''
   @app.route('/questions/search', methods=['POST'])
+  @router.read_only
   def search_questions():
     body = request.get_json()
     search_term = body.get('searchTerm')
 
-    questions = Question.query
-
-    if search_term is not None:
-      questions = questions.filter(Question.question.ilike('%{}%'.format(search_term)))
-
-    selection = questions.order_by(Question.id).all()
-    current_questions = paginate_questions(request, selection)
+    if search_term is None:
+      try:
+        result = paginate_questions(request, Question.query, total=question_counts.total())
+      except ValueError:
+        abort(400)
+    elif isinstance(search_term, str):
+      result = find_questions(search_term, request.args.get('page', 1, type=int))
+    else:
+      abort(400)
 
-    total_questions = len(selection)
-    current_category = Category.query.first().format()
+    current_category = category_cache.first()
     
     output = {
       'success': True,
       'status_code': 200,
-      'questions': current_questions,
-      'total_questions': total_questions,
+      'questions': result.questions,
+      'total_questions': result.total_questions,
       'current_category': current_category
     }
 
-    return jsonify(output)
+    return page_response(result, output)
 
 
   '''
@@ -213,22 +349,30 @@ def create_app(test_config=None):
   category to be shown. 
   '''
   @app.route('/categories/<int:category_id>/questions')
+  @router.read_only
+  @conditional(Question.__tablename__, Category.__tablename__)
   def retrieve_questions_by_category(category_id):
-    category = Category.query.get(category_id)
+    category = category_cache.get(category_id)
 
     if category is None:
       abort(404)
 
-    selection = Question.query.filter(Question.category == category.id).all()
-    current_questions = paginate_questions(request, selection)
-    total_questions = len(selection)
+    try:
+      page = paginate_questions(
+        request,
+        Question.query.filter(Question.category == category['id']),
+        total=question_counts.get(category['id'])
+      )
+    except ValueError:
+      abort(400)
 
-    return jsonify({
+    return page_response(page, {
       'success': True,
       'status_code': 200,
-      'questions': current_questions,
-      'total_questions': total_questions,
-      'current_category': category.format()
+      'questions': page.questions,
+      'total_questions': page.total_questions,
+      'next_cursor': page.next_cursor,
+      'current_category': category
     })
 
 
@@ -244,33 +388,123 @@ def create_app(test_config=None):
   and shown whether they were correct or not. 
   '''
   @app.route('/quizzes', methods=['POST'])
+  @router.read_only
+  @limiter.limit('play_quiz')
   def play_quiz():
     body = request.get_json()
     
     quiz_category_id = body.get('quiz_category')['id']
     previous_questions = body.get('previous_questions')
 
-    if (Category.query.get(quiz_category_id) is None):
+    if (category_cache.get(quiz_category_id) is None):
       abort(404)
     
     if (type(previous_questions) is not list):
       abort(400)
 
-    # filter by category
-    category_questions = Question.query
-    if quiz_category_id != 0:
-      category_questions = Question.query.filter(Question.category == quiz_category_id)
+    try:
+      previous_questions = set(previous_questions)
+    except TypeError:
+      abort(400)
 
-    # filter by previous questions
-    for prev_q in previous_questions:
-      category_questions = category_questions.filter(Question.id != prev_q)
+    # with a count, a whole round of questions is returned at once; a
+    # round is not adaptive, so it cannot be combined with a difficulty
+    count = body.get('count')
+    if count is not None:
+      if type(count) is not int or count < 1 or count > QUIZ_MAX_COUNT:
+        abort(400)
+      if body.get('difficulty') is not None:
+        abort(400)
 
-    questions = category_questions.all()
-    current_question = None
+      return jsonify({
+        'success': True,
+        'status_code': 200,
+        'questions': draw_questions(quiz_category_id, previous_questions, count)
+      })
+
+    # adaptive mode: the client sends the difficulty it is at and whether
+    # the last answer was right, and gets the next difficulty back
+    difficulty = body.get('difficulty')
+    if difficulty is not None:
+      correct = body.get('last_answer_correct')
+      if (
+        type(difficulty) is not int
+        or difficulty < MIN_DIFFICULTY or difficulty > MAX_DIFFICULTY
+        or (correct is not None and type(correct) is not bool)
+      ):
+        abort(400)
+      difficulty = next_difficulty(difficulty, correct)
+
+    output = {
+      'success': True,
+      'status_code': 200,
+      'question': draw_question(quiz_category_id, previous_questions, difficulty=difficulty)
+    }
+    if difficulty is not None:
+      output['difficulty'] = difficulty
+
+    return jsonify(output)
+
+
+  '''
+  Quiz packs: a seeded, reproducible set of `count` questions from a
+  category, precomputed for scheduled events and served from a stored,
+  compressed file (see flaskr/packs.py).
+  '''
+  @app.route('/quizzes/packs')
+  @router.read_only
+  def retrieve_quiz_pack():
+    category_id = request.args.get('category', type=int)
+    count = request.args.get('count', type=int)
+    seed = request.args.get('seed', '')
+
+    if category_id is None or count is None or count < 1 or count > PACK_MAX_COUNT:
+      abort(400)
+
+    if category_cache.get(category_id) is None:
+      abort(404)
+
+    return pack_response(category_id, count, seed)
 
-    if len(questions) > 0:
-      random_num = random.randrange(len(questions))
-      current_question = questions[random_num].format()
+
+  '''
+  Quiz sessions: the server shuffles the category once and hands out
+  one question per turn, so clients do not resend previous_questions.
+  '''
+  @app.route('/quizzes/sessions', methods=['POST'])
+  @router.read_only
+  def create_quiz_session():
+    body = request.get_json()
+
+    try:
+      quiz_category_id = body.get('quiz_category')['id']
+    except (AttributeError, TypeError, KeyError):
+      abort(400)
+
+    if (category_cache.get(quiz_category_id) is None):
+      abort(404)
+
+    question_ids = quiz_source().shuffled(quiz_category_id)
+    token = quiz_sessions.create(question_ids)
+
+    return jsonify({
+      'success': True,
+      'status_code': 200,
+      'token': token,
+      'total_questions': len(question_ids)
+    })
+
+  @app.route('/quizzes/sessions/<token>/next', methods=['POST'])
+  @router.read_only
+  def next_quiz_question(token):
+    try:
+      question = next_session_question(quiz_sessions, token)
+    except KeyError:
+      abort(404)
+
+    current_question = None
+    if question is not None:
+      current_question = question.format()
 
     return jsonify({
       'success': True,
@@ -278,6 +512,10 @@ def create_app(test_config=None):
       'question': current_question
     })
 
+  @app.route('/metrics')
+  def metrics():
+    return app.response_class(metrics_text(profiler), mimetype='text/plain; version=0.0.4')
+
 
   '''
   @DONE: 
@@ -308,6 +546,14 @@ def create_app(test_config=None):
       'message': 'Method Not Allowed'
     }), 405
 
+  @app.errorhandler(415)
+  def unsupported_media_type(error):
+    return jsonify({
+      'success': False,
+      'error': 415,
+      'message': 'Unsupported Media Type'
+    }), 415
+
   @app.errorhandler(422)
   def unprocessable(error):
     return jsonify({
@@ -316,6 +562,16 @@ def create_app(test_config=None):
       'message': 'Unprocessable Entity'
     }), 422
 
+  @app.errorhandler(429)
+  def too_many_requests(error):
+    response = jsonify({
+      'success': False,
+      'error': 429,
+      'message': 'Too Many Requests'
+    })
+    response.headers['Retry-After'] = str(g.get('retry_after', 1))
+    return response, 429
+
   @app.errorhandler(500)
   def server_error(error):
     return jsonify({
@@ -324,5 +580,15 @@ def create_app(test_config=None):
       'message': 'Internal Server Error'
     }), 500
 
+  @app.errorhandler(503)
+  def service_unavailable(error):
+    response = jsonify({
+      'success': False,
+      'error': 503,
+      'message': 'Service Unavailable'
+    })
+    response.headers['Retry-After'] = str(g.get('retry_after', 1))
+    return response, 503
+
   
   return app
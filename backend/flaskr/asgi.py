@@ -0,0 +1,69 @@
+'''
+ASGI entry point for the trivia API.
+
+Serves the app built by create_app, with the same routes and error
+handlers, from an ASGI server such as uvicorn:
+
+    uvicorn --factory flaskr.asgi:create_asgi_app
+
+Flask 1.0 and SQLAlchemy 1.3 have no async request or session support,
+so each request still runs the synchronous view on a worker thread
+(asgiref's WsgiToAsgi). What the ASGI server adds is cheap waiting:
+thousands of open client connections are held on the event loop, and
+only as many requests as the connection pool can serve are let through
+to the threads at a time, instead of every connection tying up a
+worker.
+'''
+import asyncio
+
+from asgiref.wsgi import WsgiToAsgi
+
+from models import db, PoolConfig
+from . import create_app
+
+
+class AsyncTriviaApp:
+  def __init__(self, app, max_concurrency):
+    self.app = app
+    self.asgi = WsgiToAsgi(app)
+    self.max_concurrency = max_concurrency
+    self.semaphore = None
+
+  async def lifespan(self, receive, send):
+    while True:
+      message = await receive()
+      if message['type'] == 'lifespan.startup':
+        await send({'type': 'lifespan.startup.complete'})
+      elif message['type'] == 'lifespan.shutdown':
+        with self.app.app_context():
+          db.engine.dispose()
+        await send({'type': 'lifespan.shutdown.complete'})
+        return
+
+  async def __call__(self, scope, receive, send):
+    if scope['type'] == 'lifespan':
+      return await self.lifespan(receive, send)
+
+    # created here so it belongs to the server's running event loop
+    if self.semaphore is None:
+      self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async with self.semaphore:
+      await self.asgi(scope, receive, send)
+
+
+'''
+create_asgi_app(test_config)
+    builds the Flask app with create_app and wraps it for ASGI. At most
+    ASGI_MAX_CONCURRENCY requests run at once, by default the pool size
+    plus overflow so requests never queue inside the pool.
+'''
+def create_asgi_app(test_config=None):
+  app = create_app(test_config)
+
+  max_concurrency = app.config.get('ASGI_MAX_CONCURRENCY')
+  if max_concurrency is None:
+    pool_config = app.config.get('DB_POOL_CONFIG') or PoolConfig.from_env()
+    max_concurrency = pool_config.pool_size + pool_config.max_overflow
+
+  return AsyncTriviaApp(app, max_concurrency)
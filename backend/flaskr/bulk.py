@@ -0,0 +1,305 @@
+import csv
+import io
+import json
+
+from sqlalchemy import and_
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+
+from models import db, Question, question_rows, format_question_row, category_cache, question_counts, table_versions
+from .quiz import quiz_index, MIN_DIFFICULTY, MAX_DIFFICULTY
+from .search import trigram_index, escape_like
+from .serialization import dumps
+
+BULK_BATCH_SIZE = 1000
+BULK_MAX_BATCH_SIZE = 10000
+BULK_MAX_ERRORS = 100
+EXPORT_CHUNK_SIZE = 1000
+# ids per statement for DELETE / PATCH /questions with an id list; stays
+# under SQLite's limit of 999 bound parameters
+BULK_CHUNK_SIZE = 500
+# range of an SQL INTEGER column
+INT_MIN = -2 ** 31
+INT_MAX = 2 ** 31 - 1
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonlines')
+CSV_MIMETYPES = ('text/csv',)
+COLUMNS = ('question', 'answer', 'difficulty', 'category')
+
+
+'''
+questions_changed()
+    drops everything derived from the questions table after a write
+    that bypassed Question.insert/delete. The in-memory indexes are
+    rebuilt on their next use.
+'''
+def questions_changed():
+  question_counts.invalidate()
+  quiz_index.clear()
+  trigram_index.clear()
+  table_versions.bump(Question.__tablename__)
+
+
+def to_int(value):
+  if type(value) is str and value.strip().lstrip('-').isdigit():
+    value = int(value)
+  if type(value) is not int or value < INT_MIN or value > INT_MAX:
+    raise ValueError
+  return value
+
+
+def to_difficulty(value):
+  difficulty = to_int(value)
+  if difficulty < MIN_DIFFICULTY or difficulty > MAX_DIFFICULTY:
+    raise ValueError
+  return difficulty
+
+
+'''
+validate(record)
+    turns one parsed NDJSON object or CSV row into insert parameters,
+    raising ValueError with a message describing the first problem
+'''
+def validate(record):
+  if type(record) is not dict:
+    raise ValueError('expected an object')
+
+  question = record.get('question')
+  answer = record.get('answer')
+  if type(question) is not str or question == '':
+    raise ValueError('question is required')
+  if type(answer) is not str or answer == '':
+    raise ValueError('answer is required')
+
+  try:
+    difficulty = to_int(record.get('difficulty'))
+    category = to_int(record.get('category'))
+  except ValueError:
+    raise ValueError('difficulty and category must be integers')
+
+  if difficulty < MIN_DIFFICULTY or difficulty > MAX_DIFFICULTY:
+    raise ValueError('difficulty must be between {} and {}'.format(MIN_DIFFICULTY, MAX_DIFFICULTY))
+  if category_cache.get(category) is None:
+    raise ValueError('unknown category {}'.format(category))
+
+  return {'question': question, 'answer': answer, 'difficulty': difficulty, 'category': category}
+
+
+def read_ndjson(stream):
+  for line_number, line in enumerate(io.TextIOWrapper(stream, encoding='utf-8'), 1):
+    if line.strip() == '':
+      continue
+    try:
+      yield line_number, json.loads(line)
+    except ValueError:
+      yield line_number, None
+
+
+def read_csv(stream):
+  reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8', newline=''))
+  # line 1 holds the header
+  for line_number, row in enumerate(reader, 2):
+    yield line_number, row
+
+
+def copy_rows(rows):
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  for row in rows:
+    writer.writerow([row[column] for column in COLUMNS])
+  buffer.seek(0)
+
+  statement = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(Question.__tablename__, ', '.join(COLUMNS))
+  dbapi = db.engine.dialect.dbapi
+  cursor = db.session.connection().connection.cursor()
+  try:
+    cursor.copy_expert(statement, buffer)
+  except dbapi.Error as error:
+    # the raw cursor bypasses SQLAlchemy, wrap driver errors the way it would
+    raise DBAPIError.instance(statement, None, error, dbapi.Error)
+  finally:
+    cursor.close()
+
+
+def write_batch(rows):
+  if db.engine.dialect.name == 'postgresql':
+    copy_rows(rows)
+  else:
+    db.session.execute(Question.__table__.insert(), rows)
+  db.session.commit()
+
+
+'''
+ImportResult
+    number of inserted rows and the errors of rejected rows, each as
+    {'line': <line number in the upload>, 'error': <message>}. Only the
+    first BULK_MAX_ERRORS errors are kept; error_count has them all.
+'''
+class ImportResult:
+  def __init__(self):
+    self.inserted = 0
+    self.error_count = 0
+    self.errors = []
+
+  def reject(self, line_number, message):
+    self.error_count += 1
+    if len(self.errors) < BULK_MAX_ERRORS:
+      self.errors.append({'line': line_number, 'error': message})
+
+
+def flush(batch, result):
+  rows = [row for _, row in batch]
+
+  try:
+    write_batch(rows)
+    result.inserted += len(rows)
+    return
+  except SQLAlchemyError:
+    db.session.rollback()
+
+  # the batch was rejected as a whole, retry row by row to find the culprits
+  for line_number, row in batch:
+    try:
+      write_batch([row])
+      result.inserted += 1
+    except SQLAlchemyError as error:
+      db.session.rollback()
+      result.reject(line_number, str(error.orig if hasattr(error, 'orig') else error).strip())
+
+
+'''
+import_questions(stream, mimetype, batch_size)
+    reads NDJSON or CSV questions from a file-like `stream` and inserts
+    the valid ones in transactions of `batch_size` rows, using COPY on
+    Postgres and executemany elsewhere. Memory use is bounded by the
+    batch size, not by the size of the upload.
+'''
+def import_questions(stream, mimetype, batch_size=BULK_BATCH_SIZE):
+  records = read_ndjson(stream) if mimetype in NDJSON_MIMETYPES else read_csv(stream)
+  result = ImportResult()
+  batch = []
+
+  try:
+    for line_number, record in records:
+      try:
+        batch.append((line_number, validate(record)))
+      except ValueError as error:
+        result.reject(line_number, str(error) if record is not None else 'invalid JSON')
+        continue
+
+      if len(batch) >= batch_size:
+        flush(batch, result)
+        batch = []
+
+    if batch:
+      flush(batch, result)
+  finally:
+    if result.inserted:
+      questions_changed()
+
+  return result
+
+
+'''
+export_questions()
+    yields every question as one NDJSON line, reading the table through
+    a server-side cursor so memory stays flat however large it is
+'''
+def export_questions(chunk_size=EXPORT_CHUNK_SIZE):
+  rows = question_rows().order_by(Question.id).yield_per(chunk_size)
+
+  for row in rows:
+    yield dumps(format_question_row(row)) + b'\n'
+
+
+def to_str(value):
+  if type(value) is not str or value == '':
+    raise ValueError
+  return value
+
+
+def to_category(value):
+  category = to_int(value)
+  if category_cache.get(category) is None:
+    raise ValueError
+  return category
+
+
+UPDATABLE_FIELDS = {'question': to_str, 'answer': to_str, 'difficulty': to_difficulty, 'category': to_category}
+FILTER_FIELDS = {'category': to_int, 'difficulty': to_difficulty, 'searchTerm': to_str}
+
+
+'''
+selection(body)
+    the rows a DELETE or PATCH /questions request applies to, as a list
+    of where clauses. Either "ids": a list of question ids, or "filter":
+    an object with at least one of category, difficulty and searchTerm
+    (a case-insensitive substring of the question). The id list comes
+    back split into chunks of BULK_CHUNK_SIZE, one clause each. Raises
+    ValueError for anything else.
+'''
+def selection(body):
+  if type(body) is not dict or ('ids' in body) == ('filter' in body):
+    raise ValueError('expected either ids or filter')
+
+  if 'ids' in body:
+    ids = body['ids']
+    if type(ids) is not list or not ids or any(type(question_id) is not int for question_id in ids):
+      raise ValueError('ids must be a non-empty list of integers')
+    return [
+      Question.id.in_(ids[start:start + BULK_CHUNK_SIZE]) for start in range(0, len(ids), BULK_CHUNK_SIZE)
+    ]
+
+  spec = body['filter']
+  if type(spec) is not dict or not spec or not set(spec) <= set(FILTER_FIELDS):
+    raise ValueError('filter takes category, difficulty and searchTerm')
+  values = {name: FILTER_FIELDS[name](value) for name, value in spec.items()}
+
+  clauses = []
+  if 'category' in values:
+    clauses.append(Question.category == values['category'])
+  if 'difficulty' in values:
+    clauses.append(Question.difficulty == values['difficulty'])
+  if 'searchTerm' in values:
+    clauses.append(Question.question.ilike('%{}%'.format(escape_like(values['searchTerm'])), escape='\\'))
+  return [and_(*clauses)]
+
+
+def changes(body):
+  fields = body.get('set')
+  if type(fields) is not dict or not fields or not set(fields) <= set(UPDATABLE_FIELDS):
+    raise ValueError('set takes question, answer, difficulty and category')
+  return {name: UPDATABLE_FIELDS[name](value) for name, value in fields.items()}
+
+
+def execute_all(statements):
+  affected = 0
+  try:
+    for statement in statements:
+      affected += db.session.execute(statement).rowcount
+    db.session.commit()
+  except SQLAlchemyError:
+    db.session.rollback()
+    raise
+
+  if affected:
+    questions_changed()
+  return affected
+
+
+'''
+delete_questions(body) / update_questions(body)
+    delete, or set the fields in body["set"] on, every question chosen by
+    selection(body) with set-based statements in a single transaction,
+    and return the number of rows affected
+'''
+def delete_questions(body):
+  table = Question.__table__
+  return execute_all(table.delete().where(clause) for clause in selection(body))
+
+
+def update_questions(body):
+  table = Question.__table__
+  # selection() checks that body is an object before changes() reads it
+  clauses = selection(body)
+  values = changes(body)
+  return execute_all(table.update().where(clause).values(**values) for clause in clauses)
@@ -0,0 +1,154 @@
+'''
+Response compression.
+
+compress_response(response) runs in the app's after_request handler and
+encodes JSON and text bodies of at least COMPRESSION_MIN_SIZE bytes with
+brotli or gzip, whichever the client prefers (brotli only when the
+optional brotli package is installed). Streamed responses are left
+alone.
+
+Responses that carry an ETag (see http_cache.conditional) are also kept
+in a bounded LRU cache, keyed by ETag and encoding, as the exact bytes
+that were sent. The ETag already identifies the url and the version of
+every table the body was built from, so conditional() can answer a
+repeat request straight from the cache, without running the view,
+encoding JSON or compressing anything. A compressed body is a different
+representation, so its ETag gets the content coding appended
+("<etag>-gzip") and caches never confuse it with the identity body.
+'''
+import gzip
+import threading
+from collections import OrderedDict
+
+from flask import current_app, request
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSION_CACHE_SIZE = 256
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/csv', 'text/plain')
+
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+IDENTITY = 'identity'
+
+
+def encode(body, encoding):
+  if encoding == 'br':
+    return brotli.compress(body, quality=current_app.config.get('COMPRESSION_BROTLI_QUALITY', COMPRESSION_BROTLI_QUALITY))
+  return gzip.compress(body, compresslevel=current_app.config.get('COMPRESSION_GZIP_LEVEL', COMPRESSION_GZIP_LEVEL))
+
+
+def compression_enabled():
+  return current_app.config.get('COMPRESSION', True)
+
+
+def encoded_etag(etag, content_encoding):
+  if content_encoding is None or content_encoding == IDENTITY:
+    return etag
+  return '{}-{}'.format(etag, content_encoding)
+
+
+'''
+negotiate_encoding()
+    the content coding to use for the current request: the best match
+    from Accept-Encoding among the supported ones, else 'identity'
+'''
+def negotiate_encoding():
+  if not compression_enabled():
+    return IDENTITY
+  return request.accept_encodings.best_match(ENCODINGS) or IDENTITY
+
+
+'''
+ResponseCache
+    LRU of response bodies as sent: (etag, encoding) -> (body,
+    content encoding or None, mimetype). Holds at most `max_entries`.
+'''
+class ResponseCache:
+  def __init__(self, max_entries=COMPRESSION_CACHE_SIZE):
+    self.max_entries = max_entries
+    self.lock = threading.Lock()
+    self.entries = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, etag, encoding):
+    with self.lock:
+      entry = self.entries.get((etag, encoding))
+      if entry is None:
+        self.misses += 1
+        return None
+      self.entries.move_to_end((etag, encoding))
+      self.hits += 1
+      return entry
+
+  def put(self, etag, encoding, entry):
+    with self.lock:
+      self.entries[(etag, encoding)] = entry
+      self.entries.move_to_end((etag, encoding))
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+
+  def stats(self):
+    return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+
+response_cache = ResponseCache()
+
+
+'''
+cached_response(etag)
+    the cached response for `etag` in the encoding the client accepts,
+    or None
+'''
+def cached_response(etag):
+  entry = response_cache.get(etag, negotiate_encoding())
+  if entry is None:
+    return None
+
+  body, content_encoding, mimetype = entry
+  response = current_app.response_class(body, mimetype=mimetype)
+  if content_encoding is not None:
+    response.headers['Content-Encoding'] = content_encoding
+  response.vary.add('Accept-Encoding')
+  response.set_etag(encoded_etag(etag, content_encoding))
+  return response
+
+
+def compress_response(response):
+  if (
+    response.status_code != 200
+    or response.direct_passthrough
+    or response.is_streamed
+    or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    or 'Content-Encoding' in response.headers
+  ):
+    return response
+
+  response.vary.add('Accept-Encoding')
+  encoding = negotiate_encoding()
+  body = response.get_data()
+
+  content_encoding = None
+  if encoding != IDENTITY and len(body) >= current_app.config.get('COMPRESSION_MIN_SIZE', COMPRESSION_MIN_SIZE):
+    body = encode(body, encoding)
+    content_encoding = encoding
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+
+  etag, _ = response.get_etag()
+  if etag is not None:
+    if compression_enabled():
+      response_cache.put(etag, encoding, (body, content_encoding, response.mimetype))
+    response.set_etag(encoded_etag(etag, content_encoding))
+
+  return response
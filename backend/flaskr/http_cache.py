@@ -0,0 +1,88 @@
+import calendar
+import functools
+import hashlib
+import time
+
+from flask import current_app, request, make_response
+
+from models import table_versions
+from .compression import cached_response, encoded_etag, negotiate_encoding
+
+# ETags also change, and Last-Modified moves forward, every ETAG_MAX_AGE
+# seconds, which bounds how long a worker can validate a response that
+# another worker's write made stale
+ETAG_MAX_AGE = 60
+CACHE_MAX_AGE = 0
+CACHE_SHARED_MAX_AGE = 10
+
+
+def time_bucket():
+  return int(time.time() // ETAG_MAX_AGE)
+
+
+def compute_etag(tables):
+  parts = [table_versions.epoch, str(time_bucket()), request.full_path]
+  parts.extend('{}:{}'.format(table, table_versions.get(table)) for table in tables)
+  return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def cache_control(response):
+  response.cache_control.public = True
+  response.cache_control.max_age = current_app.config.get('CACHE_MAX_AGE', CACHE_MAX_AGE)
+  response.cache_control.s_maxage = current_app.config.get('CACHE_SHARED_MAX_AGE', CACHE_SHARED_MAX_AGE)
+  return response
+
+
+'''
+conditional(*tables)
+    decorator for GET endpoints whose output depends only on the given
+    tables and the request url. `tables` may also be a single function
+    returning the table names, for endpoints whose dependencies vary
+    with the query string. Adds a strong ETag (one per content coding,
+    see compression), Last-Modified and Cache-Control to successful
+    responses, and answers a matching If-None-Match (or a fresh enough
+    If-Modified-Since) with 304 before the view, and therefore the
+    database, is reached. Other repeat
+    requests are served from the compression module's response cache
+    when the body for this ETag is still in it.
+'''
+def conditional(*tables):
+  def decorator(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+      names = tables[0]() if callable(tables[0]) else tables
+      etag = compute_etag(names)
+      last_modified = int(max(table_versions.last_modified(table) for table in names))
+      # this process only sees its own writes, so never claim a date
+      # older than the current bucket, as with the ETag
+      last_modified = max(last_modified, time_bucket() * ETAG_MAX_AGE)
+
+      if request.if_none_match:
+        # the client may hold the body in its negotiated encoding, or
+        # uncompressed when it was too small to compress
+        matched = encoded_etag(etag, negotiate_encoding())
+        if not request.if_none_match.contains(matched):
+          matched = etag
+        not_modified = request.if_none_match.contains(matched)
+      else:
+        matched = etag
+        since = request.if_modified_since
+        not_modified = since is not None and calendar.timegm(since.utctimetuple()) >= last_modified
+
+      if not_modified:
+        response = current_app.response_class(status=304)
+        response.set_etag(matched)
+      else:
+        response = cached_response(etag)
+        if response is None:
+          response = make_response(view(*args, **kwargs))
+          if response.status_code != 200:
+            return response
+          # compress_response appends the content coding when it compresses
+          response.set_etag(etag)
+
+      response.last_modified = last_modified
+      return cache_control(response)
+
+    return wrapper
+  return decorator
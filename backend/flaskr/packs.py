@@ -0,0 +1,235 @@
+'''
+Precomputed quiz packs.
+
+For scheduled events the category and number of questions are known
+ahead of time, so instead of every player drawing from POST /quizzes a
+pack is computed once: `count` questions of a category, picked by a
+random generator seeded with the category, count and an event `seed`.
+The same inputs over the same questions always give the same pack, in
+any process.
+
+Each pack is stamped with a version, a hash of every question in its
+category, and stored gzip-compressed (with a fixed mtime, so the bytes
+are reproducible too) under PACKS_DIR as
+
+    <category>-<count>-<seed key>-<version>.json.gz   immutable
+    <category>-<count>-<seed key>.json.gz             the latest version
+
+so the directory can also be served as static files. Packs are only
+built by `flask packs`: GET /quizzes/packs serves the packs found in
+PACKS_DIR and answers 404 for any other category, count or seed, so
+requests never add files. A change to any question of the category
+changes the version, and an already built pack is then rebuilt on its
+next request, replacing the files of the old version.
+'''
+import gzip
+import hashlib
+import os
+import random
+import tempfile
+import threading
+import time
+
+import click
+from flask import abort, current_app, request
+from flask.cli import with_appcontext
+
+from models import Question, question_rows, format_question_row, category_cache, table_versions
+from .compression import compression_enabled
+from .serialization import dumps
+
+PACK_MAX_COUNT = 200
+PACK_VERSION_MAX_AGE = 60
+PACK_CACHE_MAX_AGE = 60
+
+
+def seed_key(seed):
+  return hashlib.sha1(seed.encode('utf-8')).hexdigest()[:16]
+
+
+def category_questions(category):
+  rows = question_rows(Question.query.filter(Question.category == category)).order_by(Question.id)
+  return [format_question_row(row) for row in rows]
+
+
+'''
+category_version(questions)
+    the version stamp of a category: a hash of its questions, in id order
+'''
+def category_version(questions):
+  digest = hashlib.sha256()
+  for question in questions:
+    digest.update(dumps(question))
+  return digest.hexdigest()[:16]
+
+
+'''
+build_pack(category, count, seed)
+    the pack for `category` as a dict. The questions are a seeded sample
+    of the category in id order, so the same inputs give the same pack.
+'''
+def build_pack(category, count, seed):
+  questions = category_questions(category)
+  rng = random.Random('{}:{}:{}'.format(category, count, seed))
+  picked = rng.sample(questions, min(count, len(questions)))
+
+  return {
+    'success': True,
+    'status_code': 200,
+    'category': category_cache.get(category),
+    'count': len(picked),
+    'seed': seed,
+    'version': category_version(questions),
+    'questions': picked
+  }
+
+
+'''
+PackVersions
+    per-process cache of category version stamps. An entry is dropped
+    when this process writes to the questions table, and after `max_age`
+    seconds so other processes' writes are picked up.
+'''
+class PackVersions:
+  def __init__(self, max_age=PACK_VERSION_MAX_AGE):
+    self.max_age = max_age
+    self.lock = threading.Lock()
+    self.versions = {}
+
+  def get(self, category):
+    questions_version = table_versions.get(Question.__tablename__)
+    with self.lock:
+      entry = self.versions.get(category)
+    if entry is not None:
+      version, seen_version, computed_at = entry
+      if seen_version == questions_version and time.monotonic() - computed_at <= self.max_age:
+        return version
+
+    version = category_version(category_questions(category))
+    self.put(category, version, questions_version)
+    return version
+
+  def put(self, category, version, questions_version=None):
+    if questions_version is None:
+      questions_version = table_versions.get(Question.__tablename__)
+    with self.lock:
+      self.versions[category] = (version, questions_version, time.monotonic())
+
+
+pack_versions = PackVersions()
+
+
+'''
+PackStore
+    the compressed pack files in `directory`. Files are written to a
+    temporary name and renamed into place, so a reader, or a static file
+    server, never sees a partial pack.
+'''
+class PackStore:
+  def __init__(self, directory):
+    self.directory = directory
+
+  def name(self, category, count, seed, version=None):
+    parts = [str(category), str(count), seed_key(seed)]
+    if version is not None:
+      parts.append(version)
+    return os.path.join(self.directory, '-'.join(parts) + '.json.gz')
+
+  def read(self, category, count, seed, version):
+    try:
+      with open(self.name(category, count, seed, version), 'rb') as pack_file:
+        return pack_file.read()
+    except FileNotFoundError:
+      return None
+
+  def write_file(self, path, body):
+    handle, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.pack-')
+    try:
+      with os.fdopen(handle, 'wb') as out:
+        out.write(body)
+      os.replace(temp_path, path)
+    except BaseException:
+      os.unlink(temp_path)
+      raise
+
+  '''
+  build(category, count, seed)
+      builds the pack, stores it under its version and as the latest,
+      removes older versions of it and returns (version, compressed body)
+  '''
+  def build(self, category, count, seed):
+    pack = build_pack(category, count, seed)
+    body = gzip.compress(dumps(pack), mtime=0)
+    os.makedirs(self.directory, exist_ok=True)
+
+    versioned = self.name(category, count, seed, pack['version'])
+    latest = self.name(category, count, seed)
+    self.write_file(versioned, body)
+    self.write_file(latest, body)
+
+    prefix = os.path.basename(latest)[:-len('.json.gz')] + '-'
+    for name in os.listdir(self.directory):
+      if name.startswith(prefix) and name != os.path.basename(versioned):
+        os.remove(os.path.join(self.directory, name))
+
+    pack_versions.put(category, pack['version'])
+    return pack['version'], body
+
+
+def init_packs(app):
+  directory = app.config.get('PACKS_DIR', os.environ.get('TRIVIA_PACKS_DIR'))
+  app.extensions['packs'] = PackStore(directory or os.path.join(app.instance_path, 'packs'))
+
+
+'''
+pack_response(category, count, seed)
+    the pack as a response: 304 when the client has this version, else
+    the stored file, rebuilt first when it is outdated, and 404 when the
+    pack was never built. Sent gzipped as stored to clients that accept
+    it, decompressed to the others; the ETag of the gzipped body ends in
+    -gzip so the two bodies never share a validator.
+'''
+def pack_response(category, count, seed):
+  store = current_app.extensions['packs']
+  version = pack_versions.get(category)
+  gzipped = compression_enabled() and request.accept_encodings['gzip']
+  suffix = '-gzip' if gzipped else ''
+  etag = os.path.basename(store.name(category, count, seed, version)) + suffix
+
+  if request.if_none_match.contains(etag):
+    response = current_app.response_class(status=304)
+  else:
+    body = store.read(category, count, seed, version)
+    if body is None:
+      if not os.path.exists(store.name(category, count, seed)):
+        abort(404)
+      version, body = store.build(category, count, seed)
+      etag = os.path.basename(store.name(category, count, seed, version)) + suffix
+
+    response = current_app.response_class(mimetype='application/json')
+    if gzipped:
+      response.set_data(body)
+      response.headers['Content-Encoding'] = 'gzip'
+    else:
+      response.set_data(gzip.decompress(body))
+
+  response.vary.add('Accept-Encoding')
+  response.set_etag(etag)
+  response.cache_control.public = True
+  response.cache_control.max_age = current_app.config.get('PACK_CACHE_MAX_AGE', PACK_CACHE_MAX_AGE)
+  return response
+
+
+@click.command('packs')
+@click.option('--category', 'categories', type=int, multiple=True, help='category id, repeatable (default: all)')
+@click.option('--count', type=click.IntRange(1, PACK_MAX_COUNT), required=True, help='questions per pack')
+@click.option('--seed', default='', help='event seed; the same seed gives the same pack')
+@with_appcontext
+def packs_command(categories, count, seed):
+  '''Build quiz packs into PACKS_DIR.'''
+  store = current_app.extensions['packs']
+  for category in categories or [category['id'] for category in category_cache.all()]:
+    if category_cache.get(category) is None:
+      raise click.BadParameter('unknown category {}'.format(category), param_hint='--category')
+    version, body = store.build(category, count, seed)
+    click.echo('{} ({} bytes)'.format(store.name(category, count, seed, version), len(body)))
@@ -0,0 +1,181 @@
+import base64
+import binascii
+import json
+
+from flask import current_app, stream_with_context
+
+from models import Question, question_rows, format_question_row
+from .serialization import dumps, jsonify
+
+QUESTIONS_PER_PAGE = 10
+MAX_PER_PAGE = 100000
+STREAM_THRESHOLD = 1000
+STREAM_CHUNK_SIZE = 1000
+
+'''
+Cursors
+    opaque, url-safe tokens holding the id of the last question
+    returned, so the next page can be fetched with `id > last_id`
+'''
+def encode_cursor(last_id):
+  payload = json.dumps({'id': last_id}, separators=(',', ':')).encode('utf-8')
+  return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+  try:
+    padded = cursor + '=' * (-len(cursor) % 4)
+    last_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))['id']
+  except (ValueError, TypeError, KeyError, binascii.Error):
+    raise ValueError('invalid cursor')
+
+  if type(last_id) is not int:
+    raise ValueError('invalid cursor')
+
+  return last_id
+
+
+'''
+Page
+    one page of formatted questions plus the total number of matches
+    and the cursor for the page after it (None on the last page)
+'''
+class Page:
+  streamed = False
+
+  def __init__(self, questions, total_questions, next_cursor):
+    self.questions = questions
+    self.total_questions = total_questions
+    self.next_cursor = next_cursor
+
+  @property
+  def empty(self):
+    return len(self.questions) == 0
+
+
+'''
+StreamedPage
+    a page whose rows are read from a server-side cursor while the
+    response is being sent. Only the first row is fetched up front, to
+    tell whether the page is empty; `next_cursor` is only known once
+    chunks() has written every row.
+'''
+class StreamedPage:
+  streamed = True
+
+  def __init__(self, rows, total_questions, per_page):
+    self.rows = iter(rows)
+    self.first = next(self.rows, None)
+    self.total_questions = total_questions
+    self.per_page = per_page
+    self.questions = None
+    self.next_cursor = None
+
+  @property
+  def empty(self):
+    return self.first is None
+
+  def chunks(self, envelope):
+    yield b'{"questions":['
+
+    buffer = []
+    count = 0
+    last_id = None
+    row = self.first
+    while row is not None:
+      if count == self.per_page:
+        self.next_cursor = encode_cursor(last_id)
+        break
+
+      buffer.append(dumps(format_question_row(row)))
+      count += 1
+      last_id = row.id
+
+      if len(buffer) == STREAM_CHUNK_SIZE:
+        yield (b'' if count == len(buffer) else b',') + b','.join(buffer)
+        buffer = []
+      row = next(self.rows, None)
+
+    if buffer:
+      yield (b'' if count == len(buffer) else b',') + b','.join(buffer)
+
+    envelope = dict(envelope, total_questions=self.total_questions, next_cursor=self.next_cursor)
+    envelope.pop('questions', None)
+    yield b'],' + dumps(envelope)[1:] + b'\n'
+
+
+def per_page_arg(request):
+  per_page = request.args.get('per_page', QUESTIONS_PER_PAGE, type=int)
+  if per_page < 1 or per_page > MAX_PER_PAGE:
+    raise ValueError('invalid per_page')
+  return per_page
+
+
+'''
+wants_stream(request, per_page)
+    `?stream=1` / `?stream=0` pick the mode explicitly; otherwise pages
+    above STREAM_THRESHOLD rows are streamed
+'''
+def wants_stream(request, per_page):
+  stream = request.args.get('stream')
+  if stream is None:
+    return per_page > STREAM_THRESHOLD
+  return stream not in ('0', 'false')
+
+
+'''
+paginate_questions(request, query)
+    runs one page of `query` in the database, ordered by question id.
+    Uses keyset pagination when the request carries a `cursor`
+    argument and LIMIT/OFFSET on `page` otherwise. The page size comes
+    from `per_page` (default QUESTIONS_PER_PAGE); large pages, or any
+    page with `stream=1`, come back as a StreamedPage. Callers that
+    know the number of matches pass it as `total`; otherwise the query
+    is counted.
+    Raises ValueError for a malformed cursor or page size.
+'''
+def paginate_questions(request, query, per_page=None, total=None):
+  cursor = request.args.get('cursor')
+  if per_page is None:
+    per_page = per_page_arg(request)
+  total_questions = total if total is not None else query.order_by(None).count()
+
+  if cursor is not None:
+    last_id = decode_cursor(cursor)
+    query = query.filter(Question.id > last_id).order_by(Question.id)
+  else:
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+      return Page([], total_questions, None)
+    query = query.order_by(Question.id).offset((page - 1) * per_page)
+
+  query = question_rows(query).limit(per_page + 1)
+
+  if wants_stream(request, per_page):
+    return StreamedPage(query.yield_per(STREAM_CHUNK_SIZE), total_questions, per_page)
+
+  rows = query.all()
+
+  next_cursor = None
+  if len(rows) > per_page:
+    rows = rows[:per_page]
+    next_cursor = encode_cursor(rows[-1].id)
+
+  questions = [format_question_row(row) for row in rows]
+
+  return Page(questions, total_questions, next_cursor)
+
+
+'''
+page_response(page, output)
+    jsonify(output), or for a StreamedPage a chunked response that
+    writes output with the questions array filled in as rows arrive
+'''
+def page_response(page, output):
+  if not page.streamed:
+    return jsonify(output)
+
+  return current_app.response_class(
+    stream_with_context(page.chunks(output)),
+    mimetype='application/json'
+  )
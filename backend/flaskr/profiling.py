@@ -0,0 +1,270 @@
+'''
+Per-request profiling and SQL instrumentation.
+
+Enabled with the PROFILING config value (or TRIVIA_PROFILING=1 in the
+environment). When enabled every request records its wall time, the
+time spent in SQL statements and the statements themselves, using the
+SQLAlchemy before/after_cursor_execute events. The numbers are returned
+in a Server-Timing header and aggregated per route into histograms that
+GET /metrics exports in Prometheus text format. Requests slower than
+PROFILING_SLOW_MS are logged together with their SQL.
+
+PROFILING_SAMPLER additionally samples the stack of every request
+thread each PROFILING_SAMPLE_INTERVAL seconds and writes the stacks of
+slow requests to PROFILING_DIR in the collapsed format read by
+flamegraph.pl and speedscope.
+
+When profiling is disabled none of the hooks are installed, so the
+only cost left is the /metrics route.
+'''
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import category_cache, pool_stats
+from .compression import response_cache
+
+PROFILING_SLOW_MS = 500
+PROFILING_SAMPLE_INTERVAL = 0.005
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+  def __init__(self, buckets):
+    self.buckets = buckets
+    self.counts = [0] * len(buckets)
+    self.count = 0
+    self.sum = 0.0
+
+  def observe(self, value):
+    self.count += 1
+    self.sum += value
+    for index, bound in enumerate(self.buckets):
+      if value <= bound:
+        self.counts[index] += 1
+
+  def lines(self, name, labels):
+    lines = []
+    for bound, count in zip(self.buckets, self.counts):
+      lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, count))
+    lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, self.count))
+    lines.append('{}_sum{{{}}} {}'.format(name, labels, self.sum))
+    lines.append('{}_count{{{}}} {}'.format(name, labels, self.count))
+    return lines
+
+
+'''
+RequestProfile
+    what one request spent: wall time, SQL time and statements
+'''
+class RequestProfile:
+  def __init__(self):
+    self.started_at = time.perf_counter()
+    self.db_seconds = 0.0
+    self.statements = []
+
+
+'''
+Sampler
+    daemon thread that records the current stack of every thread
+    registered with track(), as collapsed "frame;frame;frame" strings
+'''
+class Sampler(threading.Thread):
+  def __init__(self, interval):
+    super().__init__(name='trivia-sampler', daemon=True)
+    self.interval = interval
+    self.lock = threading.Lock()
+    self.active = {}
+
+  def track(self, thread_id):
+    with self.lock:
+      self.active[thread_id] = Counter()
+
+  def untrack(self, thread_id):
+    with self.lock:
+      return self.active.pop(thread_id, Counter())
+
+  def run(self):
+    while True:
+      time.sleep(self.interval)
+      frames = sys._current_frames()
+      with self.lock:
+        for thread_id, stacks in self.active.items():
+          frame = frames.get(thread_id)
+          if frame is not None:
+            stacks[collapse(frame)] += 1
+
+
+def collapse(frame):
+  names = []
+  while frame is not None:
+    code = frame.f_code
+    names.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+    frame = frame.f_back
+  return ';'.join(reversed(names))
+
+
+class Profiler:
+  def __init__(self, app):
+    self.app = app
+    self.slow_seconds = app.config.get('PROFILING_SLOW_MS', PROFILING_SLOW_MS) / 1000
+    self.lock = threading.Lock()
+    self.requests = {}
+    self.sampler = None
+    self.profile_dir = None
+
+    if app.config.get('PROFILING_SAMPLER'):
+      self.profile_dir = app.config.get('PROFILING_DIR') or os.path.join(tempfile.gettempdir(), 'trivia-profiles')
+      os.makedirs(self.profile_dir, exist_ok=True)
+      self.start_sampler()
+      # threads do not survive a fork, preloading servers need a new one in each worker
+      os.register_at_fork(after_in_child=self.start_sampler)
+
+    app.before_request(self.start)
+
+  def start_sampler(self):
+    self.sampler = Sampler(self.app.config.get('PROFILING_SAMPLE_INTERVAL', PROFILING_SAMPLE_INTERVAL))
+    self.sampler.start()
+
+  def start(self):
+    g.profile = RequestProfile()
+    if self.sampler is not None:
+      self.sampler.track(threading.get_ident())
+
+  '''
+  finish(response)
+      called from the app's after_request handler: sets Server-Timing,
+      updates the route histograms and reports slow requests
+  '''
+  def finish(self, response):
+    profile = g.pop('profile', None)
+    if profile is None:
+      return response
+
+    wall_seconds = time.perf_counter() - profile.started_at
+    stacks = self.sampler.untrack(threading.get_ident()) if self.sampler is not None else None
+
+    response.headers.add('Server-Timing', 'app;dur={:.2f}'.format(wall_seconds * 1000))
+    response.headers.add('Server-Timing', 'db;dur={:.2f};desc="{} queries"'.format(
+      profile.db_seconds * 1000, len(profile.statements)))
+
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    key = (route, request.method)
+    with self.lock:
+      if key not in self.requests:
+        self.requests[key] = (
+          Histogram(DURATION_BUCKETS), Histogram(DURATION_BUCKETS), Histogram(QUERY_COUNT_BUCKETS))
+      wall, database, queries = self.requests[key]
+      wall.observe(wall_seconds)
+      database.observe(profile.db_seconds)
+      queries.observe(len(profile.statements))
+
+    if wall_seconds >= self.slow_seconds:
+      self.report_slow(route, wall_seconds, profile, stacks)
+
+    return response
+
+  def report_slow(self, route, wall_seconds, profile, stacks):
+    self.app.logger.warning('slow request %s %s: %.1f ms, %.1f ms in %d SQL statements:\n%s',
+      request.method, request.full_path, wall_seconds * 1000, profile.db_seconds * 1000,
+      len(profile.statements), '\n'.join(
+        '  {:.1f} ms  {}'.format(seconds * 1000, statement) for statement, seconds in profile.statements))
+
+    if stacks:
+      name = '{}-{}-{}.folded'.format(int(time.time() * 1000), request.method, re.sub(r'\W+', '_', route).strip('_'))
+      with open(os.path.join(self.profile_dir, name), 'w') as handle:
+        for stack, count in stacks.items():
+          handle.write('{} {}\n'.format(stack, count))
+
+  def metric_lines(self):
+    lines = []
+    names = (
+      ('trivia_request_duration_seconds', 'Wall time per request.'),
+      ('trivia_request_db_duration_seconds', 'Time spent in SQL statements per request.'),
+      ('trivia_request_db_queries', 'Number of SQL statements per request.')
+    )
+    with self.lock:
+      requests = sorted(self.requests.items())
+
+    for index, (name, description) in enumerate(names):
+      lines.append('# HELP {} {}'.format(name, description))
+      lines.append('# TYPE {} histogram'.format(name))
+      for (route, method), histograms in requests:
+        labels = 'route="{}",method="{}"'.format(route, method)
+        lines.extend(histograms[index].lines(name, labels))
+    return lines
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  if has_request_context() and 'profile' in g:
+    conn.info.setdefault('query_started_at', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  started = conn.info.get('query_started_at')
+  if started and has_request_context() and 'profile' in g:
+    seconds = time.perf_counter() - started.pop()
+    g.profile.db_seconds += seconds
+    g.profile.statements.append((statement, seconds))
+
+
+'''
+init_profiling(app)
+    returns a Profiler when profiling is enabled for `app`, else None
+'''
+def init_profiling(app):
+  enabled = app.config.get('PROFILING')
+  if enabled is None:
+    enabled = os.environ.get('TRIVIA_PROFILING', '').lower() in ('1', 'true', 'yes', 'on')
+  if not enabled:
+    return None
+
+  if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+  return Profiler(app)
+
+
+'''
+metrics_text(profiler)
+    Prometheus text exposition of the request histograms (when
+    profiling is on), the category cache counters and the pool state
+'''
+def metrics_text(profiler):
+  lines = []
+  if profiler is not None:
+    lines.extend(profiler.metric_lines())
+
+  cache = category_cache.stats()
+  lines.append('# TYPE trivia_category_cache_hits_total counter')
+  lines.append('trivia_category_cache_hits_total {}'.format(cache['hits']))
+  lines.append('# TYPE trivia_category_cache_misses_total counter')
+  lines.append('trivia_category_cache_misses_total {}'.format(cache['misses']))
+
+  responses = response_cache.stats()
+  lines.append('# TYPE trivia_response_cache_hits_total counter')
+  lines.append('trivia_response_cache_hits_total {}'.format(responses['hits']))
+  lines.append('# TYPE trivia_response_cache_misses_total counter')
+  lines.append('trivia_response_cache_misses_total {}'.format(responses['misses']))
+
+  for name, value in sorted(pool_stats().items()):
+    lines.append('# TYPE trivia_db_pool_{} gauge'.format(name))
+    lines.append('trivia_db_pool_{} {}'.format(name, value))
+
+  replicas = current_app.extensions.get('replicas')
+  if replicas:
+    lines.append('# TYPE trivia_db_replica_healthy gauge')
+    for bind, healthy in replicas.stats().items():
+      lines.append('trivia_db_replica_healthy{{bind="{}"}} {}'.format(bind, int(healthy)))
+
+  return '\n'.join(lines) + '\n'
@@ -0,0 +1,280 @@
+import random
+import threading
+import time
+
+from flask import current_app
+
+from models import db, Question, question_rows, format_question_row
+
+ALL_CATEGORIES = 0
+QUIZ_INDEX_MAX_AGE = 60
+QUIZ_MAX_COUNT = 50
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+
+'''
+sample(ids, previous, count)
+    returns up to `count` distinct random ids from the sequence `ids`
+    that are not in the set `previous`; fewer when it runs out.
+
+    Runs a partial Fisher-Yates shuffle, recording swaps in a dict
+    instead of copying the sequence, and stops once `count` unseen ids
+    are found. Expected cost is about count * n / (n - len(previous))
+    steps, i.e. O(count) until most of the ids have been played.
+'''
+def sample(ids, previous, count, rng=random):
+  picked = []
+  size = len(ids)
+  swaps = {}
+
+  for i in range(size):
+    j = rng.randrange(i, size)
+    question_id = swaps.get(j, ids[j])
+    swaps[j] = swaps.get(i, ids[i])
+    if question_id not in previous:
+      picked.append(question_id)
+      if len(picked) == count:
+        break
+
+  return picked
+
+
+'''
+QuizSource
+    the draws shared by QuizIndex and the memory-mapped Snapshot in
+    flaskr/snapshot.py, on top of their draw_many(key, previous, count).
+    Keys are a category id, ALL_CATEGORIES, or a (category, difficulty)
+    pair.
+'''
+class QuizSource:
+  '''
+  draw(category, previous)
+      returns a random id from `category` that is not in the set
+      `previous`, or None when every question has been played
+  '''
+  def draw(self, category, previous, rng=random):
+    picked = self.draw_many(category, previous, 1, rng)
+    return picked[0] if picked else None
+
+  '''
+  draw_near(category, difficulty, previous)
+      like draw, but from the questions of `difficulty` in `category`.
+      When those are used up the band widens one level at a time, the
+      harder level first.
+  '''
+  def draw_near(self, category, difficulty, previous, rng=random):
+    for distance in range(MAX_DIFFICULTY - MIN_DIFFICULTY + 1):
+      for level in (difficulty + distance, difficulty - distance) if distance else (difficulty,):
+        if MIN_DIFFICULTY <= level <= MAX_DIFFICULTY:
+          picked = self.draw_many((category, level), previous, 1, rng)
+          if picked:
+            return picked[0]
+    return None
+
+
+'''
+QuizIndex
+    in-memory index of question ids per category, used to draw quiz
+    questions without scanning the questions table.
+
+    Each category keeps an array of ids plus a map from id to its
+    position in the array, so adding and removing a question are both
+    O(1) (removal swaps the last id into the freed slot). Category 0
+    holds every question and backs the "All" quiz. The same arrays are
+    kept per (category, difficulty) pair for adaptive quizzes.
+
+    The index is built lazily from the database and rebuilt once it is
+    older than `max_age` seconds, which picks up questions written by
+    other worker processes.
+'''
+class QuizIndex(QuizSource):
+  def __init__(self, max_age=QUIZ_INDEX_MAX_AGE):
+    self.max_age = max_age
+    self.lock = threading.Lock()
+    self.clear()
+
+  def clear(self):
+    self.ids = {}
+    self.positions = {}
+    self.categories = {}
+    self.difficulties = {}
+    self.built_at = None
+
+  def build(self):
+    rows = db.session.query(Question.id, Question.category, Question.difficulty).all()
+
+    with self.lock:
+      self.clear()
+      for question_id, category, difficulty in rows:
+        self._add(question_id, category, difficulty)
+      self.built_at = time.monotonic()
+
+  def ensure_built(self):
+    if self.built_at is None or time.monotonic() - self.built_at > self.max_age:
+      self.build()
+
+  @staticmethod
+  def keys(category, difficulty):
+    return (category, ALL_CATEGORIES, (category, difficulty), (ALL_CATEGORIES, difficulty))
+
+  def _add(self, question_id, category, difficulty):
+    category = int(category)
+    difficulty = int(difficulty)
+    self.categories[question_id] = category
+    self.difficulties[question_id] = difficulty
+
+    for key in self.keys(category, difficulty):
+      ids = self.ids.setdefault(key, [])
+      self.positions.setdefault(key, {})[question_id] = len(ids)
+      ids.append(question_id)
+
+  def _remove(self, question_id):
+    category = self.categories.pop(question_id)
+    difficulty = self.difficulties.pop(question_id)
+
+    for key in self.keys(category, difficulty):
+      ids = self.ids[key]
+      positions = self.positions[key]
+      position = positions.pop(question_id)
+      last_id = ids.pop()
+      if last_id != question_id:
+        ids[position] = last_id
+        positions[last_id] = position
+
+  def add(self, question_id, category, difficulty):
+    with self.lock:
+      if self.built_at is not None and question_id not in self.categories:
+        self._add(question_id, category, difficulty)
+
+  def remove(self, question_id):
+    with self.lock:
+      if question_id in self.categories:
+        self._remove(question_id)
+
+  def size(self, category):
+    return len(self.ids.get(category, []))
+
+  def shuffled(self, category, rng=random):
+    self.ensure_built()
+
+    with self.lock:
+      ids = list(self.ids.get(category, []))
+
+    rng.shuffle(ids)
+    return ids
+
+  '''
+  draw_many(category, previous, count)
+      up to `count` distinct random unseen ids from `category`, see sample()
+  '''
+  def draw_many(self, category, previous, count, rng=random):
+    self.ensure_built()
+
+    with self.lock:
+      return sample(self.ids.get(category, []), previous, count, rng)
+
+  '''
+  load(question_ids)
+      the formatted questions for `question_ids` that still have a row,
+      by id, read with a single query by primary key
+  '''
+  def load(self, question_ids):
+    rows = question_rows(Question.query.filter(Question.id.in_(question_ids))).all()
+    return {row.id: format_question_row(row) for row in rows}
+
+
+quiz_index = QuizIndex()
+
+
+'''
+next_difficulty(difficulty, correct)
+    the difficulty to aim for after a question of `difficulty` was
+    answered: one level up after a correct answer, one down after a
+    wrong one, unchanged when `correct` is None
+'''
+def next_difficulty(difficulty, correct):
+  if correct is None:
+    return difficulty
+  step = 1 if correct else -1
+  return min(MAX_DIFFICULTY, max(MIN_DIFFICULTY, difficulty + step))
+
+
+'''
+quiz_source()
+    where quizzes draw from: the app's shared snapshot when one is
+    configured and built (see flaskr/snapshot.py), else quiz_index
+'''
+def quiz_source():
+  snapshot = current_app.extensions.get('snapshot')
+  current = snapshot.current() if snapshot is not None else None
+  return current if current is not None else quiz_index
+
+
+'''
+draw_question(category, previous, difficulty)
+    draws an unseen question, near `difficulty` when it is given, and
+    returns it formatted. Ids whose rows have disappeared (deleted by
+    another worker) are dropped from the index and the draw is retried.
+'''
+def draw_question(category, previous, rng=random, difficulty=None):
+  source = quiz_source()
+  excluded = set(previous)
+
+  while True:
+    if difficulty is None:
+      question_id = source.draw(category, excluded, rng)
+    else:
+      question_id = source.draw_near(category, difficulty, excluded, rng)
+    if question_id is None:
+      return None
+
+    found = source.load([question_id])
+    if question_id in found:
+      return found[question_id]
+
+    source.remove(question_id)
+    excluded.add(question_id)
+
+
+'''
+draw_questions(category, previous, count)
+    draws up to `count` distinct unseen questions and loads them in one
+    go, returned formatted in draw order. Ids whose rows have
+    disappeared are dropped from the index and replaced by further draws.
+'''
+def draw_questions(category, previous, count, rng=random):
+  source = quiz_source()
+  questions = []
+  excluded = set(previous)
+
+  while len(questions) < count:
+    question_ids = source.draw_many(category, excluded, count - len(questions), rng)
+    if not question_ids:
+      break
+
+    found = source.load(question_ids)
+
+    for question_id in question_ids:
+      excluded.add(question_id)
+      if question_id in found:
+        questions.append(found[question_id])
+      else:
+        source.remove(question_id)
+
+  return questions
+
+
+'''
+next_session_question(store, token)
+    pops ids off a quiz session until one still has a row. Raises
+    KeyError for unknown or expired sessions.
+'''
+def next_session_question(store, token):
+  while True:
+    question_id = store.pop(token)
+    if question_id is None:
+      return None
+
+    question = Question.query.get(question_id)
+    if question is not None:
+      return question
@@ -0,0 +1,91 @@
+import secrets
+import threading
+import time
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+
+QUIZ_SESSION_TTL = 60 * 60
+QUIZ_SESSION_MAX = 10000
+
+'''
+QuizSessionStore
+    interface for quiz session storage. A session is the remaining,
+    already shuffled, question ids of one game.
+
+    The default MemoryQuizSessionStore keeps sessions inside the worker
+    process. To share sessions between worker processes pass a subclass
+    implementing these three methods as the QUIZ_SESSION_STORE config
+    value of create_app.
+'''
+class QuizSessionStore(ABC):
+  @abstractmethod
+  def create(self, question_ids):
+    '''stores the ids and returns a new session token'''
+
+  @abstractmethod
+  def pop(self, token):
+    '''returns the next question id, None once the game is over,
+    raises KeyError for unknown or expired tokens'''
+
+  @abstractmethod
+  def delete(self, token):
+    '''forgets the session; unknown tokens are ignored'''
+
+
+'''
+MemoryQuizSessionStore
+    bounded in-process store. Ids are kept in compact arrays and handed
+    out from the end, so every turn is a constant-time pop. Sessions
+    expire `ttl` seconds after their last use and the least recently
+    used session is evicted once `max_sessions` are stored.
+'''
+class MemoryQuizSessionStore(QuizSessionStore):
+  def __init__(self, max_sessions=QUIZ_SESSION_MAX, ttl=QUIZ_SESSION_TTL):
+    self.max_sessions = max_sessions
+    self.ttl = ttl
+    self.sessions = OrderedDict()
+    self.lock = threading.Lock()
+
+  def __len__(self):
+    return len(self.sessions)
+
+  def create(self, question_ids):
+    token = secrets.token_urlsafe(16)
+    # reversed so popping from the end preserves the shuffled order
+    ids = array('q', reversed(question_ids))
+    now = time.monotonic()
+
+    with self.lock:
+      self.sessions[token] = (ids, now)
+
+      # drop expired sessions, then the least recently used ones
+      while self.sessions:
+        oldest = next(iter(self.sessions))
+        last_used = self.sessions[oldest][1]
+        if len(self.sessions) <= self.max_sessions and now - last_used <= self.ttl:
+          break
+        del self.sessions[oldest]
+
+    return token
+
+  def pop(self, token):
+    now = time.monotonic()
+
+    with self.lock:
+      ids, last_used = self.sessions[token]
+
+      if now - last_used > self.ttl:
+        del self.sessions[token]
+        raise KeyError(token)
+
+      self.sessions[token] = (ids, now)
+      self.sessions.move_to_end(token)
+
+      if len(ids) == 0:
+        return None
+      return ids.pop()
+
+  def delete(self, token):
+    with self.lock:
+      self.sessions.pop(token, None)
@@ -0,0 +1,127 @@
+import functools
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from flask import abort, current_app, g, request
+
+from models import pool_metrics
+
+# (tokens added per second, bucket size) for each limited endpoint,
+# counted per client address
+RATE_LIMITS = {
+  'create_question': (1.0, 20),
+  'delete_question': (1.0, 20),
+  'delete_questions': (1.0, 10),
+  'update_questions': (1.0, 10),
+  'play_quiz': (5.0, 50)
+}
+RATE_LIMIT_MAX_CLIENTS = 100000
+
+# limited endpoints are turned away while this many requests are queued
+# for a connection, or while recent pool waits average this many seconds
+ADMISSION_MAX_WAITING = 20
+ADMISSION_MAX_WAIT = 0.5
+ADMISSION_RETRY_AFTER = 1
+
+'''
+RateLimitStore
+    interface for token bucket storage. take(key, rate, burst) spends
+    one token from the bucket `key`, which holds at most `burst` tokens
+    and regains `rate` per second, and returns 0 when a token was
+    available, else the seconds until the next one.
+
+    The default MemoryRateLimitStore limits each worker process on its
+    own. To share the buckets between workers pass a subclass implementing
+    take() as the RATE_LIMIT_STORE config value of create_app.
+'''
+class RateLimitStore(ABC):
+  @abstractmethod
+  def take(self, key, rate, burst):
+    '''0 when a token was spent, else the seconds until the next one'''
+
+
+'''
+MemoryRateLimitStore
+    in-process buckets, each a (tokens, updated_at) pair refilled lazily
+    when it is next used. Holds at most `max_clients` buckets, dropping
+    the least recently used; a dropped bucket comes back full.
+'''
+class MemoryRateLimitStore(RateLimitStore):
+  def __init__(self, max_clients=RATE_LIMIT_MAX_CLIENTS):
+    self.max_clients = max_clients
+    self.buckets = OrderedDict()
+    self.lock = threading.Lock()
+
+  def __len__(self):
+    return len(self.buckets)
+
+  def take(self, key, rate, burst):
+    now = time.monotonic()
+
+    with self.lock:
+      tokens, updated_at = self.buckets.pop(key, (burst, now))
+      tokens = min(burst, tokens + (now - updated_at) * rate)
+
+      wait = 0
+      if tokens >= 1:
+        tokens -= 1
+      else:
+        wait = (1 - tokens) / rate
+
+      self.buckets[key] = (tokens, now)
+      if len(self.buckets) > self.max_clients:
+        self.buckets.popitem(last=False)
+
+    return wait
+
+
+def client_key():
+  # behind a proxy, wrap the app in werkzeug's ProxyFix so this is the client
+  return request.remote_addr or ''
+
+
+'''
+RateLimiter
+    limit(name) decorates a view so that, before it runs, the request is
+    turned away with 503 while the connection pool is overloaded, and
+    with 429 once the client's bucket for `name` is empty. Both set
+    g.retry_after for the Retry-After header.
+'''
+class RateLimiter:
+  def __init__(self, app):
+    self.enabled = app.config.get('RATE_LIMITING', True)
+    self.limits = dict(RATE_LIMITS, **app.config.get('RATE_LIMITS', {}))
+    self.store = app.config.get('RATE_LIMIT_STORE') or MemoryRateLimitStore(
+      app.config.get('RATE_LIMIT_MAX_CLIENTS', RATE_LIMIT_MAX_CLIENTS)
+    )
+
+  def admit(self):
+    config = current_app.config
+    if (
+      pool_metrics.waiting >= config.get('ADMISSION_MAX_WAITING', ADMISSION_MAX_WAITING)
+      or pool_metrics.recent_wait() >= config.get('ADMISSION_MAX_WAIT', ADMISSION_MAX_WAIT)
+    ):
+      g.retry_after = ADMISSION_RETRY_AFTER
+      abort(503)
+
+  def take(self, name):
+    rate, burst = self.limits[name]
+    wait = self.store.take('{}|{}'.format(name, client_key()), rate, burst)
+    if wait > 0:
+      g.retry_after = math.ceil(wait)
+      abort(429)
+
+  def limit(self, name):
+    def decorator(view):
+      @functools.wraps(view)
+      def wrapper(*args, **kwargs):
+        if self.enabled:
+          self.admit()
+          self.take(name)
+        return view(*args, **kwargs)
+
+      return wrapper
+    return decorator
@@ -0,0 +1,156 @@
+import functools
+import itertools
+import threading
+import time
+
+from flask import current_app, request
+from sqlalchemy import exc, text
+
+from models import db, replica_binds
+
+REPLICA_CHECK_INTERVAL = 5
+# seconds a Postgres standby may be behind the primary before it is skipped
+REPLICA_MAX_LAG = 10
+# after a write, the client's reads go to the primary for this many seconds
+REPLICA_STICKY_SECONDS = 5
+STICKY_COOKIE = 'trivia_last_write'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+REPLICA_LAG = text(
+  'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+  'ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+
+class Replica:
+  def __init__(self, bind):
+    self.bind = bind
+    self.healthy = True
+    self.checked_at = None
+
+
+'''
+ReplicaSet
+    the replica binds of an app, handed out round-robin by pick(). A
+    replica is health checked when first picked and then every
+    `check_interval` seconds: it must answer a query and, on Postgres,
+    be less than `max_lag` seconds behind. pick() skips unhealthy
+    replicas and returns None when none are left, meaning the primary.
+'''
+class ReplicaSet:
+  def __init__(self, app, binds, check_interval=REPLICA_CHECK_INTERVAL, max_lag=REPLICA_MAX_LAG):
+    self.app = app
+    self.replicas = [Replica(bind) for bind in binds]
+    self.check_interval = check_interval
+    self.max_lag = max_lag
+    self.counter = itertools.count()
+    self.lock = threading.Lock()
+
+  def __len__(self):
+    return len(self.replicas)
+
+  def check(self, replica):
+    engine = db.get_engine(self.app, bind=replica.bind)
+    try:
+      with engine.connect() as connection:
+        if engine.dialect.name == 'postgresql' and self.max_lag is not None:
+          lag = connection.scalar(REPLICA_LAG)
+          healthy = lag is None or lag <= self.max_lag
+        else:
+          healthy = connection.scalar(text('SELECT 1')) == 1
+    except exc.DBAPIError:
+      healthy = False
+
+    replica.healthy = healthy
+    replica.checked_at = time.monotonic()
+
+  def pick(self):
+    for _ in range(len(self.replicas)):
+      with self.lock:
+        replica = self.replicas[next(self.counter) % len(self.replicas)]
+      if replica.checked_at is None or time.monotonic() - replica.checked_at > self.check_interval:
+        self.check(replica)
+      if replica.healthy:
+        return replica.bind
+    return None
+
+  def mark_down(self, bind):
+    for replica in self.replicas:
+      if replica.bind == bind:
+        replica.healthy = False
+        replica.checked_at = time.monotonic()
+
+  def stats(self):
+    return {replica.bind: replica.healthy for replica in self.replicas}
+
+
+'''
+ReplicaRouter
+    read_only decorates a view whose database reads may be served by a
+    replica. Unless the client wrote within REPLICA_STICKY_SECONDS, the
+    request's session is pointed at the next healthy replica; when that
+    replica fails with an OperationalError it is marked down and the
+    view runs again on the primary.
+
+    Read-your-writes: any successful request with an unsafe method to a
+    view that is not read_only counts as a write, and the response sets
+    a cookie with its time, so stickiness holds across workers. Clients
+    that drop cookies may read their own writes late.
+
+    The in-process caches (counts, quiz and search indexes) may be
+    rebuilt from a replica, so they can lag by its replication delay on
+    top of their max_age.
+'''
+class ReplicaRouter:
+  def __init__(self, app):
+    config = app.config
+    self.replicas = ReplicaSet(
+      app,
+      replica_binds(app),
+      config.get('REPLICA_CHECK_INTERVAL', REPLICA_CHECK_INTERVAL),
+      config.get('REPLICA_MAX_LAG', REPLICA_MAX_LAG)
+    )
+    self.sticky_seconds = config.get('REPLICA_STICKY_SECONDS', REPLICA_STICKY_SECONDS)
+    app.extensions['replicas'] = self.replicas
+
+    if self.replicas:
+      app.after_request(self.remember_write)
+      app.teardown_request(self.release)
+
+  def sticky(self):
+    try:
+      last_write = float(request.cookies.get(STICKY_COOKIE, 0))
+    except ValueError:
+      return False
+    return time.time() - last_write < self.sticky_seconds
+
+  def remember_write(self, response):
+    view = current_app.view_functions.get(request.endpoint)
+    if request.method not in SAFE_METHODS and not getattr(view, 'read_only', False) and response.status_code < 400:
+      response.set_cookie(STICKY_COOKIE, '{:.3f}'.format(time.time()), max_age=self.sticky_seconds, httponly=True)
+    return response
+
+  def release(self, error=None):
+    db.session.info.pop('replica', None)
+
+  def read_only(self, view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+      if not self.replicas or self.sticky():
+        return view(*args, **kwargs)
+
+      replica = self.replicas.pick()
+      if replica is None:
+        return view(*args, **kwargs)
+
+      db.session.info['replica'] = replica
+      try:
+        return view(*args, **kwargs)
+      except exc.OperationalError:
+        self.replicas.mark_down(replica)
+        db.session.rollback()
+        db.session.info.pop('replica', None)
+        return view(*args, **kwargs)
+
+    wrapper.read_only = True
+    return wrapper
@@ -0,0 +1,176 @@
+import threading
+import time
+from bisect import bisect_left, insort
+
+from sqlalchemy import func
+
+from models import db, Question, question_rows, format_question_row
+from .pagination import QUESTIONS_PER_PAGE
+
+SEARCH_INDEX_MAX_AGE = 60
+SEARCH_COUNT_LIMIT = 1000
+
+
+def escape_like(term):
+  return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def trigrams(text):
+  text = text.lower()
+  return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def contains(postings, question_id):
+  position = bisect_left(postings, question_id)
+  return position < len(postings) and postings[position] == question_id
+
+
+'''
+TrigramIndex
+    in-process inverted index used for search when the database has no
+    trigram index (SQLite). Maps every three-character sequence of a
+    question to the sorted list of ids containing it; a search
+    intersects the postings of the term's trigrams, starting with the
+    shortest, and confirms each candidate with a substring check.
+
+    Like QuizIndex it is built lazily and rebuilt after `max_age`
+    seconds so other workers' writes show up.
+'''
+class TrigramIndex:
+  def __init__(self, max_age=SEARCH_INDEX_MAX_AGE):
+    self.max_age = max_age
+    self.lock = threading.Lock()
+    self.clear()
+
+  def clear(self):
+    self.postings = {}
+    self.texts = {}
+    self.built_at = None
+
+  def build(self):
+    rows = db.session.query(Question.id, Question.question).order_by(Question.id).all()
+
+    with self.lock:
+      self.clear()
+      for question_id, text in rows:
+        self._add(question_id, text)
+      self.built_at = time.monotonic()
+
+  def ensure_built(self):
+    if self.built_at is None or time.monotonic() - self.built_at > self.max_age:
+      self.build()
+
+  def _add(self, question_id, text):
+    text = text.lower()
+    self.texts[question_id] = text
+    for trigram in trigrams(text):
+      postings = self.postings.setdefault(trigram, [])
+      if postings and postings[-1] > question_id:
+        insort(postings, question_id)
+      else:
+        postings.append(question_id)
+
+  def add(self, question_id, text):
+    with self.lock:
+      if self.built_at is not None and question_id not in self.texts:
+        self._add(question_id, text)
+
+  def remove(self, question_id):
+    with self.lock:
+      text = self.texts.pop(question_id, None)
+      if text is None:
+        return
+      for trigram in trigrams(text):
+        postings = self.postings[trigram]
+        del postings[bisect_left(postings, question_id)]
+        if not postings:
+          del self.postings[trigram]
+
+  '''
+  search(term)
+      returns the ids of every question containing `term`, ranked
+      shortest question first (the closest match, as pg_trgm's
+      similarity would rank it) and then by id
+  '''
+  def search(self, term):
+    self.ensure_built()
+    term = term.lower()
+
+    with self.lock:
+      lists = sorted((self.postings.get(trigram, []) for trigram in trigrams(term)), key=len)
+
+      if lists:
+        shortest, others = lists[0], lists[1:]
+        candidates = [i for i in shortest if all(contains(postings, i) for postings in others)]
+      else:
+        # terms under three characters have no trigrams to look up
+        candidates = list(self.texts)
+
+      matches = [i for i in candidates if term in self.texts[i]]
+      matches.sort(key=lambda i: (len(self.texts[i]), i))
+
+    return matches
+
+
+trigram_index = TrigramIndex()
+
+
+'''
+SearchResult
+    one page of formatted questions and the number of matches.
+    On Postgres the count stops at SEARCH_COUNT_LIMIT, so it is exact
+    for small result sets and a lower bound for very broad terms.
+'''
+class SearchResult:
+  streamed = False
+
+  def __init__(self, questions, total_questions):
+    self.questions = questions
+    self.total_questions = total_questions
+
+
+def uses_trigram_index():
+  return db.engine.dialect.name == 'postgresql'
+
+
+def search_postgres(term, page, per_page):
+  # % and _ in the term are literal, as in the in-process search
+  matches = Question.query.filter(Question.question.ilike('%{}%'.format(escape_like(term)), escape='\\'))
+  rank = func.word_similarity(term, Question.question)
+
+  offset = (page - 1) * per_page
+  rows = question_rows(matches).order_by(rank.desc(), Question.id).offset(offset).limit(per_page).all()
+
+  capped = matches.with_entities(Question.id).limit(SEARCH_COUNT_LIMIT).subquery()
+  total_questions = db.session.query(func.count()).select_from(capped).scalar()
+
+  return SearchResult([format_question_row(row) for row in rows], total_questions)
+
+
+def search_in_process(term, page, per_page):
+  ids = trigram_index.search(term)
+
+  offset = (page - 1) * per_page
+  page_ids = ids[offset:offset + per_page]
+
+  rows = {}
+  if page_ids:
+    rows = {row.id: row for row in question_rows(Question.query.filter(Question.id.in_(page_ids)))}
+
+  questions = [format_question_row(rows[i]) for i in page_ids if i in rows]
+  return SearchResult(questions, len(ids))
+
+
+'''
+find_questions(term, page)
+    ranked, paginated substring search over question text, served by the
+    pg_trgm GIN index on Postgres and by the in-process TrigramIndex
+    elsewhere
+'''
+def find_questions(term, page=1, per_page=QUESTIONS_PER_PAGE):
+  search = search_postgres if uses_trigram_index() else search_in_process
+  result = search(term, max(page, 1), per_page)
+
+  if page < 1:
+    result.questions = []
+  return result
@@ -0,0 +1,72 @@
+'''
+JSON encoding for responses.
+
+Flask 1.0 has no pluggable JSON provider, and its jsonify always goes
+through the stdlib encoder class, sorting keys by default. The app uses
+the jsonify defined here instead. It encodes with the backend picked by
+the JSON_BACKEND config value:
+
+    'auto'    orjson when it is installed, else the stdlib (default)
+    'orjson'  orjson, failing at startup when it is missing
+    'stdlib'  json.dumps
+    a function taking the data and returning the encoded bytes
+
+Output is compact, unsorted and UTF-8 (no \\u escapes), which is the
+same JSON document Flask produced, and byte for byte the same across
+the two built-in backends. With JSONIFY_PRETTYPRINT_REGULAR set or in
+debug mode responses are left to flask.jsonify, which indents them.
+'''
+import json
+
+import flask
+from flask import current_app
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+
+def orjson_dumps(data):
+  return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+
+def stdlib_dumps(data, _dumps=json.dumps):
+  return _dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+BACKENDS = {'orjson': orjson_dumps, 'stdlib': stdlib_dumps}
+
+
+def init_json(app):
+  backend = app.config.get('JSON_BACKEND', 'auto')
+
+  if callable(backend):
+    encoder = backend
+  elif backend == 'auto':
+    encoder = orjson_dumps if orjson is not None else stdlib_dumps
+  elif backend == 'orjson' and orjson is None:
+    raise RuntimeError('JSON_BACKEND is orjson but the orjson package is not installed')
+  else:
+    encoder = BACKENDS[backend]
+
+  app.extensions['json_dumps'] = encoder
+
+
+'''
+dumps(data)
+    `data` encoded as JSON bytes with the current app's backend
+'''
+def dumps(data):
+  return current_app.extensions['json_dumps'](data)
+
+
+def jsonify(*args, **kwargs):
+  if args and kwargs:
+    raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+  data = args[0] if len(args) == 1 else (args or kwargs)
+
+  if current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug:
+    return flask.jsonify(data)
+
+  return current_app.response_class(dumps(data) + b'\n', mimetype=current_app.config['JSONIFY_MIMETYPE'])
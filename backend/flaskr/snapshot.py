@@ -0,0 +1,410 @@
+'''
+Shared question snapshot.
+
+Under gunicorn every worker keeps its own quiz index, built from the
+database at boot and again every QUIZ_INDEX_MAX_AGE seconds, so memory
+grows with the worker count. Even the copy inherited from a preloaded
+master is soon unshared, as reference counting writes to its pages.
+
+With SNAPSHOT_PATH (or TRIVIA_SNAPSHOT) set, the questions and
+categories are instead written to one versioned file. Every worker maps
+it read only and draws quiz questions straight from the mapping: the
+pages live once in the OS page cache, reads copy nothing into Python
+objects until a question is returned, and opening it takes no queries.
+
+File layout, native byte order, every section 8-byte aligned:
+
+    header         magic, format, group count, version, source, question
+                   count, length of the categories JSON
+    ids            int64[n]      question ids in id order
+    offsets        int64[n + 1]  where each question's JSON starts in the blob
+    by_category    int64[n]      ids ordered by (category, difficulty, id)
+    by_difficulty  int64[n]      ids ordered by (difficulty, id)
+    groups         int64[4 * g]  (category, difficulty, start, end) rows
+    blob           each question formatted as JSON, in id order
+    categories     the categories list as JSON
+
+A group row with difficulty 0 spans a whole category of by_category, one
+with category 0 (ALL_CATEGORIES) spans a difficulty of by_difficulty.
+
+The version is the time the tables were read, in nanoseconds. The
+source is a checksum of the tables (see source_version()), compared
+against the database every SNAPSHOT_VERIFY_INTERVAL seconds so writes
+made outside the app, or by another host, are picked up as well.
+
+A rebuild writes a new file next to the old one and renames it over the
+path, so readers see one version or the other, whole. Rebuilds hold a
+lock file, and a rebuild never replaces a file with a newer version.
+Readers stat the path at most every SNAPSHOT_CHECK_INTERVAL seconds and
+map the new file once it was replaced; mappings of the old one stay
+valid until dropped.
+'''
+import fcntl
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import click
+from flask.cli import with_appcontext
+from flask import current_app
+from sqlalchemy import func
+
+from models import db, Question, Category, question_rows, format_question_row, table_versions
+from .quiz import QuizSource, ALL_CATEGORIES, sample
+from .serialization import dumps, orjson
+
+MAGIC = b'TRIVSNAP'
+FORMAT = 2
+HEADER = struct.Struct('=8sIIQQQQ')
+SNAPSHOT_CHECK_INTERVAL = 1
+# how often a worker checks the snapshot against the database, like
+# QUIZ_INDEX_MAX_AGE for the in-process index
+SNAPSHOT_VERIFY_INTERVAL = 60
+# writes are batched: the rebuild starts this many seconds after the first one
+SNAPSHOT_REBUILD_DELAY = 1
+
+loads = orjson.loads if orjson is not None else json.loads
+
+
+def padding(length):
+  return -length % 8
+
+
+def runs(keys):
+  start = 0
+  for key, group in itertools.groupby(keys):
+    end = start + sum(1 for _ in group)
+    yield key, start, end
+    start = end
+
+
+'''
+source_version()
+    a 64-bit checksum of the questions and categories tables: row counts,
+    id sums and maxima and sums of the other columns (text by length).
+    Any insert or delete changes it, as do nearly all updates; writes
+    made through the app rebuild the snapshot regardless.
+'''
+def source_version():
+  questions = db.session.query(
+    func.count(Question.id),
+    func.max(Question.id),
+    func.sum(Question.id),
+    func.sum(Question.category * 8 + Question.difficulty),
+    func.sum(func.length(Question.question) * 1024 + func.length(Question.answer))
+  ).one()
+  categories = db.session.query(
+    func.count(Category.id), func.max(Category.id), func.sum(func.length(Category.type))
+  ).one()
+
+  values = ','.join(str(int(value or 0)) for value in tuple(questions) + tuple(categories))
+  return int.from_bytes(hashlib.sha1(values.encode('utf-8')).digest()[:8], 'little')
+
+
+'''
+snapshot_header(path)
+    the version and source of the snapshot file at `path`, or None when
+    there is no readable snapshot there
+'''
+def snapshot_header(path):
+  try:
+    with open(path, 'rb') as snapshot_file:
+      header = snapshot_file.read(HEADER.size)
+  except FileNotFoundError:
+    return None
+
+  if len(header) < HEADER.size:
+    return None
+  magic, file_format, _, version, source, _, _ = HEADER.unpack(header)
+  if magic != MAGIC or file_format != FORMAT:
+    return None
+  return {'version': version, 'source': source}
+
+
+@contextmanager
+def file_lock(path):
+  with open(path + '.lock', 'a') as lock_file:
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    yield
+
+
+'''
+write_snapshot(path, force)
+    writes the questions and categories tables to a new snapshot file
+    and atomically replaces `path` with it. Unless `force` is set
+    nothing is written while the file's source still matches the
+    database. A file with a newer version, written meanwhile by another
+    process, is never replaced. Returns the version now at `path`.
+    Needs an app context.
+'''
+def write_snapshot(path, force=True):
+  with file_lock(path):
+    source = source_version()
+    existing = snapshot_header(path)
+    if not force and existing is not None and existing['source'] == source:
+      return existing['version']
+
+    version = time.time_ns()
+    rows = question_rows().order_by(Question.id).all()
+    categories = [category.format() for category in Category.query.order_by(Category.id)]
+
+    fragments = [dumps(format_question_row(row)) for row in rows]
+    offsets = list(itertools.accumulate(map(len, fragments), initial=0))
+    by_category = sorted(rows, key=lambda row: (row.category, row.difficulty, row.id))
+    by_difficulty = sorted(rows, key=lambda row: (row.difficulty, row.id))
+
+    groups = []
+    for (category, difficulty), start, end in runs([(row.category, row.difficulty) for row in by_category]):
+      groups.append((category, difficulty, start, end))
+    for category, start, end in runs([row.category for row in by_category]):
+      groups.append((category, 0, start, end))
+    for difficulty, start, end in runs([row.difficulty for row in by_difficulty]):
+      groups.append((ALL_CATEGORIES, difficulty, start, end))
+
+    categories_json = dumps(categories)
+    blob = b''.join(fragments)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+    try:
+      with os.fdopen(handle, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, FORMAT, len(groups), version, source, len(rows), len(categories_json)))
+        out.write(array('q', [row.id for row in rows]).tobytes())
+        out.write(array('q', offsets).tobytes())
+        out.write(array('q', [row.id for row in by_category]).tobytes())
+        out.write(array('q', [row.id for row in by_difficulty]).tobytes())
+        out.write(array('q', [value for group in groups for value in group]).tobytes())
+        out.write(blob + b'\0' * padding(len(blob)))
+        out.write(categories_json)
+        out.flush()
+        os.fsync(out.fileno())
+
+      existing = snapshot_header(path)
+      if existing is not None and existing['version'] > version:
+        os.unlink(temp_path)
+        return existing['version']
+      os.replace(temp_path, path)
+    except BaseException:
+      if os.path.exists(temp_path):
+        os.unlink(temp_path)
+      raise
+
+  return version
+
+
+'''
+Snapshot
+    a mapped snapshot file. The id arrays are memoryviews into the
+    mapping; draw_many, load and shuffled follow QuizIndex, so quizzes
+    can draw from either. It is read only: remove() does nothing, and
+    questions deleted since the snapshot was written are served until
+    it is rebuilt.
+'''
+class Snapshot(QuizSource):
+  def __init__(self, path):
+    with open(path, 'rb') as snapshot_file:
+      self.stat = os.fstat(snapshot_file.fileno())
+      self.map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(self.map)
+    magic, file_format, group_count, self.version, self.source, count, categories_length = HEADER.unpack_from(view)
+    if magic != MAGIC or file_format != FORMAT:
+      raise ValueError('{} is not a format {} snapshot'.format(path, FORMAT))
+
+    position = HEADER.size
+    def int64s(length):
+      nonlocal position
+      section = view[position:position + length * 8].cast('q')
+      position += length * 8
+      return section
+
+    self.ids = int64s(count)
+    self.offsets = int64s(count + 1)
+    self.by_category = int64s(count)
+    self.by_difficulty = int64s(count)
+    groups = int64s(group_count * 4).tolist()
+
+    blob_length = self.offsets[count]
+    self.blob = view[position:position + blob_length]
+    position += blob_length + padding(blob_length)
+    self.categories_json = view[position:position + categories_length]
+
+    self.groups = {ALL_CATEGORIES: self.by_category}
+    for row in range(0, len(groups), 4):
+      category, difficulty, start, end = groups[row:row + 4]
+      if difficulty == 0:
+        self.groups[category] = self.by_category[start:end]
+      elif category == ALL_CATEGORIES:
+        self.groups[(ALL_CATEGORIES, difficulty)] = self.by_difficulty[start:end]
+      else:
+        self.groups[(category, difficulty)] = self.by_category[start:end]
+
+  def __len__(self):
+    return len(self.ids)
+
+  def size(self, category):
+    return len(self.groups.get(category, ()))
+
+  def draw_many(self, category, previous, count, rng=random):
+    return sample(self.groups.get(category, ()), previous, count, rng)
+
+  def shuffled(self, category, rng=random):
+    ids = list(self.groups.get(category, ()))
+    rng.shuffle(ids)
+    return ids
+
+  def load(self, question_ids):
+    found = {}
+    for question_id in question_ids:
+      position = bisect_left(self.ids, question_id)
+      if position < len(self.ids) and self.ids[position] == question_id:
+        found[question_id] = loads(bytes(self.blob[self.offsets[position]:self.offsets[position + 1]]))
+    return found
+
+  def remove(self, question_id):
+    pass
+
+  def categories(self):
+    return loads(bytes(self.categories_json))
+
+
+'''
+SharedSnapshot
+    the snapshot at `path` as seen by one worker. current() returns the
+    mapped Snapshot, remapping when the file was replaced, or None while
+    there is none yet.
+
+    Rebuilds run on a background thread. After a request that changed
+    the questions or categories tables in this worker one is forced,
+    SNAPSHOT_REBUILD_DELAY seconds later so a burst of writes costs one
+    rebuild. Every `verify_interval` seconds, starting with the first
+    use, the file's source is compared with the database and it is
+    rebuilt when they differ, which picks up a file left over from an
+    earlier run and writes made elsewhere.
+'''
+class SharedSnapshot:
+  def __init__(self, app, path, check_interval=SNAPSHOT_CHECK_INTERVAL, rebuild_delay=SNAPSHOT_REBUILD_DELAY,
+               verify_interval=SNAPSHOT_VERIFY_INTERVAL):
+    self.app = app
+    self.path = path
+    self.check_interval = check_interval
+    self.rebuild_delay = rebuild_delay
+    self.verify_interval = verify_interval
+    self.snapshot = None
+    self.checked_at = None
+    self.verified_at = None
+    self.lock = threading.Lock()
+    self.build_lock = threading.Lock()
+    self.timer = None
+    self.force = False
+    self.seen_versions = self.table_versions()
+
+  @staticmethod
+  def table_versions():
+    return (table_versions.get(Question.__tablename__), table_versions.get(Category.__tablename__))
+
+  def current(self):
+    now = time.monotonic()
+    if self.verified_at is None or now - self.verified_at >= self.verify_interval:
+      self.verified_at = now
+      self.schedule_rebuild(force=False, delay=0)
+    if self.checked_at is None or now - self.checked_at >= self.check_interval:
+      self.checked_at = now
+      self.reload()
+    return self.snapshot
+
+  def reload(self):
+    try:
+      stat = os.stat(self.path)
+    except FileNotFoundError:
+      self.snapshot = None
+      return
+
+    snapshot = self.snapshot
+    if snapshot is None or (stat.st_dev, stat.st_ino, stat.st_mtime_ns) != (
+      snapshot.stat.st_dev, snapshot.stat.st_ino, snapshot.stat.st_mtime_ns
+    ):
+      self.snapshot = Snapshot(self.path)
+
+  '''
+  rebuild(force)
+      writes the snapshot now; unless `force` is set, only when it is
+      missing or its source no longer matches the database
+  '''
+  def rebuild(self, force=True):
+    with self.build_lock, self.app.app_context():
+      write_snapshot(self.path, force=force)
+    self.checked_at = None
+
+  def ensure_built(self):
+    self.rebuild(force=False)
+    self.verified_at = time.monotonic()
+    return self.current()
+
+  def schedule_rebuild(self, force=True, delay=None):
+    with self.lock:
+      self.force = self.force or force
+      if self.timer is not None:
+        return
+      self.timer = threading.Timer(self.rebuild_delay if delay is None else delay, self.rebuild_in_background)
+      self.timer.daemon = True
+      self.timer.start()
+
+  def rebuild_in_background(self):
+    with self.lock:
+      force, self.force, self.timer = self.force, False, None
+    try:
+      self.rebuild(force)
+    except Exception:
+      self.app.logger.exception('rebuilding the snapshot at %s failed', self.path)
+
+  def after_request(self, response):
+    versions = self.table_versions()
+    if versions != self.seen_versions:
+      self.seen_versions = versions
+      self.schedule_rebuild()
+    return response
+
+
+'''
+init_snapshot(app)
+    returns the app's SharedSnapshot, also kept as
+    app.extensions['snapshot'], or None unless SNAPSHOT_PATH or
+    TRIVIA_SNAPSHOT names the file
+'''
+def init_snapshot(app):
+  path = app.config.get('SNAPSHOT_PATH', os.environ.get('TRIVIA_SNAPSHOT'))
+  if not path:
+    return None
+
+  shared = SharedSnapshot(
+    app,
+    path,
+    app.config.get('SNAPSHOT_CHECK_INTERVAL', SNAPSHOT_CHECK_INTERVAL),
+    app.config.get('SNAPSHOT_REBUILD_DELAY', SNAPSHOT_REBUILD_DELAY),
+    app.config.get('SNAPSHOT_VERIFY_INTERVAL', SNAPSHOT_VERIFY_INTERVAL)
+  )
+  app.extensions['snapshot'] = shared
+  app.after_request(shared.after_request)
+  return shared
+
+
+@click.command('snapshot')
+@with_appcontext
+def snapshot_command():
+  '''Write the shared question snapshot to SNAPSHOT_PATH.'''
+  shared = current_app.extensions.get('snapshot')
+  if shared is None:
+    raise click.UsageError('set SNAPSHOT_PATH or TRIVIA_SNAPSHOT to the snapshot file')
+  version = write_snapshot(shared.path)
+  click.echo('snapshot {} written to {}'.format(version, shared.path))
@@ -0,0 +1,58 @@
+'''
+Startup helpers for servers that fork workers from a preloaded app.
+
+With gunicorn's preload_app (see gunicorn.conf.py) the app is created
+once in the master. warm_up(app) then loads the category cache, the
+question counts and the in-memory indexes there, so every worker starts
+with them already built (shared copy-on-write) instead of each one
+querying the database on its first requests. after_fork(app) runs in
+each worker.
+'''
+import time
+
+from models import db, category_cache, question_counts, pool_metrics, table_versions
+from .quiz import quiz_index
+from .search import trigram_index, uses_trigram_index
+
+
+'''
+warm_up(app)
+    builds the caches and indexes the read endpoints use and closes the
+    connections that did it, so no connection is inherited by a forked
+    worker. Returns the seconds it took.
+'''
+def warm_up(app):
+  start = time.perf_counter()
+
+  with app.app_context():
+    category_cache.load()
+    question_counts.load()
+    snapshot = app.extensions.get('snapshot')
+    if snapshot is not None:
+      # workers map the snapshot file instead of building a quiz index
+      snapshot.ensure_built()
+    else:
+      quiz_index.ensure_built()
+    # Postgres searches use the trigram GIN index instead
+    if not uses_trigram_index():
+      trigram_index.ensure_built()
+    db.session.remove()
+    db.engine.dispose()
+
+  return time.perf_counter() - start
+
+
+'''
+after_fork(app)
+    resets per-process state in a new worker. The pool checks the pid of
+    every connection it hands out as well (see models.py), this only
+    makes sure the worker starts with an empty pool and its own metrics.
+    The worker also gets its own table_versions epoch: with the parent's
+    epoch and counters, two workers that each saw a different write
+    would send the same ETag for different bodies.
+'''
+def after_fork(app):
+  with app.app_context():
+    db.engine.dispose()
+  pool_metrics.reset()
+  table_versions.reset()
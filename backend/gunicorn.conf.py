@@ -0,0 +1,39 @@
+'''
+gunicorn settings for running the trivia API with several workers:
+
+    gunicorn -c gunicorn.conf.py 'flaskr:create_app()'
+
+The app is created and warmed up once in the master (preload_app), then
+forked into the workers, which start serving with the category cache,
+question counts and quiz index already built. The master's connections
+are closed before forking and each worker opens its own.
+
+Worker startup times are logged at info level.
+'''
+import multiprocessing
+import os
+import time
+
+from flaskr.startup import warm_up, after_fork
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+preload_app = True
+
+config_loaded_at = time.perf_counter()
+
+
+def when_ready(server):
+  app = server.app.wsgi()
+  loaded = time.perf_counter() - config_loaded_at
+  seconds = warm_up(app)
+  server.log.info('app loaded in %.1f ms, warmed up in %.1f ms', loaded * 1000, seconds * 1000)
+
+
+def post_fork(server, worker):
+  worker.forked_at = time.perf_counter()
+  after_fork(server.app.wsgi())
+
+
+def post_worker_init(worker):
+  worker.log.info('worker %s ready in %.1f ms', worker.pid, (time.perf_counter() - worker.forked_at) * 1000)
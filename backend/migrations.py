@@ -0,0 +1,203 @@
+'''
+Schema migrations for databases created before the current models.
+
+create_all only creates missing tables, it never changes existing ones,
+so databases set up with an older models.py are brought up to date
+here. Each migration is idempotent: it inspects the schema and only
+does what is missing, so it is safe on a database created from
+trivia.psql or a fresh create_all as well. Applied versions are kept in
+the schema_migrations table.
+
+    flask migrate [--batch-size N]
+
+Migrations run while the app keeps serving: long data changes are done
+in batches of short transactions and indexes are built concurrently on
+Postgres.
+'''
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import MetaData, Table, Column, Integer, String, inspect, select, text
+
+from models import db
+
+BACKFILL_BATCH_SIZE = 5000
+
+metadata = MetaData()
+schema_migrations = Table(
+  'schema_migrations', metadata,
+  Column('version', Integer, primary_key=True),
+  Column('name', String, nullable=False),
+  Column('applied_at', Integer, nullable=False)
+)
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+  def register(fn):
+    MIGRATIONS.append((version, name, fn))
+    MIGRATIONS.sort(key=lambda entry: entry[0])
+    return fn
+  return register
+
+
+def autocommit(engine):
+  # CREATE INDEX CONCURRENTLY and the batched backfill need every
+  # statement in its own transaction
+  connection = engine.connect()
+  if engine.dialect.name == 'postgresql':
+    connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+  return connection
+
+
+'''
+backfill(connection, statement, batch_size)
+    runs `statement` over the questions table in id ranges of
+    `batch_size` rows, one transaction per range, so row locks are only
+    held briefly. `statement` gets :low and :high bind parameters.
+'''
+def backfill(connection, statement, batch_size):
+  low = 0
+  while True:
+    high = connection.execute(text(
+      'SELECT max(id) FROM (SELECT id FROM questions WHERE id > :low ORDER BY id LIMIT :limit) AS batch'
+    ), low=low, limit=batch_size).scalar()
+    if high is None:
+      return
+    connection.execute(text(statement), low=low, high=high)
+    low = high
+
+
+'''
+1: category as an integer foreign key
+    Question.category used to be declared as a String, so databases
+    made with create_all have a varchar column compared against integer
+    category ids. On Postgres the column is rebuilt as an integer: a
+    shadow column kept in sync by a trigger is backfilled in batches,
+    then swapped in under a short lock. The foreign key is added NOT
+    VALID and validated separately, and the (category, id) index is
+    built concurrently. Other databases only get the index.
+'''
+@migration(1, 'category integer foreign key')
+def category_integer_foreign_key(engine, batch_size):
+  inspector = inspect(engine)
+  connection = autocommit(engine)
+
+  try:
+    if engine.dialect.name == 'postgresql':
+      column = next(column for column in inspector.get_columns('questions') if column['name'] == 'category')
+      if not isinstance(column['type'], Integer):
+        convert_category_column(engine, connection, batch_size)
+
+      if not any(key['constrained_columns'] == ['category'] for key in inspector.get_foreign_keys('questions')):
+        connection.execute(
+          'ALTER TABLE questions ADD CONSTRAINT category FOREIGN KEY (category) REFERENCES categories (id) '
+          'ON UPDATE CASCADE ON DELETE SET NULL NOT VALID'
+        )
+        connection.execute('ALTER TABLE questions VALIDATE CONSTRAINT category')
+
+      connection.execute(
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS questions_category_id_idx ON questions (category, id)'
+      )
+    else:
+      connection.execute('CREATE INDEX IF NOT EXISTS questions_category_id_idx ON questions (category, id)')
+  finally:
+    connection.close()
+
+
+def convert_category_column(engine, connection, batch_size):
+  connection.execute('ALTER TABLE questions ADD COLUMN IF NOT EXISTS category_id integer')
+  connection.execute(
+    'CREATE OR REPLACE FUNCTION questions_sync_category_id() RETURNS trigger AS $$ '
+    'BEGIN NEW.category_id := NEW.category::integer; RETURN NEW; END $$ LANGUAGE plpgsql'
+  )
+  connection.execute('DROP TRIGGER IF EXISTS questions_sync_category_id ON questions')
+  connection.execute(
+    'CREATE TRIGGER questions_sync_category_id BEFORE INSERT OR UPDATE OF category ON questions '
+    'FOR EACH ROW EXECUTE PROCEDURE questions_sync_category_id()'
+  )
+
+  backfill(
+    connection,
+    'UPDATE questions SET category_id = category::integer '
+    'WHERE id > :low AND id <= :high AND category_id IS NULL',
+    batch_size
+  )
+
+  # the autocommit connection cannot hold a transaction, the swap gets its own
+  with engine.begin() as swap:
+    swap.execute('LOCK TABLE questions IN ACCESS EXCLUSIVE MODE')
+    swap.execute('UPDATE questions SET category_id = category::integer WHERE category_id IS NULL')
+    swap.execute('DROP TRIGGER questions_sync_category_id ON questions')
+    swap.execute('DROP FUNCTION questions_sync_category_id()')
+    swap.execute('ALTER TABLE questions DROP COLUMN category')
+    swap.execute('ALTER TABLE questions RENAME COLUMN category_id TO category')
+    swap.execute('ALTER TABLE questions ALTER COLUMN category SET NOT NULL')
+
+
+'''
+2: trigram search index
+    Postgres search ranks with word_similarity and is served by a GIN
+    trigram index, both from the pg_trgm extension. Databases loaded
+    from an older trivia.psql, or whose tables were not made by
+    create_all, have neither. The index is built concurrently. Other
+    databases search with the in-process index and need nothing.
+'''
+@migration(2, 'trigram search index')
+def trigram_search_index(engine, batch_size):
+  if engine.dialect.name != 'postgresql':
+    return
+
+  connection = autocommit(engine)
+  try:
+    connection.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    connection.execute(
+      'CREATE INDEX CONCURRENTLY IF NOT EXISTS questions_question_trgm_idx '
+      'ON questions USING gin (question gin_trgm_ops)'
+    )
+  finally:
+    connection.close()
+
+
+def applied_versions(engine):
+  metadata.create_all(engine)
+  with engine.connect() as connection:
+    return {row.version for row in connection.execute(select([schema_migrations.c.version]))}
+
+
+def pending(engine):
+  applied = applied_versions(engine)
+  return [(version, name) for version, name, _ in MIGRATIONS if version not in applied]
+
+
+'''
+migrate(engine, batch_size)
+    applies every migration not yet recorded in schema_migrations, in
+    order, and returns the (version, name) pairs it applied
+'''
+def migrate(engine, batch_size=BACKFILL_BATCH_SIZE, log=None):
+  applied = applied_versions(engine)
+  done = []
+
+  for version, name, fn in MIGRATIONS:
+    if version in applied:
+      continue
+    if log is not None:
+      log('applying {}: {}'.format(version, name))
+    fn(engine, batch_size)
+    with engine.begin() as connection:
+      connection.execute(schema_migrations.insert(), version=version, name=name, applied_at=int(time.time()))
+    done.append((version, name))
+
+  return done
+
+
+@click.command('migrate')
+@click.option('--batch-size', default=BACKFILL_BATCH_SIZE, help='rows per backfill transaction')
+@with_appcontext
+def migrate_command(batch_size):
+  '''Bring the database schema up to date.'''
+  done = migrate(db.engine, batch_size, log=click.echo)
+  click.echo('{} migration(s) applied'.format(len(done)))
@@ -1,25 +1,303 @@
+import itertools
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
-import json
+import threading
+import time
+from collections import Counter
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, create_engine, event, exc, func, inspect, DDL
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import Pool, NullPool, QueuePool
+from flask import json
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
 
 database_name = "trivia"
-database_username = os.environ['DB_USER']
-database_password = os.environ['DB_PSWD']
-database_path = "postgres://{}:{}@{}/{}".format(database_username, database_password, 'localhost:5432', database_name)
 
-db = SQLAlchemy()
+'''
+default_database_path()
+    the Postgres url built from DB_USER and DB_PSWD. Read when an app
+    is set up rather than at import, so importing the models needs no
+    database configuration.
+'''
+def default_database_path():
+  try:
+    database_username = os.environ['DB_USER']
+    database_password = os.environ['DB_PSWD']
+  except KeyError as error:
+    raise RuntimeError('set {} or SQLALCHEMY_DATABASE_URI to configure the database'.format(error.args[0]))
+  return "postgres://{}:{}@{}/{}".format(database_username, database_password, 'localhost:5432', database_name)
+
+'''
+RoutingSession
+    sends the statements of a session to the read replica bind named in
+    session.info['replica'], when one is set, and everything else
+    (including flushes, so any ORM write) to the primary. flaskr/replicas.py
+    sets the replica for the length of a read-only request.
+'''
+class RoutingSession(SignallingSession):
+  def get_bind(self, mapper=None, clause=None):
+    replica = self.info.get('replica')
+    if replica is not None and not self._flushing:
+      return get_state(self.app).db.get_engine(self.app, bind=replica)
+    return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+  def create_session(self, options):
+    return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+'''
+PoolMetrics
+    counters for the connection pool: how often a connection was
+    checked out or opened, how long requests waited for one, how many
+    are waiting right now, and a moving average of recent waits that
+    halves every WAIT_HALF_LIFE seconds without checkouts
+'''
+WAIT_HALF_LIFE = 1.0
+
+class PoolMetrics:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    self.checkouts = 0
+    self.connects = 0
+    self.waits = 0
+    self.waiting = 0
+    self.wait_seconds = 0.0
+    self.max_wait_seconds = 0.0
+    self.average_wait = 0.0
+    self.average_updated_at = time.monotonic()
+
+  def start_wait(self):
+    with self.lock:
+      self.waiting += 1
+
+  def record_wait(self, seconds):
+    with self.lock:
+      self.waits += 1
+      self.waiting -= 1
+      self.wait_seconds += seconds
+      self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+      self.average_wait = self.recent_wait() * 0.9 + seconds * 0.1
+      self.average_updated_at = time.monotonic()
+
+  def recent_wait(self):
+    idle = time.monotonic() - self.average_updated_at
+    return self.average_wait * 0.5 ** (idle / WAIT_HALF_LIFE)
+
+
+pool_metrics = PoolMetrics()
+
+
+'''
+TimedQueuePool
+    QueuePool that records how long each checkout waited in pool_metrics
+'''
+class TimedQueuePool(QueuePool):
+  def _do_get(self):
+    pool_metrics.start_wait()
+    start = time.perf_counter()
+    try:
+      return super()._do_get()
+    finally:
+      pool_metrics.record_wait(time.perf_counter() - start)
+
+
+def env_flag(name, default):
+  value = os.environ.get(name)
+  if value is None:
+    return default
+  return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_int(name, default):
+  value = os.environ.get(name)
+  return default if value is None else int(value)
+
+
+def env_list(name):
+  return [value.strip() for value in os.environ.get(name, '').split(',') if value.strip()]
+
+
+'''
+PoolConfig
+    connection pool settings passed to setup_db. PoolConfig.from_env()
+    reads them from DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT (ms) and
+    DB_EXTERNAL_POOLER.
+
+    With external_pooler set (e.g. behind PgBouncer) connections are not
+    pooled in the process at all and are returned to the pooler as soon
+    as a request is done.
+'''
+class PoolConfig:
+  def __init__(self, pool_size=5, max_overflow=10, pool_timeout=30, pool_recycle=1800,
+               pool_pre_ping=True, statement_timeout=None, external_pooler=False):
+    self.pool_size = pool_size
+    self.max_overflow = max_overflow
+    self.pool_timeout = pool_timeout
+    self.pool_recycle = pool_recycle
+    self.pool_pre_ping = pool_pre_ping
+    self.statement_timeout = statement_timeout
+    self.external_pooler = external_pooler
+
+  @classmethod
+  def from_env(cls):
+    defaults = cls()
+    return cls(
+      pool_size=env_int('DB_POOL_SIZE', defaults.pool_size),
+      max_overflow=env_int('DB_MAX_OVERFLOW', defaults.max_overflow),
+      pool_timeout=env_int('DB_POOL_TIMEOUT', defaults.pool_timeout),
+      pool_recycle=env_int('DB_POOL_RECYCLE', defaults.pool_recycle),
+      pool_pre_ping=env_flag('DB_POOL_PRE_PING', defaults.pool_pre_ping),
+      statement_timeout=env_int('DB_STATEMENT_TIMEOUT', defaults.statement_timeout),
+      external_pooler=env_flag('DB_EXTERNAL_POOLER', defaults.external_pooler)
+    )
+
+  def engine_options(self, database_path):
+    url = make_url(database_path)
+    options = {'pool_pre_ping': self.pool_pre_ping}
+    connect_args = {}
+
+    if url.drivername.startswith('sqlite'):
+      if url.database in (None, '', ':memory:'):
+        # Flask-SQLAlchemy keeps in-memory databases on a single connection
+        return {}
+      connect_args['check_same_thread'] = False
+    elif self.statement_timeout is not None:
+      connect_args['options'] = '-c statement_timeout={}'.format(self.statement_timeout)
+
+    if self.external_pooler:
+      options['poolclass'] = NullPool
+    else:
+      options.update(
+        poolclass=TimedQueuePool,
+        pool_size=self.pool_size,
+        max_overflow=self.max_overflow,
+        pool_timeout=self.pool_timeout,
+        pool_recycle=self.pool_recycle
+      )
+
+    if connect_args:
+      options['connect_args'] = connect_args
+    return options
+
+
+'''
+pool_stats()
+    current state of the bound engine's pool plus the pool_metrics counters
+'''
+def pool_stats():
+  pool = db.engine.pool
+  stats = {
+    'checkouts': pool_metrics.checkouts,
+    'connects': pool_metrics.connects,
+    'waits': pool_metrics.waits,
+    'waiting': pool_metrics.waiting,
+    'wait_seconds': pool_metrics.wait_seconds,
+    'recent_wait_seconds': pool_metrics.recent_wait(),
+    'max_wait_seconds': pool_metrics.max_wait_seconds
+  }
+  if isinstance(pool, QueuePool):
+    stats.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+  return stats
+
+
+@event.listens_for(Pool, 'checkout')
+def count_checkout(dbapi_connection, connection_record, connection_proxy):
+  pool_metrics.checkouts += 1
+
+
+@event.listens_for(Pool, 'connect')
+def count_connect(dbapi_connection, connection_record):
+  pool_metrics.connects += 1
+
+
+# a connection opened before a fork must not be used by both processes:
+# connections remember the pid that opened them, and a checkout in any
+# other process discards it and makes the pool open a fresh one
+@event.listens_for(Pool, 'connect')
+def remember_pid(dbapi_connection, connection_record):
+  connection_record.info['pid'] = os.getpid()
+
+
+@event.listens_for(Pool, 'checkout')
+def check_pid(dbapi_connection, connection_record, connection_proxy):
+  if connection_record.info['pid'] != os.getpid():
+    connection_record.connection = connection_proxy.connection = None
+    raise exc.DisconnectionError('connection was opened in process {}'.format(connection_record.info['pid']))
+
 
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service. Tables are only
+    created when `create_tables` is set: the schema normally comes from
+    trivia.psql and `flask migrate`, and skipping create_all saves every
+    worker a round of schema introspection queries at boot.
+
+    `replica_paths` (default: the comma separated DB_REPLICAS) are read
+    replicas of the database, added as the binds replica_0, replica_1...
+    with the same pool settings as the primary.
 '''
-def setup_db(app, database_path=database_path):
+REPLICA_BIND = 'replica_{}'
+
+def setup_db(app, database_path=None, pool_config=None, create_tables=False, replica_paths=None):
+    database_path = database_path or default_database_path()
+    pool_config = pool_config or PoolConfig.from_env()
+    replica_paths = replica_paths if replica_paths is not None else env_list('DB_REPLICAS')
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+    app.config["SQLALCHEMY_BINDS"] = {
+      REPLICA_BIND.format(number): path for number, path in enumerate(replica_paths)
+    }
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = pool_config.engine_options(database_path)
     db.app = app
     db.init_app(app)
-    db.create_all()
+    if create_tables:
+        db.create_all(bind=None)
+
+
+def replica_binds(app):
+  binds = app.config.get('SQLALCHEMY_BINDS') or {}
+  return [bind for bind in binds if bind.startswith(REPLICA_BIND.format(''))]
+
+'''
+TableVersions
+    per-table write counters, bumped whenever rows of a table change.
+    Derived data such as HTTP ETags is keyed on these, so it can be
+    validated without querying the database. Counters live in the
+    process; `epoch` tells apart the counters of different processes.
+    A forked worker inherits its parent's epoch and must call reset().
+'''
+class TableVersions:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    with self.lock:
+      self.epoch = os.urandom(8).hex()
+      self.versions = {}
+      self.modified = {}
+      self.started_at = time.time()
+
+  def bump(self, table):
+    with self.lock:
+      self.versions[table] = self.versions.get(table, 0) + 1
+      self.modified[table] = time.time()
+
+  def get(self, table):
+    return self.versions.get(table, 0)
+
+  def last_modified(self, table):
+    return self.modified.get(table, self.started_at)
+
+
+table_versions = TableVersions()
 
 '''
 Question
@@ -27,11 +305,17 @@ Question
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  # category listings and quiz draws filter on category and page by id
+  __table_args__ = (Index('questions_category_id_idx', 'category', 'id'),)
 
   id = Column(Integer, primary_key=True)
   question = Column(String, nullable=False)
   answer = Column(String, nullable=False)
-  category = Column(String, nullable=False)
+  category = Column(
+    Integer,
+    ForeignKey('categories.id', name='category', onupdate='CASCADE', ondelete='SET NULL'),
+    nullable=False
+  )
   difficulty = Column(Integer, nullable=False)
 
   def __init__(self, question, answer, category, difficulty):
@@ -43,13 +327,16 @@ class Question(db.Model):
   def insert(self):
     db.session.add(self)
     db.session.commit()
+    table_versions.bump(self.__tablename__)
   
   def update(self):
     db.session.commit()
+    table_versions.bump(self.__tablename__)
 
   def delete(self):
     db.session.delete(self)
     db.session.commit()
+    table_versions.bump(self.__tablename__)
 
   def format(self):
     return {
@@ -60,6 +347,43 @@ class Question(db.Model):
       'difficulty': self.difficulty
     }
 
+'''
+Row projections
+    the read endpoints select just the formatted columns as plain rows
+    instead of hydrating Question objects, which skips the identity map
+    and attribute instrumentation. format_question_row(row) produces
+    exactly what Question.format() returns for the same row.
+'''
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+QUESTION_COLUMNS = tuple(getattr(Question, field) for field in QUESTION_FIELDS)
+
+def format_question_row(row, _fields=QUESTION_FIELDS, _zip=zip):
+  return dict(_zip(_fields, row))
+
+def question_rows(query=None):
+  query = query if query is not None else Question.query
+  return query.with_entities(*QUESTION_COLUMNS)
+
+'''
+Trigram search index
+    lets POST /questions/search use a GIN index on Postgres for both the
+    ILIKE '%term%' filter and word_similarity ranking. Other databases
+    fall back to the in-process index in flaskr/search.py.
+'''
+event.listen(
+  Question.__table__,
+  'after_create',
+  DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+event.listen(
+  Question.__table__,
+  'after_create',
+  DDL(
+    'CREATE INDEX IF NOT EXISTS questions_question_trgm_idx '
+    'ON questions USING gin (question gin_trgm_ops)'
+  ).execute_if(dialect='postgresql')
+)
+
 '''
 Category
 
@@ -77,4 +401,190 @@ class Category(db.Model):
     return {
       'id': self.id,
       'type': self.type
-    }
\ No newline at end of file
+    }
+
+
+'''
+CategoryCache
+    read-through cache of the categories table. Categories almost never
+    change, so the listing endpoints read them from here instead of the
+    database. Holds the formatted list, an id -> category map and the
+    list already encoded as JSON bytes.
+
+    Writes to Category rows invalidate it on commit (see the session
+    events below); entries also expire after `max_age` seconds so
+    changes made by other processes are picked up.
+'''
+CATEGORY_CACHE_MAX_AGE = 300
+
+class CategoryCache:
+  def __init__(self, max_age=CATEGORY_CACHE_MAX_AGE):
+    self.max_age = max_age
+    self.lock = threading.Lock()
+    self.entry = None
+    self.hits = 0
+    self.misses = 0
+
+  def load(self):
+    with self.lock:
+      entry = self.entry
+      if entry is not None and time.monotonic() - entry['loaded_at'] <= self.max_age:
+        self.hits += 1
+        return entry
+
+      self.misses += 1
+
+    rows = db.session.query(Category.id, Category.type).order_by(Category.id)
+    formatted = [{'id': category_id, 'type': category_type} for category_id, category_type in rows]
+    entry = {
+      'categories': formatted,
+      'by_id': {category['id']: category for category in formatted},
+      'json': json.dumps(formatted, separators=(',', ':')).encode('utf-8'),
+      'loaded_at': time.monotonic()
+    }
+
+    with self.lock:
+      self.entry = entry
+    return entry
+
+  def all(self):
+    return self.load()['categories']
+
+  def get(self, category_id):
+    return self.load()['by_id'].get(category_id)
+
+  def first(self):
+    categories = self.all()
+    return categories[0] if categories else None
+
+  def json(self):
+    return self.load()['json']
+
+  def invalidate(self):
+    with self.lock:
+      self.entry = None
+
+  def stats(self):
+    return {'hits': self.hits, 'misses': self.misses}
+
+
+category_cache = CategoryCache()
+
+
+@event.listens_for(Session, 'after_flush')
+def mark_category_writes(session, flush_context):
+  for instance in itertools.chain(session.new, session.dirty, session.deleted):
+    if isinstance(instance, Category):
+      session.info['categories_changed'] = True
+      return
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_category_cache(session):
+  if session.info.pop('categories_changed', False):
+    category_cache.invalidate()
+    table_versions.bump(Category.__tablename__)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_category_writes(session):
+  session.info.pop('categories_changed', None)
+
+
+'''
+QuestionCounts
+    number of questions per category, so listings can report totals
+    without counting rows. Loaded with one GROUP BY, then kept current
+    by the session events below: committed inserts, deletes and
+    category changes of Question rows adjust the counts, rolled back
+    ones do not. The counts are reloaded from the table every `max_age`
+    seconds, which reconciles them with writes made by other processes
+    and with any drift from a write that landed while they were loading.
+'''
+QUESTION_COUNTS_MAX_AGE = 60
+
+class QuestionCounts:
+  def __init__(self, max_age=QUESTION_COUNTS_MAX_AGE):
+    self.max_age = max_age
+    self.lock = threading.Lock()
+    self.counts = None
+    self.loaded_at = 0
+
+  def load(self):
+    with self.lock:
+      if self.counts is not None and time.monotonic() - self.loaded_at <= self.max_age:
+        return self.counts
+
+    rows = db.session.query(Question.category, func.count(Question.id)).group_by(Question.category)
+    counts = {category_key(category): count for category, count in rows}
+
+    with self.lock:
+      self.counts = counts
+      self.loaded_at = time.monotonic()
+    return counts
+
+  def get(self, category_id):
+    return self.load().get(category_id, 0)
+
+  def total(self):
+    return sum(self.load().values())
+
+  def all(self):
+    return self.load()
+
+  def apply(self, deltas):
+    with self.lock:
+      if self.counts is None:
+        return
+      # replaced rather than updated so readers never see a dict change size
+      counts = dict(self.counts)
+      for category, delta in deltas.items():
+        counts[category] = counts.get(category, 0) + delta
+      self.counts = counts
+
+  def invalidate(self):
+    with self.lock:
+      self.counts = None
+
+
+question_counts = QuestionCounts()
+
+
+def category_key(category):
+  try:
+    return int(category)
+  except (TypeError, ValueError):
+    return category
+
+
+@event.listens_for(Session, 'after_flush')
+def track_question_counts(session, flush_context):
+  deltas = Counter()
+  for instance in session.new:
+    if isinstance(instance, Question):
+      deltas[category_key(instance.category)] += 1
+  for instance in session.deleted:
+    if isinstance(instance, Question):
+      deltas[category_key(instance.category)] -= 1
+  for instance in session.dirty:
+    if isinstance(instance, Question):
+      history = inspect(instance).attrs.category.history
+      for category in history.deleted:
+        deltas[category_key(category)] -= 1
+      for category in history.added:
+        deltas[category_key(category)] += 1
+
+  if deltas:
+    session.info.setdefault('question_count_deltas', Counter()).update(deltas)
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_question_counts(session):
+  deltas = session.info.pop('question_count_deltas', None)
+  if deltas:
+    question_counts.apply(deltas)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_question_counts(session):
+  session.info.pop('question_count_deltas', None)
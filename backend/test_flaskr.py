@@ -1,10 +1,25 @@
+import asyncio
+import gzip
 import os
+import tempfile
 import unittest
 import json
+import flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine
+from werkzeug.http import http_date
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.asgi import AsyncTriviaApp
+from flaskr.quiz import quiz_index, ALL_CATEGORIES, QUIZ_MAX_COUNT
+from flaskr.snapshot import Snapshot, write_snapshot, HEADER as SNAPSHOT_HEADER
+from flaskr.startup import warm_up, after_fork
+from flaskr.compression import response_cache
+from flaskr.http_cache import time_bucket, ETAG_MAX_AGE
+from flaskr.serialization import BACKENDS, orjson
+from flaskr.bulk import ImportResult, flush
+from models import setup_db, db, question_rows, Question, Category, table_versions
+from migrations import migrate, pending
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -65,6 +80,59 @@ class TriviaTestCase(unittest.TestCase):
       self.assertTrue(len(data['categories']))
 
 
+    def test_get_categories_with_counts(self):
+      res = self.client().get('/categories?with_counts=1')
+      data = json.loads(res.data)
+
+      self.assertEqual(res.status_code, 200)
+      with self.app.app_context():
+        for category in data['categories']:
+          self.assertEqual(category['question_count'], Question.query.filter(Question.category == category['id']).count())
+        self.assertEqual(data['total_questions'], Question.query.count())
+
+
+    def test_category_counts_follow_create_and_delete(self):
+      before = json.loads(self.client().get('/categories/1/questions').data)['total_questions']
+
+      created = json.loads(self.client().post('/questions', json=self.new_question).data)['created']
+      after_create = json.loads(self.client().get('/categories/1/questions').data)['total_questions']
+
+      self.client().delete('/questions/{}'.format(created))
+      after_delete = json.loads(self.client().get('/categories/1/questions').data)['total_questions']
+
+      self.assertEqual(after_create, before + 1)
+      self.assertEqual(after_delete, before)
+
+
+    def explain(self, query):
+      with self.app.app_context():
+        sql = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+        if db.engine.dialect.name == 'postgresql':
+          # the test tables are tiny, make the planner show the index it would use on a real one
+          db.session.execute('SET LOCAL enable_seqscan = off')
+          rows = db.session.execute('EXPLAIN ' + sql).fetchall()
+        else:
+          rows = db.session.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+        db.session.rollback()
+      return '\n'.join(str(value) for row in rows for value in row)
+
+
+    def test_category_listing_uses_category_index(self):
+      with self.app.app_context():
+        query = question_rows(Question.query.filter(Question.category == 1)).order_by(Question.id).limit(10)
+      plan = self.explain(query)
+
+      self.assertIn('questions_category_id_idx', plan)
+
+
+    def test_category_count_uses_category_index(self):
+      with self.app.app_context():
+        query = Question.query.filter(Question.category == 1).with_entities(db.func.count(Question.id))
+      plan = self.explain(query)
+
+      self.assertIn('questions_category_id_idx', plan)
+
+
     def test_get_paginated_questions(self):
       res = self.client().get('/questions')
       data = json.loads(res.data.decode('utf-8'))
@@ -89,7 +157,61 @@ class TriviaTestCase(unittest.TestCase):
         second_page_first_question = second_page_questions[0]['question']
 
         self.assertNotEqual(first_page_first_question, second_page_first_question)
-      
+
+
+    def test_get_questions_with_cursor(self):
+      res = self.client().get('/questions')
+      data = json.loads(res.data.decode('utf-8'))
+
+      self.assertEqual(res.status_code, 200)
+      self.assertTrue(data['next_cursor'])
+
+      res2 = self.client().get('/questions?cursor=' + data['next_cursor'])
+      data2 = json.loads(res2.data.decode('utf-8'))
+
+      self.assertEqual(res2.status_code, 200)
+      self.assertEqual(data2['success'], True)
+      self.assertEqual(data2['total_questions'], data['total_questions'])
+      self.assertGreater(data2['questions'][0]['id'], data['questions'][-1]['id'])
+
+
+    def test_400_get_questions_with_invalid_cursor(self):
+      res = self.client().get('/questions?cursor=not-a-cursor')
+      data = json.loads(res.data.decode('utf-8'))
+
+      self.assertEqual(res.status_code, 400)
+      self.assertEqual(data['success'], False)
+      self.assertEqual(data['message'], 'Bad Request')
+
+
+    def test_get_questions_streamed(self):
+      res = self.client().get('/questions?per_page=5&stream=0')
+      data = json.loads(res.data.decode('utf-8'))
+
+      res2 = self.client().get('/questions?per_page=5&stream=1')
+      data2 = json.loads(res2.data.decode('utf-8'))
+
+      self.assertEqual(res2.status_code, 200)
+      self.assertNotIn('Content-Length', res2.headers)
+      self.assertEqual(data2, data)
+
+
+    def test_400_get_questions_with_invalid_page_size(self):
+      res = self.client().get('/questions?per_page=0')
+      data = json.loads(res.data.decode('utf-8'))
+
+      self.assertEqual(res.status_code, 400)
+      self.assertEqual(data['success'], False)
+      self.assertEqual(data['message'], 'Bad Request')
+
+
+    def test_listed_questions_match_question_format(self):
+      res = self.client().get('/categories/1/questions')
+      data = json.loads(res.data.decode('utf-8'))
+
+      for listed in data['questions']:
+        self.assertEqual(listed, Question.query.get(listed['id']).format())
+
 
     def test_404_sent_requesting_beyond_valid_page(self):
       res = self.client().get('/questions?page=1000')
@@ -100,6 +222,122 @@ class TriviaTestCase(unittest.TestCase):
       self.assertEqual(data['message'], 'Not Found')
 
 
+    def test_304_questions_not_modified(self):
+      res = self.client().get('/questions')
+      etag = res.headers['ETag']
+
+      self.assertEqual(res.status_code, 200)
+      self.assertTrue(etag)
+      self.assertIn('public', res.headers['Cache-Control'])
+
+      res2 = self.client().get('/questions', headers={'If-None-Match': etag})
+
+      self.assertEqual(res2.status_code, 304)
+      self.assertEqual(res2.headers['ETag'], etag)
+      self.assertEqual(res2.data, b'')
+
+
+    def test_if_modified_since_expires_with_etag_bucket(self):
+      bucket_start = time_bucket() * ETAG_MAX_AGE
+      res = self.client().get('/questions')
+
+      self.assertGreaterEqual(res.last_modified.timestamp(), bucket_start)
+
+      res2 = self.client().get('/questions', headers={'If-Modified-Since': res.headers['Last-Modified']})
+      self.assertEqual(res2.status_code, 304)
+
+      earlier = http_date(bucket_start - 1)
+      res3 = self.client().get('/questions', headers={'If-Modified-Since': earlier})
+      self.assertEqual(res3.status_code, 200)
+
+
+    def test_etag_changes_after_create_and_delete(self):
+      etag = self.client().get('/questions').headers['ETag']
+
+      res = self.client().post('/questions', json=self.new_question)
+      created = json.loads(res.data.decode('utf-8'))['created']
+
+      res2 = self.client().get('/questions', headers={'If-None-Match': etag})
+      etag2 = res2.headers['ETag']
+
+      self.assertEqual(res2.status_code, 200)
+      self.assertNotEqual(etag2, etag)
+
+      self.client().delete('/questions/' + str(created))
+      res3 = self.client().get('/questions', headers={'If-None-Match': etag2})
+
+      self.assertEqual(res3.status_code, 200)
+      self.assertNotEqual(res3.headers['ETag'], etag2)
+
+
+    def test_gzip_compressed_and_cached_listing(self):
+      res = self.client().get('/questions', headers={'Accept-Encoding': 'gzip'})
+      body = gzip.decompress(res.data)
+      data = json.loads(body)
+
+      self.assertEqual(res.status_code, 200)
+      self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+      self.assertIn('Accept-Encoding', res.headers['Vary'])
+      self.assertTrue(data['success'])
+
+      hits = response_cache.stats()['hits']
+      res = self.client().get('/questions', headers={'Accept-Encoding': 'gzip'})
+
+      self.assertEqual(response_cache.stats()['hits'], hits + 1)
+      self.assertEqual(gzip.decompress(res.data), body)
+
+
+    def test_compressed_response_has_its_own_etag(self):
+      plain = self.client().get('/questions')
+      compressed = self.client().get('/questions', headers={'Accept-Encoding': 'gzip'})
+
+      self.assertEqual(compressed.headers['ETag'], plain.headers['ETag'][:-1] + '-gzip"')
+
+      res = self.client().get('/questions', headers={
+        'Accept-Encoding': 'gzip',
+        'If-None-Match': compressed.headers['ETag']
+      })
+      self.assertEqual(res.status_code, 304)
+      self.assertEqual(res.headers['ETag'], compressed.headers['ETag'])
+
+      res = self.client().get('/questions', headers={'If-None-Match': compressed.headers['ETag']})
+      self.assertEqual(res.status_code, 200)
+      self.assertEqual(res.headers['ETag'], plain.headers['ETag'])
+
+
+    def test_small_responses_are_not_compressed(self):
+      res = self.client().get('/this/is/a/random/endpoint', headers={'Accept-Encoding': 'gzip'})
+
+      self.assertEqual(res.status_code, 404)
+      self.assertNotIn('Content-Encoding', res.headers)
+
+
+    def test_json_backends_match_flask_jsonify(self):
+      with self.app.test_request_context():
+        data = {
+          'success': True,
+          'questions': [question.format() for question in Question.query.limit(10)],
+          'current_category': None,
+          'note': 'caf\u00e9 \u2603'
+        }
+        expected = json.loads(flask.jsonify(data).get_data())
+
+        for name, dumps in BACKENDS.items():
+          if name == 'orjson' and orjson is None:
+            continue
+          self.assertEqual(json.loads(dumps(data)), expected)
+
+
+    def test_custom_json_backend(self):
+      app = create_app({'JSON_BACKEND': lambda data: b'{"custom":true}'})
+      setup_db(app, self.database_path)
+
+      res = app.test_client().get('/this/is/a/random/endpoint')
+
+      self.assertEqual(res.status_code, 404)
+      self.assertEqual(json.loads(res.data), {'custom': True})
+
+
     def test_delete_question(self):
       question_id = 2
       res = self.client().delete('/questions/' + str(question_id))
@@ -120,7 +358,7 @@ class TriviaTestCase(unittest.TestCase):
       self.assertEqual(data2['success'], False)
       self.assertEqual(data2['message'], 'Not Found')
 
-    
+
     def test_404_question_to_delete_not_found(self):
       question_id = 10000
       res = self.client().delete('/questions/' + str(question_id))
@@ -143,7 +381,162 @@ class TriviaTestCase(unittest.TestCase):
       self.assertTrue(data['created'])
       # Making sure question is created by searching for it in the test below
 
-    
+
+    def test_bulk_create_questions_ndjson(self):
+      lines = [
+        json.dumps(self.new_question),
+        json.dumps(self.new_question_empty_answer),
+        'not json'
+      ]
+      res = self.client().post('/questions/bulk', data='\n'.join(lines), content_type='application/x-ndjson')
+      data = json.loads(res.data.decode('utf-8'))
+
+      self.assertEqual(res.status_code, 200)
+      self.assertEqual(data['success'], True)
+      self.assertEqual(data['inserted'], 1)
+      self.assertEqual(data['error_count'], 2)
+      self.assertEqual([error['line'] for error in data['errors']], [2, 3])
+
+
+    def test_bulk_create_questions_csv(self):
+      rows = 'question,answer,difficulty,category\nWhat is 2 + 2?,4,1,1\nWhat is 3 + 3?,6,1,1000\n'
+      res = self.client().post('/questions/bulk', data=rows, content_type='text/csv')
+      data = json.loads(res.data.decode('utf-8'))
+
+      self.assertEqual(res.status_code, 200)
+      self.assertEqual(data['inserted'], 1)
+      self.assertEqual(data['errors'][0]['line'], 3)
+
+
+    def test_bulk_create_questions_rejects_out_of_range_values(self):
+      lines = [
+        json.dumps(dict(self.new_question, difficulty=99999999999999999999999)),
+        json.dumps(dict(self.new_question, difficulty=6)),
+        json.dumps(dict(self.new_question, category=99999999999999999999999))
+      ]
+      res = self.client().post('/questions/bulk', data='\n'.join(lines), content_type='application/x-ndjson')
+      data = json.loads(res.data.decode('utf-8'))
+
+      self.assertEqual(res.status_code, 200)
+      self.assertEqual(data['inserted'], 0)
+      self.assertEqual([error['line'] for error in data['errors']], [1, 2, 3])
+
+
+    def test_bulk_create_retries_failed_batch_row_by_row(self):
+      good = dict(self.new_question, question='Which row survives the retry?')
+      bad = dict(self.new_question, question=None)
+      result = ImportResult()
+
+      with self.app.app_context():
+        flush([(1, good), (2, bad)], result)
+        Question.query.filter(Question.question == good['question']).delete()
+        db.session.commit()
+
+      self.assertEqual(result.inserted, 1)
+      self.assertEqual([error['line'] for error in result.errors], [2])
+
+
+    def test_415_bulk_create_questions_unsupported_type(self):
+      res = self.client().post('/questions/bulk', data='<questions/>', content_type='application/xml')
+      data = json.loads(res.data.decode('utf-8'))
+
+      self.assertEqual(res.status_code, 415)
+      self.assertEqual(data['success'], False)
+      self.assertEqual(data['message'], 'Unsupported Media Type')
+
+
+    def test_export_questions(self):
+      res = self.client().get('/questions/export')
+      lines = res.data.decode('utf-8').splitlines()
+      total_questions = json.loads(self.client().get('/questions').data.decode('utf-8'))['total_questions']
+
+      self.assertEqual(res.status_code, 200)
+      self.assertEqual(res.mimetype, 'application/x-ndjson')
+      self.assertEqual(len(lines), total_questions)
+      self.assertTrue(json.loads(lines[0])['question'])
+
+
+    def test_batch_update_and_delete_questions_by_filter(self):
+      for answer in ('Stripes', 'Spots'):
+        self.client().post('/questions', json=dict(self.new_question, question='Which zebra_crossing is this?', answer=answer))
+      selection = {'filter': {'searchTerm': 'ZEBRA_CROSSING', 'category': 1}}
+
+      res = self.client().patch('/questions', json=dict(selection, set={'difficulty': 2, 'answer': 'Both'}))
+      data = json.loads(res.data.decode('utf-8'))
+
+      self.assertEqual(res.status_code, 200)
+      self.assertEqual(data['updated'], 2)
+      search = json.loads(self.client().post('/questions/search', json={'searchTerm': 'zebra_crossing'}).data.decode('utf-8'))
+      self.assertEqual({(question['difficulty'], question['answer']) for question in search['questions']}, {(2, 'Both')})
+
+      # LIKE wildcards in the search term are matched literally
+      res = self.client().delete('/questions', json={'filter': {'searchTerm': 'zebra%crossing'}})
+      self.assertEqual(json.loads(res.data.decode('utf-8'))['deleted'], 0)
+
+      res = self.client().delete('/questions', json=selection)
+      data = json.loads(res.data.decode('utf-8'))
+
+      self.assertEqual(res.status_code, 200)
+      self.assertEqual(data['deleted'], 2)
+      search = json.loads(self.client().post('/questions/search', json={'searchTerm': 'zebra_crossing'}).data.decode('utf-8'))
+      self.assertEqual(search['questions'], [])
+
+
+    def test_batch_delete_questions_by_ids(self):
+      ids = [
+        json.loads(self.client().post('/questions', json=self.new_question).data.decode('utf-8'))['created']
+        for _ in range(3)
+      ]
+      total_questions = json.loads(self.client().get('/questions').data.decode('utf-8'))['total_questions']
+
+      res = self.client().delete('/questions', json={'ids': ids + [100000]})
+      data = json.loads(res.data.decode('utf-8'))
+
+      self.assertEqual(res.status_code, 200)
+      self.assertEqual(data['deleted'], 3)
+      self.assertEqual(json.loads(self.client().get('/questions').data.decode('utf-8'))['total_questions'], total_questions - 3)
+      self.assertEqual(self.client().delete('/questions/' + str(ids[0])).status_code, 404)
+
+
+    def test_400_batch_questions_invalid_selection(self):
+      bodies = [
+        {},
+        {'filter': {}},
+        {'ids': []},
+        {'ids': ['1']},
+        {'ids': [1], 'filter': {'category': 1}},
+        {'filter': {'answer': 'Stripes'}}
+      ]
+      for body in bodies:
+        self.assertEqual(self.client().delete('/questions', json=body).status_code, 400)
+
+      for fields in ({}, {'id': 1}, {'category': 1000}, {'question': ''}):
+        res = self.client().patch('/questions', json={'ids': [1], 'set': fields})
+        self.assertEqual(res.status_code, 400)
+
+
+    def test_400_batch_update_invalid_body_or_values(self):
+      for kwargs in ({}, {'data': 'not json', 'content_type': 'text/plain'}, {'json': [{'ids': [1]}]}):
+        self.assertEqual(self.client().patch('/questions', **kwargs).status_code, 400)
+
+      for fields in ({'difficulty': 10 ** 20}, {'difficulty': 0}, {'category': 10 ** 20}):
+        res = self.client().patch('/questions', json={'ids': [1], 'set': fields})
+        self.assertEqual(res.status_code, 400)
+
+
+    def test_503_writes_shed_while_pool_is_saturated(self):
+      app = create_app({'ADMISSION_MAX_WAITING': 0})
+      setup_db(app, self.database_path)
+
+      res = app.test_client().post('/questions', json=self.new_question)
+      data = json.loads(res.data)
+
+      self.assertEqual(res.status_code, 503)
+      self.assertEqual(data['message'], 'Service Unavailable')
+      self.assertIn('Retry-After', res.headers)
+      self.assertEqual(app.test_client().get('/questions').status_code, 200)
+
+
     def test_search_for_questions(self):
       res = self.client().post('/questions/search', json={'searchTerm': self.new_question['question'] })
       data = json.loads(res.data.decode('utf-8'))
@@ -155,6 +548,35 @@ class TriviaTestCase(unittest.TestCase):
       self.assertTrue(data['current_category'])
 
 
+    def test_search_for_questions_ignores_case(self):
+      res = self.client().post('/questions/search', json={'searchTerm': 'title'})
+      data = json.loads(res.data.decode('utf-8'))
+
+      res2 = self.client().post('/questions/search', json={'searchTerm': 'TiTlE'})
+      data2 = json.loads(res2.data.decode('utf-8'))
+
+      self.assertEqual(res2.status_code, 200)
+      self.assertTrue(data['total_questions'])
+      self.assertEqual(data2['total_questions'], data['total_questions'])
+      self.assertEqual(data2['questions'], data['questions'])
+
+
+    def test_search_for_questions_matches_wildcards_literally(self):
+      res = self.client().post('/questions/search', json={'searchTerm': '%'})
+      data = json.loads(res.data.decode('utf-8'))
+
+      self.assertEqual(res.status_code, 200)
+      self.assertEqual(data['total_questions'], 0)
+
+
+    def test_400_search_term_not_a_string(self):
+      res = self.client().post('/questions/search', json={'searchTerm': 123})
+      data = json.loads(res.data.decode('utf-8'))
+
+      self.assertEqual(res.status_code, 400)
+      self.assertEqual(data['success'], False)
+
+
     def test_405_question_creation_not_allowed(self):
       # Can't post to route /questions/$id
       res = self.client().post('/questions/1000', json=self.new_question)
@@ -174,7 +596,7 @@ class TriviaTestCase(unittest.TestCase):
       self.assertEqual(data['success'], False)
       self.assertEqual(data['message'], 'Unprocessable Entity')
 
-    
+
     def test_400_question_creation_string_in_integer_values(self):
       # Can't create question with string in integer values (difficulty & category id)
       res = self.client().post('/questions', json=self.new_question_string_in_integer_values)
@@ -203,7 +625,7 @@ class TriviaTestCase(unittest.TestCase):
       self.assertEqual(res.status_code, 404)
       self.assertEqual(data['success'], False)
       self.assertEqual(data['message'], 'Not Found')
-    
+
 
     def test_404_unavailable_random_endpoint(self):
       res = self.client().get('/this/is/a/random/endpoint')
@@ -228,7 +650,53 @@ class TriviaTestCase(unittest.TestCase):
       self.assertEqual(res.status_code, 200)
       self.assertEqual(data['success'], True)
       self.assertTrue(data['question'])
-    
+
+
+    def test_play_trivia_quiz_skips_previous_questions(self):
+      res = self.client().get('/categories/1/questions')
+      category_ids = [question['id'] for question in json.loads(res.data.decode('utf-8'))['questions']]
+
+      quiz_data = {
+        'previous_questions': category_ids[1:],
+        'quiz_category': {
+          'id': 1,
+          'type': 'Science'
+        }
+      }
+      res = self.client().post('/quizzes', json=quiz_data)
+      data = json.loads(res.data.decode('utf-8'))
+
+      self.assertEqual(res.status_code, 200)
+      self.assertEqual(data['question']['id'], category_ids[0])
+
+      # once every question was played there is nothing left to draw
+      quiz_data['previous_questions'] = category_ids
+      res = self.client().post('/quizzes', json=quiz_data)
+      data = json.loads(res.data.decode('utf-8'))
+
+      self.assertEqual(res.status_code, 200)
+      self.assertEqual(data['question'], None)
+
+
+    def test_play_quiz_with_count(self):
+      with self.app.app_context():
+        played = Question.query.filter(Question.category == 1).first().id
+        available = Question.query.filter(Question.category == 1).count() - 1
+
+      res = self.client().post('/quizzes', json={
+        'previous_questions': [played],
+        'quiz_category': {'id': 1, 'type': 'Science'},
+        'count': 50
+      })
+      data = json.loads(res.data)
+      ids = [question['id'] for question in data['questions']]
+
+      self.assertEqual(res.status_code, 200)
+      self.assertEqual(len(ids), available)
+      self.assertEqual(len(set(ids)), len(ids))
+      self.assertNotIn(played, ids)
+      self.assertTrue(all(question['category'] == 1 for question in data['questions']))
+
 
     def test_404_play_quiz_with_unavailable_cateogry(self):
       quiz_data = {
@@ -244,7 +712,7 @@ class TriviaTestCase(unittest.TestCase):
       self.assertEqual(res.status_code, 404)
       self.assertEqual(data['success'], False)
       self.assertEqual(data['message'], 'Not Found')
-    
+
 
     def test_400_play_quiz_with_string_in_place_of_list(self):
       quiz_data = {
@@ -262,6 +730,125 @@ class TriviaTestCase(unittest.TestCase):
       self.assertEqual(data['message'], 'Bad Request')
 
 
+    def test_400_play_quiz_with_invalid_count(self):
+      res = self.client().post('/quizzes', json={
+        'previous_questions': [],
+        'quiz_category': {'id': 1, 'type': 'Science'},
+        'count': 51
+      })
+
+      self.assertEqual(res.status_code, 400)
+
+
+    def test_429_play_quiz_rate_limited(self):
+      app = create_app({'RATE_LIMITS': {'play_quiz': (0.01, 2)}})
+      setup_db(app, self.database_path)
+      body = {'previous_questions': [], 'quiz_category': {'id': 1, 'type': 'Science'}}
+
+      statuses = [app.test_client().post('/quizzes', json=body).status_code for _ in range(2)]
+      res = app.test_client().post('/quizzes', json=body)
+      data = json.loads(res.data)
+
+      self.assertEqual(statuses, [200, 200])
+      self.assertEqual(res.status_code, 429)
+      self.assertEqual(data['message'], 'Too Many Requests')
+      self.assertEqual(res.headers['Retry-After'], '100')
+
+
+    def test_adaptive_quiz_moves_up_after_correct_answer(self):
+      with self.app.app_context():
+        question = Question.query.filter(Question.difficulty > 1).first()
+        category, difficulty = question.category, question.difficulty
+
+      res = self.client().post('/quizzes', json={
+        'previous_questions': [],
+        'quiz_category': {'id': category},
+        'difficulty': difficulty - 1,
+        'last_answer_correct': True
+      })
+      data = json.loads(res.data)
+
+      self.assertEqual(res.status_code, 200)
+      self.assertEqual(data['difficulty'], difficulty)
+      self.assertEqual(data['question']['difficulty'], difficulty)
+      self.assertEqual(data['question']['category'], category)
+
+
+    def test_adaptive_quiz_widens_band_when_level_is_played(self):
+      with self.app.app_context():
+        question = Question.query.first()
+        category, difficulty = question.category, question.difficulty
+        played = [row.id for row in Question.query.filter(
+          Question.category == category, Question.difficulty == difficulty)]
+        remaining = Question.query.filter(Question.category == category).count() - len(played)
+
+      res = self.client().post('/quizzes', json={
+        'previous_questions': played,
+        'quiz_category': {'id': category},
+        'difficulty': difficulty
+      })
+      data = json.loads(res.data)
+
+      self.assertEqual(res.status_code, 200)
+      if remaining:
+        self.assertNotEqual(data['question']['difficulty'], difficulty)
+        self.assertEqual(data['question']['category'], category)
+      else:
+        self.assertIsNone(data['question'])
+
+
+    def test_400_adaptive_quiz_invalid_difficulty(self):
+      res = self.client().post('/quizzes', json={
+        'previous_questions': [],
+        'quiz_category': {'id': 1},
+        'difficulty': 6
+      })
+
+      self.assertEqual(res.status_code, 400)
+
+
+    def test_400_adaptive_quiz_with_count(self):
+      res = self.client().post('/quizzes', json={
+        'previous_questions': [],
+        'quiz_category': {'id': 1},
+        'difficulty': 3,
+        'count': 5
+      })
+
+      self.assertEqual(res.status_code, 400)
+
+
+    def test_play_quiz_session(self):
+      res = self.client().post('/quizzes/sessions', json={'quiz_category': {'id': 1, 'type': 'Science'}})
+      data = json.loads(res.data.decode('utf-8'))
+
+      self.assertEqual(res.status_code, 200)
+      self.assertEqual(data['success'], True)
+      self.assertTrue(data['token'])
+      self.assertTrue(data['total_questions'])
+
+      played = []
+      for _ in range(data['total_questions'] + 1):
+        res2 = self.client().post('/quizzes/sessions/' + data['token'] + '/next')
+        data2 = json.loads(res2.data.decode('utf-8'))
+        self.assertEqual(res2.status_code, 200)
+        if data2['question'] is None:
+          break
+        played.append(data2['question']['id'])
+
+      self.assertEqual(data2['question'], None)
+      self.assertEqual(len(played), len(set(played)))
+
+
+    def test_404_quiz_session_not_found(self):
+      res = self.client().post('/quizzes/sessions/not-a-token/next')
+      data = json.loads(res.data.decode('utf-8'))
+
+      self.assertEqual(res.status_code, 404)
+      self.assertEqual(data['success'], False)
+      self.assertEqual(data['message'], 'Not Found')
+
+
     def test_405_method_get_not_allowed_for_quizzes_endpoint(self):
       res = self.client().get('/quizzes')
       data = json.loads(res.data.decode('utf-8'))
@@ -271,6 +858,275 @@ class TriviaTestCase(unittest.TestCase):
       self.assertEqual(data['message'], 'Method Not Allowed')
 
 
+    def test_snapshot_matches_database(self):
+      path = os.path.join(tempfile.mkdtemp(), 'questions.snapshot')
+
+      with self.app.app_context():
+        write_snapshot(path)
+        snapshot = Snapshot(path)
+        questions = Question.query.order_by(Question.id).all()
+        category = questions[0].category
+
+        self.assertEqual(len(snapshot), len(questions))
+        self.assertEqual(snapshot.load([questions[0].id, 100000]), {questions[0].id: questions[0].format()})
+        self.assertEqual(snapshot.categories(), [category.format() for category in Category.query.order_by(Category.id)])
+        self.assertEqual(
+          sorted(snapshot.shuffled(category)),
+          [question.id for question in questions if question.category == category]
+        )
+        self.assertEqual(
+          snapshot.size((ALL_CATEGORIES, questions[0].difficulty)),
+          len([question for question in questions if question.difficulty == questions[0].difficulty])
+        )
+
+
+    def test_quiz_draws_from_rebuilt_snapshot(self):
+      path = os.path.join(tempfile.mkdtemp(), 'questions.snapshot')
+      app = create_app({'SNAPSHOT_PATH': path, 'SNAPSHOT_CHECK_INTERVAL': 0})
+      setup_db(app, self.database_path)
+      shared = app.extensions['snapshot']
+      version = shared.ensure_built().version
+      client = app.test_client()
+
+      created = json.loads(client.post('/questions', json=dict(self.new_question, category=6)).data)['created']
+      # the write scheduled a rebuild; run it now instead of after the delay
+      self.assertIsNotNone(shared.timer)
+      shared.timer.cancel()
+      shared.rebuild_in_background()
+
+      res = client.post('/quizzes', json={'previous_questions': [], 'quiz_category': {'id': 6}, 'count': QUIZ_MAX_COUNT})
+      data = json.loads(res.data)
+
+      self.assertGreater(shared.current().version, version)
+      self.assertIn(created, [question['id'] for question in data['questions']])
+
+
+    def test_stale_snapshot_rebuilt_at_startup(self):
+      path = os.path.join(tempfile.mkdtemp(), 'questions.snapshot')
+      with self.app.app_context():
+        question = Question(question='Left in an old snapshot?', answer='Yes', difficulty=1, category=1)
+        question.insert()
+        question_id = question.id
+        write_snapshot(path)
+        # deleted behind the app's back, as with psql
+        db.session.execute(Question.__table__.delete().where(Question.id == question_id))
+        db.session.commit()
+
+      app = create_app({'SNAPSHOT_PATH': path})
+      setup_db(app, self.database_path)
+      with app.app_context():
+        snapshot = app.extensions['snapshot'].ensure_built()
+
+      self.assertEqual(snapshot.load([question_id]), {})
+
+
+    def test_snapshot_never_replaced_by_older_version(self):
+      path = os.path.join(tempfile.mkdtemp(), 'questions.snapshot')
+      with self.app.app_context():
+        write_snapshot(path)
+        with open(path, 'r+b') as snapshot_file:
+          header = list(SNAPSHOT_HEADER.unpack(snapshot_file.read(SNAPSHOT_HEADER.size)))
+          header[3] = 2 ** 63
+          snapshot_file.seek(0)
+          snapshot_file.write(SNAPSHOT_HEADER.pack(*header))
+
+        self.assertEqual(write_snapshot(path), 2 ** 63)
+        self.assertEqual(Snapshot(path).version, 2 ** 63)
+
+
+    def test_get_quiz_pack_is_reproducible_and_cacheable(self):
+      packs_dir = tempfile.mkdtemp()
+      app = create_app({'PACKS_DIR': packs_dir})
+      setup_db(app, self.database_path)
+      path = '/quizzes/packs?category=1&count=2&seed=finals'
+      app.test_cli_runner().invoke(args=['packs', '--category', '1', '--count', '2', '--seed', 'finals'])
+
+      res = app.test_client().get(path)
+      data = json.loads(res.data)
+      again = app.test_client().get(path, headers={'Accept-Encoding': 'gzip'})
+
+      self.assertEqual(res.status_code, 200)
+      self.assertEqual(data['count'], len(data['questions']))
+      self.assertTrue(all(question['category'] == 1 for question in data['questions']))
+      self.assertEqual(again.headers['Content-Encoding'], 'gzip')
+      self.assertEqual(json.loads(gzip.decompress(again.data)), data)
+      self.assertIn(res.headers['ETag'].strip('"'), os.listdir(packs_dir))
+      self.assertEqual(again.headers['ETag'], res.headers['ETag'][:-1] + '-gzip"')
+
+      res = app.test_client().get(path, headers={'If-None-Match': res.headers['ETag']})
+      self.assertEqual(res.status_code, 304)
+
+
+    def test_quiz_pack_version_changes_with_category(self):
+      packs_dir = tempfile.mkdtemp()
+      app = create_app({'PACKS_DIR': packs_dir})
+      setup_db(app, self.database_path)
+      client = app.test_client()
+      path = '/quizzes/packs?category=4&count=50'
+      app.test_cli_runner().invoke(args=['packs', '--category', '4', '--count', '50'])
+
+      version = json.loads(client.get(path).data)['version']
+      client.post('/questions', json=dict(self.new_question, category=4))
+      data = json.loads(client.get(path).data)
+
+      self.assertNotEqual(data['version'], version)
+      self.assertEqual(len([name for name in os.listdir(packs_dir) if not name.startswith('.')]), 2)
+
+
+    def test_400_quiz_pack_without_count(self):
+      res = self.client().get('/quizzes/packs?category=1')
+      self.assertEqual(res.status_code, 400)
+
+      res = self.client().get('/quizzes/packs?category=1000&count=5')
+      self.assertEqual(res.status_code, 404)
+
+
+    def test_404_quiz_pack_not_built(self):
+      packs_dir = tempfile.mkdtemp()
+      app = create_app({'PACKS_DIR': packs_dir})
+      setup_db(app, self.database_path)
+
+      res = app.test_client().get('/quizzes/packs?category=1&count=2&seed=unplanned')
+
+      self.assertEqual(res.status_code, 404)
+      self.assertEqual(os.listdir(packs_dir), [])
+
+
+    def test_packs_command_builds_packs(self):
+      packs_dir = tempfile.mkdtemp()
+      app = create_app({'PACKS_DIR': packs_dir})
+      setup_db(app, self.database_path)
+
+      result = app.test_cli_runner().invoke(args=['packs', '--category', '1', '--category', '2', '--count', '3'])
+
+      self.assertEqual(result.exit_code, 0)
+      self.assertEqual(len(os.listdir(packs_dir)), 4)
+
+
+    def replica_app(self, replica_path):
+      app = create_app({'DB_REPLICAS': [replica_path]})
+      setup_db(app, self.database_path, replica_paths=[replica_path])
+      return app
+
+
+    def test_read_only_routes_use_replica_until_client_writes(self):
+      handle, replica_file = tempfile.mkstemp(suffix='.db')
+      os.close(handle)
+      replica = create_engine('sqlite:///' + replica_file)
+      db.Model.metadata.create_all(replica)
+      replica.execute(Category.__table__.insert(), id=1, type='Science')
+      replica.execute(Question.__table__.insert(), question='Only on the replica?', answer='Yes', difficulty=1, category=1)
+
+      app = self.replica_app('sqlite:///' + replica_file)
+      client = app.test_client()
+
+      lines = client.get('/questions/export').data.decode('utf-8').splitlines()
+      self.assertEqual([json.loads(line)['question'] for line in lines], ['Only on the replica?'])
+
+      res = client.post('/questions', json=self.new_question)
+      self.assertIn('trivia_last_write', res.headers['Set-Cookie'])
+
+      # read-your-writes: this client now reads from the primary
+      lines = client.get('/questions/export').data.decode('utf-8').splitlines()
+      self.assertIn(json.loads(res.data)['created'], [json.loads(line)['id'] for line in lines])
+      lines = app.test_client().get('/questions/export').data.decode('utf-8').splitlines()
+      self.assertEqual(len(lines), 1)
+      os.remove(replica_file)
+
+
+    def test_unhealthy_replica_falls_back_to_primary(self):
+      app = self.replica_app('sqlite:////nonexistent/replica.db')
+      client = app.test_client()
+
+      lines = client.get('/questions/export').data.decode('utf-8').splitlines()
+      metrics = client.get('/metrics').data.decode('utf-8')
+
+      self.assertTrue(len(lines) > 1)
+      self.assertIn('trivia_db_replica_healthy{bind="replica_0"} 0', metrics)
+
+
+    def test_asgi_app_serves_same_routes(self):
+      asgi_app = AsyncTriviaApp(self.app, max_concurrency=2)
+      messages = []
+
+      async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+      async def send(message):
+        messages.append(message)
+
+      async def get(path):
+        await asgi_app({
+          'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+          'path': path, 'root_path': '', 'query_string': b'', 'headers': []
+        }, receive, send)
+
+      asyncio.run(get('/categories'))
+      asyncio.run(get('/this/is/a/random/endpoint'))
+
+      statuses = [message['status'] for message in messages if message['type'] == 'http.response.start']
+      body = b''.join(message.get('body', b'') for message in messages if message['type'] == 'http.response.body')
+
+      self.assertEqual(statuses, [200, 404])
+      self.assertIn(b'"categories"', body)
+      self.assertIn(b'"Not Found"', body)
+
+
+    def test_profiling_reports_server_timing_and_metrics(self):
+      app = create_app({'PROFILING': True})
+      setup_db(app, self.database_path)
+      client = app.test_client
+      response_cache.clear()
+
+      res = client().get('/questions')
+      timings = res.headers.getlist('Server-Timing')
+
+      self.assertEqual(res.status_code, 200)
+      self.assertTrue(timings[0].startswith('app;dur='))
+      self.assertTrue(timings[1].startswith('db;dur='))
+      self.assertNotIn('"0 queries"', timings[1])
+
+      res = client().get('/metrics')
+      text = res.get_data(as_text=True)
+
+      self.assertEqual(res.status_code, 200)
+      self.assertIn('trivia_request_duration_seconds_count{route="/questions",method="GET"} 1', text)
+      self.assertIn('trivia_category_cache_hits_total', text)
+
+
+    def test_profiling_disabled_by_default(self):
+      res = self.client().get('/categories')
+
+      self.assertEqual(res.status_code, 200)
+      self.assertNotIn('Server-Timing', res.headers)
+
+
+    def test_migrations_are_applied_once(self):
+      with self.app.app_context():
+        migrate(db.engine)
+
+        self.assertEqual(pending(db.engine), [])
+        self.assertEqual(migrate(db.engine), [])
+
+
+    def test_warm_up_builds_indexes(self):
+      quiz_index.clear()
+      warm_up(self.app)
+
+      with self.app.app_context():
+        self.assertEqual(quiz_index.size(ALL_CATEGORIES), Question.query.count())
+
+
+    def test_after_fork_gives_worker_its_own_table_versions(self):
+      self.client().post('/questions', json=self.new_question)
+      epoch = table_versions.epoch
+
+      after_fork(self.app)
+
+      self.assertNotEqual(table_versions.epoch, epoch)
+      self.assertEqual(table_versions.get(Question.__tablename__), 0)
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file